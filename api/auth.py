@@ -8,15 +8,15 @@ router = APIRouter(prefix="/api/auth", tags=["auth"])
 
 
 @router.post("/login", response_model=LoginResponse)
-def login(response: Response, req: LoginRequest):
-    login_data = login_service(response, req)
+async def login(response: Response, req: LoginRequest):
+    login_data = await login_service(response, req)
     return login_data
 
 
 
 @router.get("/logout", response_model=LogoutResponse)
-def logout(response: Response, user=Depends(current_user_from_cookies), access_token: str = Cookie(None), refresh_token: str = Cookie(None)):
-    return logout_service(response, access_token, refresh_token)
+async def logout(response: Response, user=Depends(current_user_from_cookies), access_token: str = Cookie(None), refresh_token: str = Cookie(None)):
+    return await logout_service(response, access_token, refresh_token)
 
 
 
@@ -1,25 +1,43 @@
-from fastapi import APIRouter, Depends, Response, Cookie
+from fastapi import APIRouter, Depends, Request, Response, Cookie
 from dto.auth_dto import  MeResponse, Widget, MultiRpcRequest
 from Deps.auth import current_user_from_cookies
 from services.config_service import me_service, get_widget_data, post_widget
+from services.catalog_cache import etag_matches
+from core.redis_client import redis_metrics
 
 
 
 router = APIRouter(prefix="/api/pre", tags=["pre"])
+# routes d'exploitation, montées par main.py seulement si REDIS_METRICS_ENDPOINT=1
+internal_router = APIRouter(prefix="/internal", tags=["internal"])
 
 @router.get("/config/me", response_model=MeResponse)
-def me(user=Depends(current_user_from_cookies)):
-    me_data = me_service(user)
+async def me(request: Request, response: Response, user=Depends(current_user_from_cookies)):
+    me_data, etag = await me_service(user)
+    # revalidation à chaque chargement de page : 304 sans corps si rien n'a changé
+    headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        # on repart de la réponse injectée : les Set-Cookie posés par un refresh de token ne doivent pas être perdus
+        not_modified = Response(status_code=304, headers=headers)
+        not_modified.raw_headers.extend(
+            (name, value) for name, value in response.raw_headers if name != b"content-length"
+        )
+        return not_modified
+    response.headers.update(headers)
     return me_data
 
 
 @router.post("/{module}/widgets")
-def get_widgets(response: Response, req: MultiRpcRequest, user=Depends(current_user_from_cookies)):
-    me_data = get_widget_data(response, req)
+async def get_widgets(response: Response, req: MultiRpcRequest, user=Depends(current_user_from_cookies)):
+    me_data = await get_widget_data(response, req)
     return me_data
 
 @router.post("/config/me/{module}/widgets")
-def post_widgets(module: str, response: Response, req: list[Widget], user=Depends(current_user_from_cookies)):
-    me_data = post_widget(response, req, user, module=module)
+async def post_widgets(module: str, response: Response, req: list[Widget], user=Depends(current_user_from_cookies)):
+    me_data = await post_widget(response, req, user, module=module)
     return me_data
 
+
+@internal_router.get("/metrics/redis")
+async def redis_command_metrics(user=Depends(current_user_from_cookies)):
+    return redis_metrics.snapshot()
@@ -0,0 +1,112 @@
+# benchmarks/stock_backend.py
+"""
+Parité et temps du backend NumPy des KPI/séries stock
+(services/stock/vectorized.py) contre les fonctions Python d'origine.
+
+    python -m benchmarks.stock_backend [n_mouvements]
+
+Chaque RPC de VECTORIZED_RPCS est exécutée avec les deux backends, sur
+ColumnarTable et sur listes de dicts, pour plusieurs jeux de params ; toute
+sortie différente est affichée et le code retour vaut 1.
+"""
+from __future__ import annotations
+import json
+import random
+import sys
+import time
+from datetime import date, timedelta
+
+from services.table_store import ColumnarTable
+from services.stock import chart, kpi
+from services.stock.vectorized import VECTORIZED_RPCS, np
+
+PARAMS = [
+    {},
+    {"start_date": "2025-06-01", "end_date": "2025-09-30"},
+    {"start_date": "2024-10-01", "end_date": "2025-09-30", "entrepot_id": 2},
+    {"end_date": "2025-08-15", "cout_ratio": 0.55, "couts_logistiques": 120.0},
+]
+
+
+def _tables(n: int):
+    rnd = random.Random(7)
+    base = date(2025, 9, 30)
+    day = lambda lo, hi: (base - timedelta(days=rnd.randint(lo, hi))).isoformat()
+    n_prod, n_stock, n_cmd = 400, 2000, max(1000, n // 20)
+    types = ["Entrée", "Sortie", "Sortie client", "ajustement", "perte", "transfert", None]
+    return {
+        "produit": [{"id": i, "prix": round(rnd.uniform(0.5, 90), 2)} for i in range(1, n_prod + 1)],
+        "stock": [
+            {"id": i, "produit_id": rnd.randint(1, n_prod), "entrepot_id": rnd.randint(1, 4),
+             "quantitedisponible": rnd.randint(-5, 900), "quantitereserve": rnd.choice([None, rnd.randint(0, 80)])}
+            for i in range(1, n_stock + 1)
+        ],
+        "mouvement_stock": [
+            {"id": i, "stock_id": rnd.randint(1, n_stock), "entrepot_id": rnd.choice([None, 1, 2]),
+             "typemouvement": rnd.choice(types), "quantite": round(rnd.uniform(-20, 200), 3),
+             "datemouvement": day(0, 500)}
+            for i in range(1, n + 1)
+        ],
+        "commandeclient": [
+            {"id": i, "date_reelle_livraison": rnd.choice([None, day(0, 400)])} for i in range(1, n_cmd + 1)
+        ],
+        "lignecommande": [
+            {"id": i, "commande_id": rnd.randint(1, n_cmd), "produit_id": rnd.randint(1, n_prod),
+             "quantite_commandee": rnd.randint(1, 40), "prix_unitaire": round(rnd.uniform(1, 120), 2)}
+            for i in range(1, 3 * n_cmd + 1)
+        ],
+        "peremption": [
+            {"id": i, "stock_id": rnd.randint(1, n_stock), "produit_id": rnd.randint(1, n_prod),
+             "dateexpiration": (base + timedelta(days=rnd.randint(-20, 200))).isoformat(),
+             "quantite": rnd.randint(0, 60)}
+            for i in range(1, n_stock + 1)
+        ],
+    }
+
+
+def _reference(fn):
+    return getattr(kpi, fn.__name__, None) or getattr(chart, fn.__name__)
+
+
+def _call(fn, tables, params):
+    names = fn.__code__.co_varnames[:fn.__code__.co_argcount]
+    return fn(tables, **{k: v for k, v in params.items() if k in names})
+
+
+def _timed(fn, tables, params):
+    t0 = time.perf_counter()
+    out = _call(fn, tables, params)
+    return out, (time.perf_counter() - t0) * 1000
+
+
+def main(n: int) -> int:
+    if np is None:
+        print("numpy n'est pas installé : rien à comparer")
+        return 1
+    rows = _tables(n)
+    layouts = {"columnar": {k: ColumnarTable.from_rows(v) for k, v in rows.items()}, "dicts": rows}
+
+    mismatches = 0
+    totals = {}
+    for layout, tables in layouts.items():
+        for name, fn in VECTORIZED_RPCS.items():
+            for params in PARAMS:
+                expected, t_py = _timed(_reference(fn), tables, params)
+                got, t_np = _timed(fn, tables, params)
+                if json.dumps(expected, sort_keys=True) != json.dumps(got, sort_keys=True):
+                    mismatches += 1
+                    print(f"DIFF {layout} {name} {params}\n  python={str(expected)[:160]}\n  numpy ={str(got)[:160]}")
+                if layout == "columnar":
+                    py, vec = totals.get(name, (0.0, 0.0))
+                    totals[name] = (py + t_py, vec + t_np)
+
+    print(f"{n} mouvements synthétiques, {len(PARAMS)} jeux de params (ColumnarTable)")
+    print(f"{'rpc':<36}{'python (ms)':>14}{'numpy (ms)':>14}")
+    for name, (py, vec) in totals.items():
+        print(f"{name:<36}{py:>14.1f}{vec:>14.1f}")
+    print(f"{mismatches} sortie(s) différente(s)")
+    return 1 if mismatches else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(int(sys.argv[1]) if len(sys.argv) > 1 else 100_000))
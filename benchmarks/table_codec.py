@@ -0,0 +1,88 @@
+# benchmarks/table_codec.py
+"""
+Micro-benchmark du cache Redis des tables : ancien chemin JSON (liste de
+dicts, decode_responses=True) contre le format binaire de services/table_codec.py.
+
+    python -m benchmarks.table_codec [n_lignes]
+
+Avec REDIS_BENCH_URL défini, la mémoire Redis réelle (MEMORY USAGE) des deux
+formats est aussi mesurée (clés bench:* supprimées à la fin).
+"""
+from __future__ import annotations
+import json
+import os
+import random
+import sys
+import time
+from datetime import date, timedelta
+
+from services.table_store import ColumnarTable
+from services.table_codec import encode_table, decode_table
+
+
+def _rows(n: int):
+    rnd = random.Random(42)
+    base = date(2025, 1, 1)
+    types = ["Entrée", "Sortie", "Sortie client", "ajustement", "perte"]
+    return [
+        {
+            "id": i,
+            "stock_id": rnd.randint(1, 5000),
+            "entrepot_id": rnd.randint(1, 8),
+            "typemouvement": rnd.choice(types),
+            "quantite": rnd.randint(-20, 200),
+            "prix_unitaire": round(rnd.uniform(0.5, 90), 2),
+            "datemouvement": (base + timedelta(days=rnd.randint(0, 700))).isoformat(),
+            "commentaire": None if rnd.random() < 0.8 else f"lot {rnd.randint(1, 999)}",
+        }
+        for i in range(1, n + 1)
+    ]
+
+
+def _best(fn, repeat: int = 5) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - t0)
+    return best * 1000
+
+
+def main(n: int) -> None:
+    rows = _rows(n)
+    table = ColumnarTable.from_rows(rows)
+
+    json_blob = json.dumps(rows)
+    bin_blob = encode_table(table)
+    raw_blob = encode_table(table, compress=False)
+
+    results = [
+        ("json (liste de dicts)", len(json_blob.encode()),
+         _best(lambda: json.dumps(rows)),
+         _best(lambda: ColumnarTable.from_rows(json.loads(json_blob.encode().decode())))),
+        ("binaire", len(raw_blob),
+         _best(lambda: encode_table(table, compress=False)),
+         _best(lambda: decode_table(raw_blob))),
+        ("binaire + zlib", len(bin_blob),
+         _best(lambda: encode_table(table)),
+         _best(lambda: decode_table(bin_blob))),
+    ]
+
+    print(f"{n} lignes mouvement_stock synthétiques")
+    print(f"{'format':<24}{'taille (Ko)':>12}{'encode (ms)':>14}{'decode (ms)':>14}")
+    for name, size, enc, dec in results:
+        print(f"{name:<24}{size / 1024:>12.1f}{enc:>14.1f}{dec:>14.1f}")
+
+    url = os.getenv("REDIS_BENCH_URL")
+    if url:
+        import redis
+        client = redis.from_url(url, decode_responses=False)
+        client.set("bench:json", json_blob)
+        client.set("bench:bin", bin_blob)
+        print(f"Redis MEMORY USAGE json={client.memory_usage('bench:json')} o, "
+              f"binaire={client.memory_usage('bench:bin')} o")
+        client.delete("bench:json", "bench:bin")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 200_000)
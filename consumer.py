@@ -1,31 +1,165 @@
+from collections import defaultdict
 from kafka import KafkaConsumer
-import redis
 import json
-
-# Redis synchrone
-redis_client = redis.Redis(host="localhost", port=6379, db=0, decode_responses=True)
+import time
+from services.table_store import ColumnarTable
+from services.table_cache import TABLE_RECONCILE_TTL, slice_of
+from services.table_codec import encode_table, decode_table, read_blobs_with_heads, write_blob, delete_blob, remaining_ttl
+from services.rollups import apply_rollup_events, rollups_due
+# Redis synchrone (REDIS_URL) ; redis_bin : blobs des tables en bytes bruts
+# (format binaire de services/table_codec.py)
+from core.redis_client import redis_client, redis_bin
 
 # Kafka Consumer (écoute plusieurs topics)
 consumer = KafkaConsumer(
     "orders_events", "contact_events",  # ajouter ici toutes les tables que tu veux écouter
+    "catalog_events",  # TABLE_KPI, TABLE_TABLEAUX, TABLE_CHART, TABLE_MAP (cache de /config/me)
+    # agrégats journaliers (services/rollups.py, rollup_tables()) :
+    #   orders_events   -> commandeclient, lignecommande
+    #   stock_events    -> mouvement_stock
+    #   supplier_events -> reception_fournisseur, commande_fournisseur
+    "stock_events", "supplier_events",
     bootstrap_servers="localhost:9092",
     group_id="cache-invalidator",
     value_deserializer=lambda m: json.loads(m.decode("utf-8"))
 )
 
+# Une rafale d'events sur une même table = une seule réécriture du cache
+BATCH_TIMEOUT_MS = 200
+BATCH_MAX_RECORDS = 500
+
+# Vérification périodique des agrégats à reconstruire (rollup_ready expirant)
+ROLLUP_CHECK_INTERVAL = 60
+
+
+def _net_changes(events):
+    """
+    Dernier état connu par id : {id: record} (upsert) ou {id: None} (delete).
+    None si un event n'a pas d'id (patch impossible).
+    """
+    changes = {}
+    for action, record in events:
+        rid = record.get("id")
+        if rid is None:
+            return None
+        changes[rid] = None if action == "DELETE" else record
+    return changes
+
+
+def _in_part(record, part):
+    """La ligne appartient-elle à cette variante ? (toujours, hors tranche mensuelle)"""
+    if part is None:
+        return True
+    col, month = part
+    value = record.get(col)
+    return isinstance(value, str) and value.startswith(month)
+
+
+def _touched(data, changes, part):
+    """La variante contient-elle un id modifié, ou doit-elle recevoir une ligne ?"""
+    ids = data.columns.get("id")
+    if ids is not None and any(v in changes for v in ids.values()):
+        return True
+    return any(record is not None and _in_part(record, part) for record in changes.values())
+
+
+def _patch_snapshot(data, changes, part):
+    """
+    Applique les changements à un snapshot (projection et tranche mensuelle
+    respectées) : mises à jour à leur position, insertions à la fin.
+    """
+    columns = list(data.columns)
+    rows, removed = [], []
+    for rid, record in changes.items():
+        if record is None or not _in_part(record, part):
+            removed.append(rid)  # supprimée, ou hors de cette tranche : seulement retirée
+            continue
+        rows.append({c: record.get(c) for c in columns} if columns else dict(record))
+    return data.without(removed).upsert(ColumnarTable.from_rows(rows))
+
+
+def patch_table_cache(table, events):
+    """
+    Patch en place des variantes en cache de la table (complète, projections,
+    tranches) au lieu de les supprimer : le cache reste chaud. Seules les
+    variantes qui contiennent un id modifié ou reçoivent une ligne sont
+    réécrites ; les morceaux qu'elles remplacent sont retirés dans la même
+    transaction. Tables sans id -> ancienne invalidation (suppression des clés).
+    """
+    cache_key = f"table_cache:{table}"
+    keys = [cache_key, *redis_client.scan_iter(match=f"{cache_key}:*")]
+    changes = _net_changes(events)
+    rewritten = []
+
+    def _apply(pipe):
+        rewritten.clear()
+        blobs, heads = read_blobs_with_heads(pipe, keys)
+        # TTL lus sous WATCH : le snapshot patché garde son échéance de réconciliation
+        ttls = {key: remaining_ttl(pipe, key, TABLE_RECONCILE_TTL) for key, blob in zip(keys, blobs) if blob}
+        pipe.multi()
+        for key, blob, head in zip(keys, blobs, heads):
+            if not blob:
+                continue
+            data = decode_table(blob)
+            if changes is None or (data.length and "id" not in data.columns):
+                delete_blob(pipe, key, previous=head)
+                rewritten.append(key)
+                continue
+            part = slice_of(key)
+            if not _touched(data, changes, part):
+                continue
+            patched = _patch_snapshot(data, changes, part)
+            write_blob(pipe, key, encode_table(patched), ttls[key], previous=head)
+            rewritten.append(key)
+        # la nouvelle version invalide aussi les copies L1 de chaque worker API
+        pipe.incr(f"table_version:{table}")
+
+    redis_bin.transaction(_apply, *keys)
+    print(f" Cache patché dans Redis: {cache_key} ({len(events)} event(s), "
+          f"{len(rewritten)}/{len(keys)} clé(s) réécrite(s))")
+
+
+def rebuild_due_rollups():
+    """
+    Reconstruction planifiée : les deltas ne rattrapent pas un event manqué,
+    chaque agrégat est donc refait depuis Supabase avant l'expiration de
+    rollup_ready. Faite dans la boucle du consumer : aucun event n'est
+    appliqué pendant la reconstruction, ceux en attente sont rejoués ensuite
+    (idempotents).
+    """
+    due = rollups_due(redis_client)
+    if not due:
+        return
+    from services.config_service import rebuild_rollups
+    try:
+        rebuild_rollups(due)
+    except Exception as e:
+        print(f"[ROLLUP] Échec de la reconstruction de {due}: {e}")
+
+
 print("📡 En attente des events Kafka...")
 print("Topics écoutés:", consumer.subscription())
-for msg in consumer:
-    event = msg.value
-    table = event.get("table")
-    action = event.get("type")
-    record = event.get("record")
-
-    print(f" Event reçu: {action} sur {table} → {record}")
-
-    if record and action in ("UPDATE", "DELETE"):
-        # Supprime la clé Redis correspondante
-        print(f"[CACHE] Invalidation du cache pour la table '{table}'")
-        cache_key = f"table_cache:{table}"
-        redis_client.delete(cache_key)
-        print(f" Cache supprimé dans Redis: {cache_key}")
+next_rollup_check = 0.0
+while True:
+    if time.monotonic() >= next_rollup_check:
+        rebuild_due_rollups()
+        next_rollup_check = time.monotonic() + ROLLUP_CHECK_INTERVAL
+    batch = consumer.poll(timeout_ms=BATCH_TIMEOUT_MS, max_records=BATCH_MAX_RECORDS)
+    events_by_table = defaultdict(list)
+    for messages in batch.values():
+        for msg in messages:
+            event = msg.value
+            table = event.get("table")
+            action = event.get("type")
+            record = event.get("record")
+
+            print(f" Event reçu: {action} sur {table} → {record}")
+
+            if table and record and action in ("INSERT", "UPDATE", "DELETE"):
+                events_by_table[table].append((action, record))
+
+    for table, events in events_by_table.items():
+        print(f"[CACHE] Mise à jour du cache pour la table '{table}' ({len(events)} event(s))")
+        patch_table_cache(table, events)
+        # agrégats journaliers (mouvements, ventes, réceptions) : delta par ligne
+        apply_rollup_events(redis_client, table, events)
@@ -0,0 +1,181 @@
+import os
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, Iterator, Optional
+
+import redis
+import redis.asyncio as aioredis
+from redis.asyncio.client import Pipeline as _AsyncPipeline
+from redis.client import Pipeline as _SyncPipeline
+
+# ============================================================
+# Accès Redis partagé
+# ------------------------------------------------------------
+# Un pool de connexions configuré par processus et par mode :
+#   redis_client / redis_bin   : sync (pools de threads, consumer, scripts)
+#   aredis_client / aredis_bin : redis.asyncio (chemin des requêtes)
+# *_bin : valeurs en bytes bruts (blobs de services/table_codec.py).
+# Pools bloquants bornés (REDIS_MAX_CONNECTIONS, attente REDIS_POOL_TIMEOUT)
+# et timeouts socket : une panne Redis coûte au plus quelques secondes.
+# Chaque commande (et chaque pipeline, compté comme une commande PIPELINE)
+# est chronométrée : compteurs par commande (redis_metrics.snapshot()) et
+# cumul par requête HTTP (track_request(), en-tête Server-Timing de main.py).
+# Les compteurs ne sont exposés en HTTP (/internal/metrics/redis) que si
+# REDIS_METRICS_ENDPOINT=1 : désactivé par défaut, à n'ouvrir que sur un
+# déploiement interne.
+# ============================================================
+
+REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
+REDIS_MAX_CONNECTIONS = int(os.getenv("REDIS_MAX_CONNECTIONS", "64"))
+REDIS_POOL_TIMEOUT = float(os.getenv("REDIS_POOL_TIMEOUT", "5"))
+REDIS_SOCKET_TIMEOUT = float(os.getenv("REDIS_SOCKET_TIMEOUT", "5"))
+REDIS_CONNECT_TIMEOUT = float(os.getenv("REDIS_CONNECT_TIMEOUT", "2"))
+REDIS_HEALTH_CHECK_INTERVAL = int(os.getenv("REDIS_HEALTH_CHECK_INTERVAL", "30"))
+REDIS_METRICS_ENDPOINT = os.getenv("REDIS_METRICS_ENDPOINT", "0") == "1"
+
+
+class RequestRedisStats:
+    """Temps Redis cumulé d'une requête HTTP."""
+    __slots__ = ("seconds", "calls", "errors")
+
+    def __init__(self):
+        self.seconds = 0.0
+        self.calls = 0
+        self.errors = 0
+
+    def server_timing(self) -> str:
+        return f'redis;dur={1000 * self.seconds:.1f};desc="{self.calls} appels, {self.errors} erreurs"'
+
+
+_request_stats: ContextVar[Optional[RequestRedisStats]] = ContextVar("redis_request_stats", default=None)
+
+
+class RedisMetrics:
+    """Compteurs par commande depuis le démarrage du processus."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # commande -> [appels, erreurs, secondes cumulées, max]
+        self._commands: Dict[str, list] = {}
+
+    def record(self, command: str, seconds: float, error: bool) -> None:
+        stats = _request_stats.get()
+        with self._lock:
+            entry = self._commands.get(command)
+            if entry is None:
+                entry = self._commands[command] = [0, 0, 0.0, 0.0]
+            entry[0] += 1
+            entry[1] += error
+            entry[2] += seconds
+            entry[3] = max(entry[3], seconds)
+            if stats is not None:
+                stats.calls += 1
+                stats.errors += error
+                stats.seconds += seconds
+
+    def snapshot(self) -> Dict[str, dict]:
+        with self._lock:
+            return {
+                command: {
+                    "calls": calls,
+                    "errors": errors,
+                    "total_ms": round(1000 * total, 3),
+                    "avg_ms": round(1000 * total / calls, 3) if calls else 0.0,
+                    "max_ms": round(1000 * worst, 3),
+                }
+                for command, (calls, errors, total, worst) in sorted(self._commands.items())
+            }
+
+    def reset(self) -> None:
+        with self._lock:
+            self._commands.clear()
+
+
+redis_metrics = RedisMetrics()
+
+
+@contextmanager
+def track_request() -> Iterator[RequestRedisStats]:
+    """Cumule le temps Redis des commandes émises dans ce contexte (et ses copies)."""
+    stats = RequestRedisStats()
+    token = _request_stats.set(stats)
+    try:
+        yield stats
+    finally:
+        _request_stats.reset(token)
+
+
+def _command_name(args) -> str:
+    name = args[0] if args else "?"
+    return (name.decode() if isinstance(name, bytes) else str(name)).upper()
+
+
+# ---------- clients instrumentés ----------
+class _Pipeline(_SyncPipeline):
+    def execute(self, raise_on_error=True):
+        started, error = time.perf_counter(), True
+        try:
+            result = super().execute(raise_on_error)
+            error = False
+            return result
+        finally:
+            redis_metrics.record("PIPELINE", time.perf_counter() - started, error)
+
+
+class Redis(redis.Redis):
+    def execute_command(self, *args, **options):
+        started, error = time.perf_counter(), True
+        try:
+            result = super().execute_command(*args, **options)
+            error = False
+            return result
+        finally:
+            redis_metrics.record(_command_name(args), time.perf_counter() - started, error)
+
+    def pipeline(self, transaction=True, shard_hint=None):
+        return _Pipeline(self.connection_pool, self.response_callbacks, transaction, shard_hint)
+
+
+class _AsyncPipelineTimed(_AsyncPipeline):
+    async def execute(self, raise_on_error=True):
+        started, error = time.perf_counter(), True
+        try:
+            result = await super().execute(raise_on_error)
+            error = False
+            return result
+        finally:
+            redis_metrics.record("PIPELINE", time.perf_counter() - started, error)
+
+
+class AsyncRedis(aioredis.Redis):
+    async def execute_command(self, *args, **options):
+        started, error = time.perf_counter(), True
+        try:
+            result = await super().execute_command(*args, **options)
+            error = False
+            return result
+        finally:
+            redis_metrics.record(_command_name(args), time.perf_counter() - started, error)
+
+    def pipeline(self, transaction=True, shard_hint=None):
+        return _AsyncPipelineTimed(self.connection_pool, self.response_callbacks, transaction, shard_hint)
+
+
+def _pool_options(decode_responses: bool) -> dict:
+    return dict(
+        decode_responses=decode_responses,
+        max_connections=REDIS_MAX_CONNECTIONS,
+        timeout=REDIS_POOL_TIMEOUT,
+        socket_timeout=REDIS_SOCKET_TIMEOUT,
+        socket_connect_timeout=REDIS_CONNECT_TIMEOUT,
+        health_check_interval=REDIS_HEALTH_CHECK_INTERVAL,
+    )
+
+
+# Connexions ouvertes à la première commande (pas à l'import)
+redis_client = Redis(connection_pool=redis.BlockingConnectionPool.from_url(REDIS_URL, **_pool_options(True)))
+redis_bin = Redis(connection_pool=redis.BlockingConnectionPool.from_url(REDIS_URL, **_pool_options(False)))
+aredis_client = AsyncRedis(connection_pool=aioredis.BlockingConnectionPool.from_url(REDIS_URL, **_pool_options(True)))
+aredis_bin = AsyncRedis(connection_pool=aioredis.BlockingConnectionPool.from_url(REDIS_URL, **_pool_options(False)))
@@ -1,7 +1,8 @@
-from fastapi import FastAPI
+from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
+from core.redis_client import track_request, REDIS_METRICS_ENDPOINT
 from api.auth import router as auth_router
-from api.config import router as pre_router
+from api.config import router as pre_router, internal_router
 app = FastAPI()
 
 origins = [
@@ -17,5 +18,15 @@ app.add_middleware(
     allow_headers=["*"],              
 )
 
+# Part de Redis dans chaque réponse (onglet Timing des devtools)
+@app.middleware("http")
+async def redis_server_timing(request: Request, call_next):
+    with track_request() as stats:
+        response = await call_next(request)
+    response.headers.append("Server-Timing", stats.server_timing())
+    return response
+
 app.include_router(auth_router)
-app.include_router(pre_router)
\ No newline at end of file
+app.include_router(pre_router)
+if REDIS_METRICS_ENDPOINT:
+    app.include_router(internal_router)
\ No newline at end of file
@@ -4,17 +4,10 @@ from datetime import date, datetime, timedelta
 from typing import Any, Dict, List, Optional
 from collections import defaultdict
 
-# -------- utils communes --------
-def _parse_date(v: Any) -> Optional[date]:
-    if v in (None, "", "null"): return None
-    if isinstance(v, date): return v
-    s = str(v)
-    for fmt in ("%Y-%m-%d","%Y/%m/%d","%d/%m/%Y","%Y-%m-%d %H:%M:%S","%Y-%m-%dT%H:%M:%S"):
-        try: return datetime.strptime(s[:len(fmt)], fmt).date()
-        except: pass
-    try: return datetime.fromisoformat(s).date()
-    except: return None
+from services.table_dates import parse_date as _parse_date
+from services.table_store import row_date as _row_date, index_by, table_index
 
+# -------- utils communes --------
 def _between(d: Optional[date], a: date, b: date) -> bool:
     return bool(d and a <= d <= b)
 
@@ -32,16 +25,16 @@ def _g(row: Dict[str, Any], *names: str, default=None):
 # ============================================================
 def table_cmd_clients_bloquees(tables, start_date: str|None=None, end_date: str|None=None):
     commandes = tables.get("commandeclient", []) or []
-    contacts  = {c.get("id"): c for c in (tables.get("contact", []) or [])}
+    contacts  = index_by(tables.get("contact", []) or [])
 
     out = []
     for c in commandes:
         cmd_id  = c.get("id")
         client  = (contacts.get(c.get("contact_id")) or {}).get("nom") or "Inconnu"
         statut  = c.get("statut")
-        dcmd    = _parse_date(_g(c, "date_commande"))
-        dprev   = _parse_date(_g(c, "date_prevue_livraison"))
-        dreal   = _parse_date(_g(c, "date_reelle_livraison"))
+        dcmd    = _row_date(c, "date_commande")
+        dprev   = _row_date(c, "date_prevue_livraison")
+        dreal   = _row_date(c, "date_reelle_livraison")
 
         retard_j = 0
         if dprev and dreal and dreal > dprev:
@@ -106,8 +99,8 @@ def table_stock_risque_rupture(
         win_end   = today
 
     # --------- Référentiels ---------
-    produits   = {p.get("id"): p for p in (tables.get("produit",   []) or [])}
-    entrepots  = {e.get("id"): e for e in (tables.get("entrepot",  []) or [])}
+    produits   = index_by(tables.get("produit",   []) or [])
+    entrepots  = index_by(tables.get("entrepot",  []) or [])
     stock_rows =         tables.get("stock",               []) or []
     mvts       =         tables.get("mouvement_stock",     []) or []
 
@@ -117,7 +110,7 @@ def table_stock_risque_rupture(
         typ = str(_g(m, "typemouvement", "type_mouvement", default="")).lower()
         if not typ.startswith("sortie"):
             continue
-        dm = _parse_date(_g(m, "datemouvement", "date_mouvement"))
+        dm = _row_date(m, "datemouvement", "date_mouvement")
         if _between(dm, win_start, win_end):
             sid = m.get("stock_id")
             q   = float(_g(m, "quantite", "qte", default=0) or 0)
@@ -178,6 +171,23 @@ def table_stock_risque_rupture(
 #    Colonnes: cmdf_id, fournisseur, date_commande, date_prevue_livraison,
 #              date_reelle_livraison, retard_jours, statut_conformite
 # ============================================================
+def _receptions_by_cmd(recs):
+    """Par commande : première date de réception et statuts de conformité."""
+    min_rec_by_cmd: Dict[Any, Optional[date]] = {}
+    conformites_by_cmd: Dict[Any, List[str]] = {}
+    for r in recs:
+        cid = _g(r, "commande_id", "commandefournisseur_id", "id_commandefournisseur")
+        dr  = _row_date(r, "date_reception", "datereception", "date_reelle_livraison")
+        sc  = _g(r, "statut_conformite", "statutconformite")
+        if cid is None:
+            continue
+        cur = min_rec_by_cmd.get(cid)
+        if dr is not None and (cur is None or dr < cur):
+            min_rec_by_cmd[cid] = dr
+        if sc:
+            conformites_by_cmd.setdefault(cid, []).append(str(sc).strip())
+    return min_rec_by_cmd, conformites_by_cmd
+
 def table_fournisseurs_retard(tables, start_date: str|None=None, end_date: str|None=None):
     from datetime import date
     from collections import defaultdict
@@ -192,26 +202,12 @@ def table_fournisseurs_retard(tables, start_date: str|None=None, end_date: str|N
         or tables.get("receptionfournisseur", []) \
         or []
     tiers_tab = tables.get("tiers", []) or tables.get("tiers_type", []) or []
-    tiers = {t.get("id"): t for t in tiers_tab}
+    tiers = index_by(tiers_tab)
 
-    # agrégations
-    min_rec_by_cmd = defaultdict(lambda: None)
-    conformites_by_cmd = defaultdict(list)
+    # agrégations (gardées avec la table des réceptions)
+    min_rec_by_cmd, conformites_by_cmd = table_index(recs, _receptions_by_cmd)
     prio = {"Non conforme": 0, "Partiellement conforme": 1, "Conforme": 2}
 
-    # ✅ CETTE BOUCLE DOIT ÊTRE DANS LA FONCTION (indentée)
-    for r in recs:
-        cid = _g(r, "commande_id", "commandefournisseur_id", "id_commandefournisseur")
-        dr  = _parse_date(_g(r, "date_reception", "datereception", "date_reelle_livraison"))
-        sc  = _g(r, "statut_conformite", "statutconformite")
-        if cid is None:
-            continue
-        cur = min_rec_by_cmd[cid]
-        if dr is not None and (cur is None or dr < cur):
-            min_rec_by_cmd[cid] = dr
-        if sc:
-            conformites_by_cmd[cid].append(str(sc).strip())
-
     def agg_conformite(vals):
         if not vals:
             return None
@@ -220,9 +216,9 @@ def table_fournisseurs_retard(tables, start_date: str|None=None, end_date: str|N
     out = []
     for c in cmds:
         cid   = c.get("id")
-        dcmd  = _parse_date(_g(c, "date_commande", "datecommande"))
-        dprev = _parse_date(_g(c, "date_prevue_livraison", "date_prevue", "dateprevulivraison"))
-        dreal = min_rec_by_cmd.get(cid) or _parse_date(_g(c, "date_reelle_livraison"))
+        dcmd  = _row_date(c, "date_commande", "datecommande")
+        dprev = _row_date(c, "date_prevue_livraison", "date_prevue", "dateprevulivraison")
+        dreal = min_rec_by_cmd.get(cid) or _row_date(c, "date_reelle_livraison")
 
         # filtre sur la période demandée (sur date_commande)
         if sdt and (not dcmd or dcmd < sdt):
@@ -260,13 +256,13 @@ def table_fournisseurs_retard(tables, start_date: str|None=None, end_date: str|N
 # ============================================================
 def table_peremption_30j(tables, seuil_jours: int = 30):
     today = date.today()
-    produits = {p.get("id"): p for p in (tables.get("produit", []) or [])}
-    entrepots = {e.get("id"): e for e in (tables.get("entrepot", []) or [])}
-    stock_by_id = {s.get("id"): s for s in (tables.get("stock", []) or [])}
+    produits = index_by(tables.get("produit", []) or [])
+    entrepots = index_by(tables.get("entrepot", []) or [])
+    stock_by_id = index_by(tables.get("stock", []) or [])
 
     out = []
     for r in (tables.get("peremption", []) or []):
-        exp = _parse_date(_g(r, "dateexpiration", "date_expiration"))
+        exp = _row_date(r, "dateexpiration", "date_expiration")
         if not exp: 
             continue
         j = (exp - today).days
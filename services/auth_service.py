@@ -1,25 +1,176 @@
+import asyncio
+import hashlib
 import json
 import os
-import redis
+import time
+from typing import Any, Dict, Optional, Tuple
+import jwt
+from redis.exceptions import RedisError, WatchError
 from fastapi import HTTPException, status, Response
 from dto.auth_dto import LoginRequest, LoginResponse, MeResponse, LogoutResponse, MultiRpcRequest
-from core.config import supabase
+from core.config import get_async_supabase
+from core.redis_client import aredis_client as redis_client
 
 
 
-# Initialisation Redis
-redis_client = redis.from_url(
-    os.getenv("REDIS_URL"),
-    decode_responses=True
-    #ssl=True   indispensable pour Redis Cloud (TLS)
-)
-
 ACCESS_TOKEN_TTL = 60 * 60  # 1 hour
 REFRESH_TOKEN_TTL = 5 * 60 * 60  # 5 hours
 
+# ============================================================
+# Vérification locale des access tokens (JWT Supabase)
+# ------------------------------------------------------------
+# Avec SUPABASE_JWT_SECRET (HS256) ou SUPABASE_JWKS_URL (clés asymétriques,
+# mises en cache par kid), le token est vérifié sur place : signature, exp,
+# audience. Plus de GET token:{...} par requête.
+# kid inconnu : le JWKS est relu (une seule lecture à la fois, au plus une
+# par JWKS_REFETCH_SECONDS), puis le token est rejeté s'il reste inconnu.
+# Un kid inventé ne déclenche donc pas un appel HTTP par requête.
+# Révocation (logout) : ZSET REVOKED_SESSIONS_KEY, membre = session_id (ou
+# empreinte du token), score = exp. Chaque worker en garde une copie locale
+# resynchronisée toutes les REVOCATION_SYNC_SECONDS : un logout est vu
+# immédiatement par le worker qui le traite, au plus tard après ce délai
+# par les autres. Redis indisponible : la dernière copie reste utilisée.
+# Sans secret ni JWKS configuré, le cache Redis token:{...} reste la source.
+# ============================================================
+
+SUPABASE_JWT_SECRET = os.getenv("SUPABASE_JWT_SECRET")
+SUPABASE_JWKS_URL = os.getenv("SUPABASE_JWKS_URL")
+SUPABASE_JWT_AUDIENCE = os.getenv("SUPABASE_JWT_AUDIENCE", "authenticated")
+JWKS_ALGORITHMS = ["ES256", "RS256"]
+REVOKED_SESSIONS_KEY = "revoked_sessions"
+REVOCATION_SYNC_SECONDS = float(os.getenv("REVOCATION_SYNC_SECONDS", "2"))
+JWKS_REFETCH_SECONDS = float(os.getenv("JWKS_REFETCH_SECONDS", "60"))
+
+LOCAL_JWT = bool(SUPABASE_JWT_SECRET or SUPABASE_JWKS_URL)
+_jwks_client = jwt.PyJWKClient(SUPABASE_JWKS_URL) if SUPABASE_JWKS_URL else None
+# kid -> clé du dernier JWKS lu (remplacé à chaque lecture : borné par le JWKS)
+_jwks_keys: Dict[str, Any] = {}
+_jwks_fetch: Optional["asyncio.Task"] = None
+_jwks_fetched_at = float("-inf")
+_jwks_error: Optional[Exception] = None
+
+# membre -> exp (epoch), copie locale du ZSET
+_revoked: Dict[str, float] = {}
+_revoked_synced_at = 0.0
+
+# clé de signature momentanément introuvable (JWKS injoignable…)
+_UNVERIFIED = object()
+
+
+async def _signing_key(access_token: str) -> Tuple[Any, list]:
+    header = jwt.get_unverified_header(access_token)
+    alg = header.get("alg")
+    if alg == "HS256" and SUPABASE_JWT_SECRET:
+        return SUPABASE_JWT_SECRET, ["HS256"]
+    if alg not in JWKS_ALGORITHMS or _jwks_client is None:
+        raise jwt.InvalidAlgorithmError(f"algorithme non accepté: {alg}")
+    return await _jwks_key(header.get("kid")), JWKS_ALGORITHMS
+
+
+async def _fetch_jwks() -> None:
+    global _jwks_keys, _jwks_error
+    try:
+        # fetch HTTP bloquant du JWKS hors de la boucle
+        signing_keys = await asyncio.to_thread(_jwks_client.get_signing_keys, True)
+        _jwks_keys = {k.key_id: k.key for k in signing_keys if k.key_id}
+        _jwks_error = None
+    except jwt.PyJWKClientError as e:
+        _jwks_error = e
+
+
+async def _jwks_key(kid: Optional[str]) -> Any:
+    """
+    Clé du kid. Inconnu : une relecture du JWKS (partagée, au plus une par
+    JWKS_REFETCH_SECONDS) ; toujours inconnu -> token invalide.
+    JWKS injoignable -> PyJWKClientError (vérification impossible).
+    """
+    global _jwks_fetch, _jwks_fetched_at
+    key = _jwks_keys.get(kid)
+    if key is not None:
+        return key
+    if _jwks_fetch is None and time.monotonic() - _jwks_fetched_at >= JWKS_REFETCH_SECONDS:
+        _jwks_fetched_at = time.monotonic()
+        _jwks_fetch = asyncio.ensure_future(_fetch_jwks())
+        _jwks_fetch.add_done_callback(_jwks_fetch_done)
+    if _jwks_fetch is not None:
+        await asyncio.shield(_jwks_fetch)
+    key = _jwks_keys.get(kid)
+    if key is not None:
+        return key
+    if _jwks_error is not None:
+        raise _jwks_error
+    raise jwt.InvalidTokenError(f"kid inconnu: {kid}")
+
+
+def _jwks_fetch_done(_task) -> None:
+    global _jwks_fetch
+    _jwks_fetch = None
+
 
-def login_service(response: Response, req: LoginRequest) -> LoginResponse:
-    auth_res = supabase.auth.sign_in_with_password({
+async def _verified_claims(access_token: str) -> Any:
+    """Claims du token, None s'il est invalide/expiré, _UNVERIFIED si la clé est indisponible."""
+    try:
+        key, algorithms = await _signing_key(access_token)
+    except jwt.PyJWKClientError as e:
+        print(f"[AUTH] JWKS indisponible: {e}")
+        return _UNVERIFIED
+    except jwt.InvalidTokenError:
+        return None
+    try:
+        return jwt.decode(
+            access_token, key, algorithms=algorithms, audience=SUPABASE_JWT_AUDIENCE,
+            options={"require": ["exp", "sub"]},
+        )
+    except jwt.InvalidTokenError:
+        return None
+
+
+def _revocation_member(access_token: str, claims: dict) -> str:
+    session_id = claims.get("session_id")
+    if session_id:
+        return f"sid:{session_id}"
+    return "tok:" + hashlib.sha256(access_token.encode()).hexdigest()[:32]
+
+
+async def _is_revoked(member: str) -> bool:
+    global _revoked, _revoked_synced_at
+    now = time.time()
+    if time.monotonic() - _revoked_synced_at > REVOCATION_SYNC_SECONDS:
+        _revoked_synced_at = time.monotonic()
+        try:
+            entries = await redis_client.zrangebyscore(REVOKED_SESSIONS_KEY, now, "+inf", withscores=True)
+            _revoked = dict(entries)
+        except RedisError as e:
+            print(f"[AUTH] Liste de révocation non synchronisée: {e}")
+    exp = _revoked.get(member)
+    return exp is not None and exp > now
+
+
+async def _revoke(pipe, access_token: str) -> None:
+    """Ajoute la révocation du token au pipeline (rien si le token est invalide/expiré)."""
+    claims = await _verified_claims(access_token)
+    if not isinstance(claims, dict):
+        return
+    member, exp = _revocation_member(access_token, claims), float(claims["exp"])
+    _revoked[member] = exp
+    pipe.zadd(REVOKED_SESSIONS_KEY, {member: exp})
+    pipe.zremrangebyscore(REVOKED_SESSIONS_KEY, "-inf", time.time())
+    pipe.expire(REVOKED_SESSIONS_KEY, ACCESS_TOKEN_TTL * 2)
+
+
+async def _user_from_jwt(access_token: str) -> Any:
+    """user_data d'un token valide et non révoqué, None sinon, _UNVERIFIED si non vérifiable."""
+    claims = await _verified_claims(access_token)
+    if not isinstance(claims, dict):
+        return claims
+    if await _is_revoked(_revocation_member(access_token, claims)):
+        return None
+    return {"id": claims["sub"], "email": claims.get("email")}
+
+
+async def login_service(response: Response, req: LoginRequest) -> LoginResponse:
+    supabase = await get_async_supabase()
+    auth_res = await supabase.auth.sign_in_with_password({
         "email": req.email,
         "password": req.password
     })
@@ -29,8 +180,10 @@ def login_service(response: Response, req: LoginRequest) -> LoginResponse:
 
     user = auth_res.user
     user_cache = {"id": user.id, "email": user.email}
-    redis_client.setex(f"token:{auth_res.session.access_token}", ACCESS_TOKEN_TTL, json.dumps(user_cache))
-    redis_client.setex(f"refresh:{auth_res.session.refresh_token}", REFRESH_TOKEN_TTL, json.dumps(user_cache))
+    pipe = redis_client.pipeline(transaction=False)
+    pipe.setex(f"token:{auth_res.session.access_token}", ACCESS_TOKEN_TTL, json.dumps(user_cache))
+    pipe.setex(f"refresh:{auth_res.session.refresh_token}", REFRESH_TOKEN_TTL, json.dumps(user_cache))
+    await pipe.execute()
 
     response.set_cookie("access_token", auth_res.session.access_token, httponly=True, max_age=ACCESS_TOKEN_TTL, secure=True, samesite="none")
     response.set_cookie("refresh_token", auth_res.session.refresh_token, httponly=True, max_age=REFRESH_TOKEN_TTL, secure=True, samesite="none")
@@ -40,19 +193,27 @@ def login_service(response: Response, req: LoginRequest) -> LoginResponse:
     )
 
 
-def logout_service(response: Response, access_token: str = None, refresh_token: str = None) -> LogoutResponse:
+async def logout_service(response: Response, access_token: str = None, refresh_token: str = None) -> LogoutResponse:
     if not access_token and not refresh_token:
         raise HTTPException(status_code=401, detail="Aucun token fourni")
-    access_exists = redis_client.exists(f"token:{access_token}")
-    refresh_exists = redis_client.exists(f"refresh:{refresh_token}")
-
-    if not access_exists and not refresh_exists:
-        raise HTTPException(status_code=401, detail="session expirée")
-
+    keys = []
     if access_token:
-        redis_client.delete(f"token:{access_token}")
+        keys.append(f"token:{access_token}")
     if refresh_token:
-        redis_client.delete(f"refresh:{refresh_token}")
+        keys.append(f"refresh:{refresh_token}")
+    # paire déjà publiée pour ce refresh token : plus récupérable après logout
+    published = [f"refresh_result:{_refresh_digest(refresh_token)}"] if refresh_token else []
+
+    # un seul aller-retour : existence, suppression (sans effet si absentes), révocation
+    pipe = redis_client.pipeline(transaction=False)
+    pipe.exists(*keys)
+    pipe.delete(*keys, *published)
+    if LOCAL_JWT and access_token:
+        await _revoke(pipe, access_token)
+    existing = (await pipe.execute())[0]
+
+    if not existing:
+        raise HTTPException(status_code=401, detail="session expirée")
 
     response.delete_cookie("access_token")
     response.delete_cookie("refresh_token")
@@ -62,36 +223,150 @@ def logout_service(response: Response, access_token: str = None, refresh_token:
 
 
 
-def verify_and_refresh_token_service(response: Response, access_token: str, refresh_token: str = None) -> dict:
-    cached_user = redis_client.get(f"token:{access_token}")
+# ============================================================
+# Refresh single-flight
+# ------------------------------------------------------------
+# Un dashboard dont l'access token vient d'expirer envoie N requêtes en
+# parallèle avec le même refresh token : un seul refresh_session par refresh
+# token.
+#   - dans le worker : une tâche partagée par refresh token (_refreshing) ;
+#   - entre workers : verrou refresh_lock:{empreinte} (SET NX PX), le leader
+#     publie la nouvelle paire dans refresh_result:{empreinte} pendant
+#     REFRESH_RESULT_TTL (la fenêtre d'attente des suiveurs, pas plus) ; les
+#     autres l'attendent (polling court) et reçoivent la même paire, donc
+#     les mêmes cookies.
+# L'ancien refresh token ne vit plus que REFRESH_RESULT_TTL après rotation,
+# et un suiveur ne reçoit la paire publiée que si refresh:{ancien} existe
+# encore : rejouer l'ancien token au-delà de cette fenêtre, ou après un
+# logout (qui supprime les deux clés), donne un 401.
+# Leader en échec : verrou libéré, le suivant tente à son tour.
+# Redis indisponible : refresh direct (toujours coalescé dans le worker).
+# ============================================================
+
+REFRESH_LOCK_TTL_MS = int(os.getenv("REFRESH_LOCK_TTL_MS", "10000"))
+REFRESH_WAIT = float(os.getenv("REFRESH_WAIT", "10"))
+REFRESH_RESULT_TTL = int(os.getenv("REFRESH_RESULT_TTL", str(int(REFRESH_WAIT))))
+REFRESH_POLL_SECONDS = 0.05
+
+_refreshing: Dict[str, "asyncio.Task"] = {}
+
+
+async def _refresh_session(refresh_token: str) -> dict:
+    """{"user", "access_token", "refresh_token"} issus d'un refresh_session Supabase."""
+    cached_user = await redis_client.get(f"refresh:{refresh_token}")
+    if not cached_user:
+        raise HTTPException(status_code=401, detail="Refresh token expiré")
+
+    supabase = await get_async_supabase()
+    auth_res = await supabase.auth.refresh_session(refresh_token)
+    if not auth_res or not auth_res.session:
+        raise HTTPException(status_code=401, detail="Impossible de rafraîchir le token")
+
+    user = auth_res.user
+    user_data = {"id": user.id, "email": user.email}
+
+    pipe = redis_client.pipeline(transaction=False)
+    pipe.setex(f"token:{auth_res.session.access_token}", ACCESS_TOKEN_TTL, json.dumps(user_data))
+    pipe.setex(f"refresh:{auth_res.session.refresh_token}", REFRESH_TOKEN_TTL, json.dumps(user_data))
+    # ancien refresh token : gardé le temps que les suiveurs récupèrent la paire
+    pipe.expire(f"refresh:{refresh_token}", REFRESH_RESULT_TTL)
+    await pipe.execute()
+    print("Nouveau access_token et refresh_token générés via refresh")
+    return {
+        "user": user_data,
+        "access_token": auth_res.session.access_token,
+        "refresh_token": auth_res.session.refresh_token,
+    }
+
+
+async def _release_refresh_lock(lock: str, token: str) -> None:
+    try:
+        async with redis_client.pipeline(transaction=True) as pipe:
+            await pipe.watch(lock)
+            if await pipe.get(lock) == token:
+                pipe.multi()
+                pipe.delete(lock)
+                await pipe.execute()
+    except WatchError:
+        pass  # verrou expiré et repris par un autre worker
+    except RedisError as e:
+        print(f"[AUTH] Verrou de refresh non libéré (expire seul): {e}")
+
+
+def _refresh_digest(refresh_token: str) -> str:
+    return hashlib.sha256(refresh_token.encode()).hexdigest()[:32]
+
+
+async def _refresh_across_workers(refresh_token: str) -> dict:
+    digest = _refresh_digest(refresh_token)
+    result_key, lock = f"refresh_result:{digest}", f"refresh_lock:{digest}"
+    token = os.urandom(8).hex()
+    deadline = time.monotonic() + REFRESH_WAIT
+    try:
+        while True:
+            published, valid = await redis_client.mget(result_key, f"refresh:{refresh_token}")
+            if published:
+                if not valid:  # ancien token hors fenêtre, ou session fermée entre-temps
+                    raise HTTPException(status_code=401, detail="Refresh token expiré")
+                return json.loads(published)
+            if await redis_client.set(lock, token, nx=True, px=REFRESH_LOCK_TTL_MS):
+                break
+            if time.monotonic() > deadline:
+                token = None  # leader muet : refresh sans verrou
+                break
+            await asyncio.sleep(REFRESH_POLL_SECONDS)
+    except RedisError as e:
+        print(f"[AUTH] Coordination du refresh indisponible: {e}")
+        token = None
+    if token is None:
+        return await _refresh_session(refresh_token)
+
+    try:
+        result = await _refresh_session(refresh_token)
+        await redis_client.setex(result_key, REFRESH_RESULT_TTL, json.dumps(result))
+        return result
+    finally:
+        await _release_refresh_lock(lock, token)
+
+
+def _refresh_task(refresh_token: str) -> "asyncio.Task":
+    task = _refreshing.get(refresh_token)
+    if task is None:
+        # tâche détachée : l'annulation d'une requête (client parti) n'interrompt pas les autres
+        task = asyncio.ensure_future(_refresh_across_workers(refresh_token))
+        _refreshing[refresh_token] = task
+        task.add_done_callback(lambda _: _refreshing.pop(refresh_token, None))
+    return task
+
+
+async def _cached_user(access_token: str) -> Optional[dict]:
+    cached_user = await redis_client.get(f"token:{access_token}")
+    return json.loads(cached_user) if cached_user else None
+
+
+async def verify_and_refresh_token_service(response: Response, access_token: str, refresh_token: str = None) -> dict:
+    user_data = None
+    if LOCAL_JWT and access_token:
+        user_data = await _user_from_jwt(access_token)
+        if user_data is _UNVERIFIED:  # clé de signature indisponible : cache Redis
+            user_data = await _cached_user(access_token)
+    elif access_token:
+        user_data = await _cached_user(access_token)
     new_access_token = None
     new_refresh_token = None
 
-    if cached_user:
-        user_data = json.loads(cached_user)
+    if user_data:
         print("Access token valide")
     else:
         print("Access token expiré")
         if not refresh_token:
             raise HTTPException(status_code=401, detail="Token expiré, reconnectez-vous")
 
-        cached_user = redis_client.get(f"refresh:{refresh_token}")
-        if not cached_user:
-            raise HTTPException(status_code=401, detail="Refresh token expiré")
-
-        auth_res = supabase.auth.refresh_session(refresh_token)
-        if not auth_res or not auth_res.session:
-            raise HTTPException(status_code=401, detail="Impossible de rafraîchir le token")
-
-        user = auth_res.user
-        user_data = {"id": user.id, "email": user.email}
-
-        redis_client.setex(f"token:{auth_res.session.access_token}", ACCESS_TOKEN_TTL, json.dumps(user_data))
-        redis_client.setex(f"refresh:{auth_res.session.refresh_token}", REFRESH_TOKEN_TTL, json.dumps(user_data))
-
-        new_access_token = auth_res.session.access_token
-        new_refresh_token = auth_res.session.refresh_token
-        print("Nouveau access_token et refresh_token générés via refresh")
+        # requêtes concurrentes sur la même session : un seul refresh, la même paire pour toutes
+        refreshed = await asyncio.shield(_refresh_task(refresh_token))
+        user_data = refreshed["user"]
+        new_access_token = refreshed["access_token"]
+        new_refresh_token = refreshed["refresh_token"]
 
     if new_access_token:
         response.set_cookie("access_token", new_access_token, httponly=True, max_age=ACCESS_TOKEN_TTL, secure=True, samesite="none")
@@ -1,5 +1,7 @@
 from datetime import datetime
 
+from services.table_store import index_by
+
 # 1️⃣ Productivité : Volume traité / Heures travaillées
 def get_kpi_productivite(tables):
     prod_rh = tables.get("production_rh", [])
@@ -64,7 +66,7 @@ def get_kpi_efficacite(tables):
 def get_kpi_cout_horaire_unite(tables):
     prod_rh = tables.get("production_rh", [])
     temps = tables.get("temps_travail", [])
-    employes = {e["id"]: e for e in tables.get("employe", [])}
+    employes = index_by(tables.get("employe", []))
 
     total_cout = 0
     for t in temps:
@@ -0,0 +1,86 @@
+# services/catalog_cache.py
+from __future__ import annotations
+import hashlib
+import json
+import os
+from typing import Any, Iterable, List, Optional
+
+from services.table_cache import L1TableCache
+
+# ============================================================
+# Cache du catalogue de widgets (/config/me)
+# ------------------------------------------------------------
+# TABLE_KPI, TABLE_TABLEAUX, TABLE_CHART et TABLE_MAP sont communs à tous
+# les utilisateurs et ne changent presque jamais :
+#   catalog_cache:{table}:{version} -> JSON des lignes (TTL CATALOG_TTL)
+# version = table_version:{table}, incrémentée par consumer.py à chaque
+# event CDC sur la table : la clé change, l'ancienne n'est plus lue.
+# Devant Redis, un L1 par worker (mêmes clés, même TTL).
+# Chaque entrée garde l'empreinte de son JSON : l'ETag de /config/me se
+# calcule sans resérialiser le catalogue.
+# ============================================================
+
+# champ de MeResponse -> table du catalogue
+CATALOG_TABLES = {
+    "kpi": "TABLE_KPI",
+    "table": "TABLE_TABLEAUX",
+    "chart": "TABLE_CHART",
+    "maps": "TABLE_MAP",
+}
+CATALOG_TTL = int(os.getenv("CATALOG_TTL", str(60 * 60)))
+CATALOG_L1_BYTES = int(os.getenv("CATALOG_L1_BYTES", str(8 * 1024 * 1024)))
+
+# la clé porte déjà la version : version L1 constante
+_L1_VERSION = "1"
+
+
+class CatalogEntry:
+    """Lignes d'une table du catalogue (partagées en lecture seule) et empreinte de leur JSON."""
+    __slots__ = ("rows", "digest", "size")
+
+    def __init__(self, rows: List[dict], raw: str):
+        self.rows = rows
+        self.digest = hashlib.sha1(raw.encode()).hexdigest()
+        self.size = len(raw)
+
+    def nbytes(self) -> int:
+        return self.size
+
+
+catalog_l1 = L1TableCache(max_bytes=CATALOG_L1_BYTES, ttl=CATALOG_TTL)
+
+
+def catalog_key(table: str, version: str) -> str:
+    return f"catalog_cache:{table}:{version}"
+
+
+def encode_rows(rows: List[dict]) -> str:
+    return json.dumps(rows, default=str, separators=(",", ":"))
+
+
+def catalog_l1_get(key: str) -> Optional[CatalogEntry]:
+    return catalog_l1.get(key, _L1_VERSION)
+
+
+def catalog_l1_put(key: str, entry: CatalogEntry) -> None:
+    catalog_l1.put(key, _L1_VERSION, entry)
+
+
+def me_etag(user_id: str, email: str, digests: Iterable[str], widgets: Any) -> str:
+    """ETag fort de la réponse : utilisateur, empreintes du catalogue et widgets."""
+    h = hashlib.sha1(f"{user_id}|{email}".encode())
+    for digest in digests:
+        h.update(digest.encode())
+    h.update(json.dumps(widgets, default=str, sort_keys=True, separators=(",", ":")).encode())
+    return f'"{h.hexdigest()}"'
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """If-None-Match : liste d'ETags (faibles acceptés, comparaison faible) ou '*'."""
+    if not if_none_match:
+        return False
+    for candidate in if_none_match.split(","):
+        candidate = candidate.strip()
+        if candidate == "*" or candidate.removeprefix("W/") == etag:
+            return True
+    return False
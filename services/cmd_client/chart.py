@@ -2,6 +2,8 @@ from __future__ import annotations
 from datetime import datetime, timedelta
 from typing import Any, Dict, List, Optional
 
+from services.table_store import lookup_by, group_by
+
 
 def rpc_nb_otif(
     tables, 
@@ -307,8 +309,8 @@ def rpc_duree_changelog_chart(tables, start_date: str = None, end_date: str = No
     end_date = datetime.strptime(end_date, "%Y-%m-%d").date() if end_date else today
     start_date = datetime.strptime(start_date, "%Y-%m-%d").date() if start_date else end_date - timedelta(days=6)
 
-    # Ordonner changelogs par commande et par date
-    changelogs.sort(key=lambda x: (x["commande_id"], x["date_changement_statut"]))
+    # Ordonner changelogs par commande et par date (copie : la table chargée est partagée)
+    changelogs = sorted(changelogs, key=lambda x: (x["commande_id"], x["date_changement_statut"]))
 
     # Préparer les jours
     all_days = [(start_date + timedelta(days=i)) for i in range((end_date - start_date).days + 1)]
@@ -339,7 +341,7 @@ def rpc_duree_changelog_chart(tables, start_date: str = None, end_date: str = No
 def get_table_cmd_clients_service(tables):
     commandes = tables.get("commandeclient", [])
     contacts = tables.get("contact", [])
-    contact_map = {c["id"]: c["nom"] for c in contacts}
+    contact_map = lookup_by(contacts, "id", "nom")
     result = []
     
     for c in commandes:
@@ -367,9 +369,7 @@ def get_change_log(tables):
     changelog = tables.get("changelog", [])
 
     # Grouper par commande_id
-    changelog_by_cmd = defaultdict(list)
-    for c in changelog:
-        changelog_by_cmd[c["commande_id"]].append(c)
+    changelog_by_cmd = group_by(changelog, "commande_id")
 
     result = []
     for cmd_id, changes in changelog_by_cmd.items():
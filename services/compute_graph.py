@@ -0,0 +1,67 @@
+# services/compute_graph.py
+from __future__ import annotations
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import wraps
+from typing import Any, Callable, Dict, Iterator, Optional, Tuple
+
+# ============================================================
+# Intermédiaires partagés entre les RPC d'une même requête
+# ------------------------------------------------------------
+# Les RPC d'un dashboard recalculent les mêmes agrégats sur les mêmes
+# tables (deltas de stock par jour, série de disponible, CA par jour…).
+# Un intermédiaire déclaré avec @node("nom") n'est calculé qu'une fois par
+# requête et par arguments, puis servi aux autres RPC du lot.
+# Portée : request_scope() autour de l'évaluation des RPC (get_widget_data).
+# Hors portée (scripts, tests), appel direct sans cache. Les folds page par
+# page s'exécutent sous no_scope() : aucune page n'est retenue par le cache.
+# Les valeurs servies sont partagées : les RPC ne doivent pas les modifier.
+# ============================================================
+
+_Store = Dict[Tuple[Any, ...], Tuple[Any, Any]]
+_current: ContextVar[Optional[_Store]] = ContextVar("compute_graph", default=None)
+
+
+@contextmanager
+def request_scope(store: Optional[_Store] = None) -> Iterator[None]:
+    """store : reprendre les intermédiaires d'une portée précédente du même lot."""
+    token = _current.set({} if store is None else store)
+    try:
+        yield
+    finally:
+        _current.reset(token)
+
+
+@contextmanager
+def no_scope() -> Iterator[None]:
+    """Suspend le partage (tables éphémères : pages d'un fold)."""
+    token = _current.set(None)
+    try:
+        yield
+    finally:
+        _current.reset(token)
+
+
+def node(name: str) -> Callable[[Callable], Callable]:
+    """
+    Intermédiaire nommé f(tables, *args) : clé = (nom, tables, args).
+    Les tables font partie de la clé par identité.
+    """
+    def decorate(fn: Callable) -> Callable:
+        @wraps(fn)
+        def wrapper(tables, *args, **kwargs):
+            store = _current.get()
+            if store is None:
+                return fn(tables, *args, **kwargs)
+            try:
+                key = (name, id(tables), args, tuple(sorted(kwargs.items())))
+                entry = store.get(key)
+            except TypeError:  # argument non hashable : pas de partage
+                return fn(tables, *args, **kwargs)
+            if entry is not None and entry[0] is tables:
+                return entry[1]
+            value = fn(tables, *args, **kwargs)
+            store[key] = (tables, value)
+            return value
+        return wrapper
+    return decorate
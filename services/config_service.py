@@ -1,63 +1,144 @@
+import asyncio
+import contextvars
 import os
 from fastapi import HTTPException
+from postgrest.exceptions import APIError
 import json
 import redis
-from services.widgets_service import RPC_PYTHON_MAP
-from core.config import supabase
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from functools import partial
+from typing import Tuple
+from services.widgets_service import RPC_PYTHON_MAP, RPC_PAGE_FOLDS
+from services.compute_graph import request_scope, no_scope
+from services.rpc_executor import use_process_pool, run_rpcs
+from datetime import date, timedelta
+from services.table_store import ColumnarTable
+from services.table_codec import encode_table, decode_table, read_blobs, aread_blobs, write_blob, remaining_ttl
+from services.table_windows import WIDGET_DATE_WINDOWS, needed_windows, month_slices
+from services.rollups import (
+    ROLLUPS, MVT_DAILY, VENTES_DAILY, RECEPTIONS_DAILY,
+    table_key, ready_key, rollup_version_key, aread_rollup, rebuild_rollup,
+)
+from services.table_cache import (
+    TABLE_CACHE_TTL, TABLE_SCHEMA_TTL, TABLE_RECONCILE_TTL, TABLE_STALE_GRACE, TABLE_STALE_L1_TTL,
+    TABLE_LOCK_TTL_MS, TABLE_LOCK_WAIT, DELTA_SYNC_TABLES,
+    cache_key, fresh_key, lock_key, fence_key, schema_key, version_key, parse_version, l1_cache,
+)
+from services.rpc_cache import RPC_RESULT_TTL, result_key, encode_result, l1_get, l1_put
+from services.catalog_cache import (
+    CATALOG_TABLES, CATALOG_TTL, CatalogEntry, catalog_key, encode_rows, me_etag, catalog_l1_get, catalog_l1_put,
+)
+from core.config import supabase, get_async_supabase
+from core.redis_client import redis_client, redis_bin, aredis_client, aredis_bin
 from dto.auth_dto import MeResponse 
 
-# Initialisation Redis
-redis_client = redis.from_url(
-    os.getenv("REDIS_URL"),
-    decode_responses=True
-    #ssl=True  # indispensable pour Redis Cloud (TLS)
-)
+# Redis (core/redis_client.py) : blobs des tables lus en bytes bruts via *_bin,
+# clients redis.asyncio sur le chemin des requêtes (endpoints async)
+
+# Pool borné pour charger en parallèle les tables absentes de Redis
+TABLE_FETCH_WORKERS = int(os.getenv("TABLE_FETCH_WORKERS", "6"))
+table_fetch_pool = ThreadPoolExecutor(max_workers=TABLE_FETCH_WORKERS, thread_name_prefix="table-fetch")
 
-def me_service(user_data: dict) -> MeResponse:
+# Fetch paginé : PostgREST tronque silencieusement un select sans range() à max-rows
+TABLE_PAGE_SIZE = int(os.getenv("TABLE_PAGE_SIZE", "1000"))
+# Tables trop volumineuses pour être matérialisées : les RPC_PAGE_FOLDS y sont pliées page par page.
+# Vide par défaut : sans STREAMED_TABLES, toutes les tables sont paginées puis matérialisées.
+STREAMED_TABLES = {t.strip() for t in os.getenv("STREAMED_TABLES", "").split(",") if t.strip()}
+
+# Évaluation des RPC (CPU) hors de la boucle d'événements
+RPC_EVAL_WORKERS = int(os.getenv("RPC_EVAL_WORKERS", str(os.cpu_count() or 4)))
+rpc_eval_pool = ThreadPoolExecutor(max_workers=RPC_EVAL_WORKERS, thread_name_prefix="rpc-eval")
+
+async def me_service(user_data: dict) -> Tuple[MeResponse, str]:
     """
     Reçoit directement user_data (déjà authentifié via la dépendance).
     Ne touche PAS aux cookies ni au refresh.
+    Retourne la réponse et son ETag (revalidation 304 côté endpoint).
     """
     user_id = user_data["id"]
+    supabase = await get_async_supabase()
 
-    kpi_res   = supabase.table("TABLE_KPI").select("*").execute()
-    table_res = supabase.table("TABLE_TABLEAUX").select("*").execute()
-    chart_res = supabase.table("TABLE_CHART").select("*").execute()
-    map_res   = supabase.table("TABLE_MAP").select("*").execute()
-    widget_res = supabase.table("dash_widgets").select("*").eq("user_id", user_id).execute()
+    # widgets de l'utilisateur en parallèle du catalogue (cache, sinon Supabase)
+    catalog, widget_res = await asyncio.gather(
+        _load_catalog(supabase),
+        supabase.table("dash_widgets").select("*").eq("user_id", user_id).execute(),
+    )
 
+    etag = me_etag(user_id, user_data["email"], [catalog[f].digest for f in CATALOG_TABLES], widget_res.data)
     return MeResponse(
         id=user_id,
         email=user_data["email"],
-        kpi=kpi_res.data,
-        table=table_res.data,
-        chart=chart_res.data,
-        maps=map_res.data,
-        widgets=widget_res.data
-    )
+        widgets=widget_res.data,
+        **{field: entry.rows for field, entry in catalog.items()},
+    ), etag
 
 
-def post_widget(response, req, user, module):
+async def _load_catalog(supabase):
+    """{champ de MeResponse: CatalogEntry} : L1, puis Redis, puis Supabase (tables manquantes en parallèle)."""
+    tables = list(CATALOG_TABLES.values())
     try:
-        user_id = user["id"]
-        print(f"Enregistrement des widgets pour user {user_id} module '{module}'")
-        existing = (
-            supabase.table("dash_widgets")
-            .select("id")
-            .eq("user_id", user_id)
-            .eq("dashboard", module)
-            .execute()
-        )
+        versions = [parse_version(v) for v in await aredis_client.mget([version_key(t) for t in tables])]
+    except redis.RedisError as e:
+        print(f"[CATALOG] Redis indisponible, lecture directe: {e}")
+        versions = None
+
+    entries = {}
+    if versions is not None:
+        keys = {t: catalog_key(t, v) for t, v in zip(tables, versions)}
+        for t in tables:
+            entry = catalog_l1_get(keys[t])
+            if entry is not None:
+                entries[t] = entry
+        missing = [t for t in tables if t not in entries]
+        if missing:
+            try:
+                raws = await aredis_client.mget([keys[t] for t in missing])
+            except redis.RedisError:
+                raws = [None] * len(missing)
+            for t, raw in zip(missing, raws):
+                if raw is not None:
+                    entries[t] = CatalogEntry(json.loads(raw), raw)
+                    catalog_l1_put(keys[t], entries[t])
+
+    missing = [t for t in tables if t not in entries]
+    if missing:
+        results = await asyncio.gather(*(supabase.table(t).select("*").execute() for t in missing))
+        raws = {}
+        for t, res in zip(missing, results):
+            raws[t] = encode_rows(res.data)
+            entries[t] = CatalogEntry(res.data, raws[t])
+        if versions is not None:
+            # clé à la version lue avant le fetch : un event concurrent la rend
+            # inaccessible (nouvelle version), jamais fausse
+            await _store_catalog({keys[t]: (entries[t], raw) for t, raw in raws.items()})
+
+    return {field: entries[t] for field, t in CATALOG_TABLES.items()}
+
+
+async def _store_catalog(fetched):
+    pipe = aredis_client.pipeline(transaction=False)
+    for key, (entry, raw) in fetched.items():
+        pipe.setex(key, CATALOG_TTL, raw)
+        catalog_l1_put(key, entry)
+    try:
+        await pipe.execute()
+    except redis.RedisError as e:  # le catalogue reste servi depuis Supabase
+        print(f"[CATALOG] Cache du catalogue non écrit: {e}")
+
 
-        if existing.data and len(existing.data) > 0:
-            print(f"Config existante pour user {user_id} module '{module}', on la remplace…")
+# Remplacement d'un tableau de bord en une transaction (sql/replace_dash_widgets.sql)
+REPLACE_WIDGETS_RPC = "replace_dash_widgets"
 
-            supabase.table("dash_widgets").delete().eq("user_id", user_id).eq("dashboard", module).execute()
 
-        inserts = [
+async def post_widget(response, req, user, module):
+    try:
+        user_id = user["id"]
+        supabase = await get_async_supabase()
+        print(f"Enregistrement des widgets pour user {user_id} module '{module}'")
+        widgets = [
             {
-                "user_id": user_id,
-                "dashboard": module,
                 "widget_key": w.key,
                 "widget_type": w.type,
                 "x": w.x,
@@ -68,15 +149,27 @@ def post_widget(response, req, user, module):
             for w in req
         ]
 
-        if not inserts:
+        # un seul aller-retour : suppression de l'ancien layout + insertion, atomiques
+        try:
+            res = await supabase.rpc(
+                REPLACE_WIDGETS_RPC,
+                {"p_user_id": user_id, "p_dashboard": module, "p_widgets": widgets},
+            ).execute()
+            inserted = res.data or 0
+        except APIError as e:
+            if e.code != "PGRST202":  # PGRST202 : fonction pas encore déployée
+                raise
+            print(f"[WIDGETS] {REPLACE_WIDGETS_RPC} absente, remplacement non atomique")
+            inserted = await _replace_widgets_fallback(supabase, user_id, module, widgets)
+
+        if not widgets:
             return {"status": "no_data", "inserted": 0}
 
-        data = supabase.table("dash_widgets").insert(inserts).execute()
         print(f"Widgets enregistrés pour user {user_id} module '{module}'")
         return {
             "status": "success",
             "dashboard": module,
-            "inserted": len(data.data)
+            "inserted": inserted
         }
 
     except Exception as e:
@@ -84,46 +177,596 @@ def post_widget(response, req, user, module):
         raise HTTPException(status_code=500, detail=str(e))
 
 
+async def _replace_widgets_fallback(supabase, user_id, module, widgets):
+    await supabase.table("dash_widgets").delete().eq("user_id", user_id).eq("dashboard", module).execute()
+    if not widgets:
+        return 0
+    rows = [{"user_id": user_id, "dashboard": module, **w} for w in widgets]
+    data = await supabase.table("dash_widgets").insert(rows).execute()
+    return len(data.data)
 
-def get_widget_data(response, req):
-    tables = load_needed_tables(req.rpcs)
-    print(f"params: {req.rpcs}")
-    results = {}
-    for rpc in req.rpcs:
+
+
+def _is_streamed(rpc):
+    return RPC_PAGE_FOLDS.get(rpc.rpc_name) in STREAMED_TABLES
+
+
+async def get_widget_data(response, req):
+    # résultats déjà calculés pour ces params et ces versions de tables (services/rpc_cache.py)
+    keys = await _result_keys(req.rpcs)
+    cached = await _read_results([key for key in keys if key is not None])
+    todo = [rpc for rpc, key in zip(req.rpcs, keys) if key not in cached]
+    computed = {}
+    if todo:
+        tables = await load_needed_tables([rpc for rpc in todo if not _is_streamed(rpc)])
+        print(f"params: {todo}")
+        # calcul CPU (et plis page par page, sync) sur rpc_eval_pool
+        loop = asyncio.get_running_loop()
+        computed = await loop.run_in_executor(rpc_eval_pool, _evaluate_rpcs, tables, todo)
+        # une RPC présente deux fois n'a que le résultat de sa dernière occurrence
+        last = {rpc.rpc_name: key for rpc, key in zip(req.rpcs, keys) if key not in cached}
+        await _store_results({
+            key: computed[name] for name, key in last.items() if key is not None and name in computed
+        })
+    return {
+        rpc.rpc_name: cached[key] if key in cached else computed[rpc.rpc_name]
+        for rpc, key in zip(req.rpcs, keys)
+    }
+
+
+def _result_stamps(rpc_name):
+    """Versions dont dépend le résultat d'une RPC : ses tables et ses agrégats journaliers."""
+    return [version_key(t) for t in WIDGET_DEPENDENCIES.get(rpc_name, [])] + [
+        rollup_version_key(name) for name in WIDGET_ROLLUPS.get(rpc_name, ())
+    ]
+
+
+async def _result_keys(rpcs):
+    stamps = {rpc.rpc_name: _result_stamps(rpc.rpc_name) for rpc in rpcs}
+    wanted = sorted({k for ks in stamps.values() for k in ks})
+    try:
+        versions = dict(zip(wanted, await aredis_client.mget(wanted))) if wanted else {}
+    except redis.RedisError as e:  # versions inconnues : pas de clé, tout est recalculé
+        print(f"[RPC] Versions des tables non lues, cache de résultats ignoré: {e}")
+        return [None] * len(rpcs)
+    today = date.today()
+    return [
+        result_key(rpc.rpc_name, rpc.params, [parse_version(versions[k]) for k in stamps[rpc.rpc_name]], today)
+        for rpc in rpcs
+    ]
+
+
+async def _read_results(keys):
+    """{clé: résultat} des RPC en cache : L1 du worker, puis un MGET Redis."""
+    raws = {}
+    for key in keys:
+        raw = l1_get(key)
+        if raw is not None:
+            raws[key] = raw
+    missing = sorted(set(keys) - set(raws))
+    if missing:
         try:
-            if rpc.rpc_name in RPC_PYTHON_MAP:
-                func = RPC_PYTHON_MAP[rpc.rpc_name]
-                results[rpc.rpc_name] = func(tables, **(rpc.params or {}))
-            else:
-                results[rpc.rpc_name] = {"error": f"RPC {rpc.rpc_name} non défini"}
-        except Exception as e:
-            results[rpc.rpc_name] = {"error": str(e)}
+            cached = await aredis_client.mget(missing)
+        except redis.RedisError as e:  # cache optionnel : tout est recalculé
+            print(f"[RPC] Cache de résultats non lu: {e}")
+            cached = [None] * len(missing)
+        for key, raw in zip(missing, cached):
+            if raw is not None:
+                l1_put(key, raw)
+                raws[key] = raw
+    return {key: json.loads(raw) for key, raw in raws.items()}
+
+
+async def _store_results(results):
+    pipe = aredis_client.pipeline(transaction=False)
+    for key, value in results.items():
+        raw = encode_result(value)
+        if raw is None:
+            continue
+        pipe.setex(key, RPC_RESULT_TTL, raw)
+        l1_put(key, raw)
+    try:
+        await pipe.execute()
+    except redis.RedisError as e:  # le cache de résultats reste optionnel
+        print(f"[RPC] Cache de résultats non écrit: {e}")
+
+
+def _evaluate_rpcs(tables, rpcs):
+    results = {}
+    # RPC_EXECUTOR=process : RPC du lot réparties sur le pool (services/rpc_executor.py)
+    pooled = [rpc for rpc in rpcs if not _is_streamed(rpc) and rpc.rpc_name in RPC_PYTHON_MAP]
+    offloaded = (run_rpcs(tables, pooled) if use_process_pool(pooled) else None) or {}
+    # intermédiaires (@node) partagés entre les RPC du lot, le temps de la requête
+    with request_scope():
+        for rpc in rpcs:
+            try:
+                if _is_streamed(rpc):
+                    results[rpc.rpc_name] = fold_table_pages(rpc)
+                elif rpc.rpc_name in offloaded:
+                    results[rpc.rpc_name] = offloaded[rpc.rpc_name]
+                elif rpc.rpc_name in RPC_PYTHON_MAP:
+                    func = RPC_PYTHON_MAP[rpc.rpc_name]
+                    results[rpc.rpc_name] = func(tables, **(rpc.params or {}))
+                else:
+                    results[rpc.rpc_name] = {"error": f"RPC {rpc.rpc_name} non défini"}
+            except Exception as e:
+                results[rpc.rpc_name] = {"error": str(e)}
 
     return results
 
 
-def load_needed_tables(rpcs):
-    needed_tables = set()
+def _table_columns(table):
+    """Colonnes réelles de la table (L1, Redis, sinon 1 ligne Supabase). None si inconnues."""
+    key = schema_key(table)
+    columns = l1_cache.get(key, "schema")
+    if columns is not None:
+        return columns or None
+    cached = redis_client.get(key)
+    if cached:
+        columns = json.loads(cached)
+    else:
+        res = supabase.table(table).select("*").limit(1).execute()
+        columns = list(res.data[0].keys()) if res.data else []
+        redis_client.setex(key, TABLE_SCHEMA_TTL, json.dumps(columns))
+    l1_cache.put(key, "schema", columns)
+    return columns or None
+
+
+def _select_clause(table, columns):
+    """
+    Projection = colonnes déclarées ∩ colonnes réelles : les alias déclarés
+    (datemouvement / date_mouvement…) qui n'existent pas sont ignorés.
+    """
+    if columns is None:
+        return "*"
+    existing = _table_columns(table)
+    if existing is None:
+        return "*"
+    selected = [c for c in existing if c in columns]
+    return ",".join(selected) if selected else "*"
+
+
+def _date_column(table, aliases):
+    """La colonne date à filtrer, seulement si un seul des alias existe (sinon pas de filtre)."""
+    existing = _table_columns(table) or []
+    found = [a for a in aliases if a in existing]
+    return found[0] if len(found) == 1 else None
+
+
+def _iter_table_pages(table, columns=None, date_filter=None, after=None):
+    """
+    Pages de TABLE_PAGE_SIZE lignes : pagination keyset sur id si la table en a
+    un, sinon range() trié sur toutes les colonnes de la table (ordre total :
+    deux pages ne se recouvrent ni ne laissent de trou ; seules des lignes
+    identiques restent interchangeables). On s'arrête sur une page vide, pour
+    rester correct même si max-rows côté PostgREST est plus petit que TABLE_PAGE_SIZE.
+    after=(colonne, watermark) : seulement les lignes au-delà du watermark.
+    """
+    existing = _table_columns(table) or []
+    keyset = "id" in existing
+    if columns is not None:
+        columns = set(columns) | ({"id"} if keyset else set()) | ({after[0]} if after else set())
+    select = _select_clause(table, columns)
+    if date_filter:
+        col, lo, hi = date_filter
+        print(f"[SUPABASE] Chargement table {table} ({select}) {col} ∈ [{lo}..{hi}]")
+    else:
+        print(f"[SUPABASE] Chargement table {table} ({select})")
+
+    last_id = None
+    if after and after[0] == "id" and keyset:
+        last_id, after = after[1], None
+    offset = 0
+    while True:
+        query = supabase.table(table).select(select)
+        if date_filter:
+            # lt(lendemain) : couvre aussi les colonnes timestamp du dernier jour
+            query = query.gte(col, lo.isoformat()).lt(col, (hi + timedelta(days=1)).isoformat())
+        if after:
+            query = query.gt(after[0], after[1])
+        if keyset:
+            query = query.order("id")
+            if last_id is not None:
+                query = query.gt("id", last_id)
+            query = query.limit(TABLE_PAGE_SIZE)
+        else:
+            for c in existing:
+                query = query.order(c)
+            query = query.range(offset, offset + TABLE_PAGE_SIZE - 1)
+        rows = query.execute().data or []
+        if not rows:
+            return
+        yield rows
+        last_id = rows[-1].get("id")
+        offset += len(rows)
+
+
+def _fetch_table(table, columns=None, date_filter=None):
+    return ColumnarTable.from_pages(_iter_table_pages(table, columns, date_filter))
+
+
+def _watermark_column(table):
+    """updated_at si la table l'a (upsert par id), sinon id (tables en ajout seul)."""
+    existing = _table_columns(table) or []
+    if "updated_at" in existing and "id" in existing:
+        return "updated_at"
+    return "id" if "id" in existing else None
+
+
+def _sync_table(table, columns, date_filter, base):
+    """
+    Delta sync : ne récupère que les lignes au-delà du watermark du snapshot
+    en cache et les fusionne (upsert par id). Sans watermark -> rechargement complet.
+    """
+    wm_col = _watermark_column(table)
+    watermark = base.max_value(wm_col) if wm_col else None
+    if watermark is None:
+        return _fetch_table(table, columns, date_filter)
+    print(f"[SYNC] Table {table} : lignes avec {wm_col} > {watermark}")
+    delta = ColumnarTable.from_pages(_iter_table_pages(table, columns, date_filter, after=(wm_col, watermark)))
+    return base.upsert(delta, key="id")
+
+
+def fold_table_pages(rpc):
+    """Calcule une RPC de RPC_PAGE_FOLDS en sommant ses résultats page par page."""
+    func = RPC_PYTHON_MAP[rpc.rpc_name]
+    table = RPC_PAGE_FOLDS[rpc.rpc_name]
+    params = rpc.params or {}
+    total = None
+    # hors portée de requête : les @node ne gardent aucune page en mémoire
+    with no_scope():
+        for rows in _iter_table_pages(table, needed_columns([rpc]).get(table)):
+            part = func({table: ColumnarTable.from_rows(rows)}, **params)
+            total = part if total is None else total + part
+        return total if total is not None else func({table: []}, **params)
+
+
+def needed_columns(rpcs, dependencies=None):
+    """
+    {table: colonnes à charger} pour un lot de RPC.
+    None = table complète (au moins une RPC ne déclare pas ses colonnes).
+    """
+    if dependencies is None:
+        dependencies = WIDGET_DEPENDENCIES
+    needed = {}
+    for rpc in rpcs:
+        declared = WIDGET_COLUMNS.get(rpc.rpc_name, {})
+        for table in dependencies.get(rpc.rpc_name, []):
+            cols = declared.get(table)
+            if cols is None:
+                needed[table] = None
+            elif table not in needed:
+                needed[table] = set(cols)
+            elif needed[table] is not None:
+                needed[table].update(cols)
+    return needed
+
+
+def _refresh_unit(unit, base=None):
+    """Unité absente de Redis -> chargement complet ; snapshot périmé -> delta sync."""
+    table, columns, _, date_filter = unit
+    if table in DELTA_SYNC_TABLES and columns is not None:
+        # le watermark doit rester dans la projection mise en cache
+        columns = set(columns) | {c for c in ("id", _watermark_column(table)) if c}
+    if base is None:
+        return _fetch_table(table, columns, date_filter)
+    return _sync_table(table, columns, date_filter, base)
+
+
+# ============================================================
+# Single-flight + stale-while-revalidate
+# ------------------------------------------------------------
+# Un seul remplissage par clé : entre threads d'un worker (Future partagé)
+# et entre workers (verrou Redis table_lock:{clé} + jeton de fencing).
+# Les suiveurs attendent le blob du leader. Le leader n'écrit que si son
+# verrou est toujours à lui : un leader expiré ne peut pas écraser le suivant.
+# ============================================================
+
+_inflight = {}
+_inflight_lock = threading.Lock()
+
+
+class _LockLost(Exception):
+    pass
+
+
+def _single_flight(key, fn):
+    with _inflight_lock:
+        fut = _inflight.get(key)
+        leader = fut is None
+        if leader:
+            fut = _inflight[key] = Future()
+    if not leader:
+        return fut.result()
+    try:
+        result = fn()
+        fut.set_result(result)
+        return result
+    except BaseException as e:
+        fut.set_exception(e)
+        raise
+    finally:
+        with _inflight_lock:
+            _inflight.pop(key, None)
+
+
+def _acquire_fill_lock(key):
+    token = str(redis_client.incr(fence_key(key)))
+    if redis_client.set(lock_key(key), token, nx=True, px=TABLE_LOCK_TTL_MS):
+        return token
+    return None
+
+
+def _store_unit(unit, key, data, token, keepttl):
+    """Écriture fencée du blob + marqueur de fraîcheur, puis libération du verrou."""
+    delta = unit[0] in DELTA_SYNC_TABLES
+    # le TTL du blob borne l'âge du snapshot : à expiration, réconciliation complète
+    ttl = TABLE_RECONCILE_TTL if delta else TABLE_CACHE_TTL + TABLE_STALE_GRACE
+    blob = encode_table(data)
+
+    def _write(pipe):
+        if pipe.get(lock_key(key)) != token.encode():
+            raise _LockLost(key)
+        previous = pipe.get(key)  # en-tête remplacé : ses morceaux sont retirés
+        # delta sync : le snapshot garde son échéance de réconciliation
+        blob_ttl = remaining_ttl(pipe, key, ttl) if keepttl and delta else ttl
+        pipe.multi()
+        write_blob(pipe, key, blob, blob_ttl, previous=previous)
+        pipe.setex(fresh_key(key), TABLE_CACHE_TTL, 1)
+        pipe.delete(lock_key(key))
+
+    try:
+        redis_bin.transaction(_write, lock_key(key), key)
+    except _LockLost:
+        print(f"[CACHE] Verrou perdu pour {key}, écriture abandonnée")
+
+
+def _fill_unit(unit, key, base=None, wait=True):
+    """
+    Remplit une unité sous verrou. Suiveur : attend le blob du leader (wait=True)
+    ou abandonne (wait=False, rafraîchissement en tâche de fond).
+    """
+    token = _acquire_fill_lock(key)
+    if token is None:
+        if not wait:
+            return None
+        deadline = time.monotonic() + TABLE_LOCK_WAIT
+        delay = 0.02
+        while time.monotonic() < deadline:
+            time.sleep(delay)
+            delay = min(delay * 2, 0.5)
+            blob = read_blobs(redis_bin, [key])[0]
+            if blob:
+                return decode_table(blob)
+            if not redis_client.exists(lock_key(key)):
+                break
+        token = _acquire_fill_lock(key)
+    data = _refresh_unit(unit, base)
+    if token is not None:
+        _store_unit(unit, key, data, token, keepttl=base is not None)
+    return data
+
+
+def _revalidate(unit, key, version, base):
+    """Rafraîchissement en tâche de fond d'un blob servi périmé."""
+    try:
+        base = base if unit[0] in DELTA_SYNC_TABLES else None
+        data = _single_flight(key, lambda: _fill_unit(unit, key, base, wait=False))
+        if data is not None:
+            l1_cache.put(key, version, data)
+    except Exception as e:
+        print(f"[CACHE] Échec du rafraîchissement de {key}: {e}")
+
+
+def _plan_table_loads(rpcs, dependencies=None):
+    """
+    Découpe chaque table en unités de chargement :
+    (table, colonnes, tranche, filtre date). Les tables bornées en dates
+    sont découpées en tranches mensuelles, mises en cache séparément.
+    """
+    if dependencies is None:
+        dependencies = WIDGET_DEPENDENCIES
+    columns = needed_columns(rpcs, dependencies)
+    windows = needed_windows(rpcs, dependencies)
+    units = []
+    for table in sorted(columns):
+        window = windows.get(table)
+        date_col = _date_column(table, window[0]) if window else None
+        if date_col is None:
+            units.append((table, columns[table], None, None))
+            continue
+        for lo, hi in month_slices(window[1], window[2]):
+            part = f"{date_col}:{lo.strftime('%Y-%m')}"
+            units.append((table, columns[table], part, (date_col, lo, hi)))
+    return units
+
+
+def _rollups_wanted(rpcs):
+    return sorted({n for rpc in rpcs for n in WIDGET_ROLLUPS.get(rpc.rpc_name, ())})
+
+
+def _rollup_plan(rpcs, ready):
+    """
+    RPC du lot servies par les agrégats journaliers (WIDGET_ROLLUPS) :
+    une RPC l'est si ses agrégats sont prêts (ready) et sa fenêtre bornée ;
+    ses tables remplacées sortent alors de ses dépendances (un nom de RPC
+    dont une instance n'est pas servie garde ses tables).
+    Retourne (dépendances effectives, {agrégat: (début, fin)}).
+    """
+    spans, served, raw = {}, set(), set()
     for rpc in rpcs:
-        needed_tables.update(WIDGET_DEPENDENCIES.get(rpc.rpc_name, []))
+        names = WIDGET_ROLLUPS.get(rpc.rpc_name)
+        if not names:
+            continue
+        resolver, per_table = WIDGET_DATE_WINDOWS.get(rpc.rpc_name, (None, {}))
+        window = resolver(rpc.params or {}) if resolver else None
+        if window is None or not set(names) <= ready:
+            raw.add(rpc.rpc_name)
+            continue
+        served.add(rpc.rpc_name)
+        for n in names:
+            lo = window[0] - timedelta(days=per_table[ROLLUPS[n].date_table][1])
+            cur = spans.get(n)
+            spans[n] = (min(cur[0], lo), max(cur[1], window[1])) if cur else (lo, window[1])
+    if not served - raw:
+        return WIDGET_DEPENDENCIES, spans
+
+    dependencies = dict(WIDGET_DEPENDENCIES)
+    for name in served - raw:
+        replaced = {t for n in WIDGET_ROLLUPS[name] for t in ROLLUPS[n].replaces}
+        dependencies[name] = [t for t in WIDGET_DEPENDENCIES.get(name, []) if t not in replaced]
+    return dependencies, spans
 
-    loaded = {}
-    for table in needed_tables:
-        cache_key = f"table_cache:{table}"
-        cached = redis_client.get(cache_key)
 
-        if cached:
-            print(f"[CACHE] Table {table} récupérée depuis Redis")
-            loaded[table] = json.loads(cached)
+async def _load_rollups(spans):
+    """Agrégats du lot : cache L1 par version d'agrégat, sinon un pipeline Redis par agrégat."""
+    names = sorted(spans)
+    if not names:
+        return {}
+    versions = await aredis_client.mget([rollup_version_key(n) for n in names])
+    out = {}
+    for name, raw in zip(names, versions):
+        lo, hi = spans[name]
+        key, version = f"{table_key(name)}:{lo}:{hi}", parse_version(raw)
+        rollup = l1_cache.get(key, version)
+        if rollup is None:
+            rollup = await aread_rollup(aredis_client, name, lo, hi)
+            l1_cache.put(key, version, rollup)
+        out[table_key(name)] = rollup
+    return out
+
+
+def rebuild_rollups(names=None):
+    """Reconstruit les agrégats journaliers depuis Supabase (python -m services.rollups)."""
+    for name in names or sorted(ROLLUPS):
+        spec = ROLLUPS[name]
+        tables = {spec.table: _fetch_table(spec.table, spec.columns)}
+        if spec.parent is not None:
+            tables[spec.parent.table] = _fetch_table(spec.parent.table, spec.parent.columns)
+        rebuild_rollup(redis_client, name, tables)
+
+
+async def _warm_table_columns(tables):
+    """Schémas des tables filtrées en dates, lus en async avant la planification (sync)."""
+    missing = [t for t in tables if l1_cache.get(schema_key(t), "schema") is None]
+    if not missing:
+        return
+    cached = await aredis_client.mget([schema_key(t) for t in missing])
+    for table, raw in zip(missing, cached):
+        if raw:
+            columns = json.loads(raw)
         else:
-            print(f"[SUPABASE] Chargement table {table}")
-            res = supabase.table(table).select("*").execute()
-            data = res.data or []
+            client = await get_async_supabase()
+            res = await client.table(table).select("*").limit(1).execute()
+            columns = list(res.data[0].keys()) if res.data else []
+            await aredis_client.setex(schema_key(table), TABLE_SCHEMA_TTL, json.dumps(columns))
+        l1_cache.put(schema_key(table), "schema", columns)
+
+
+def _on_fetch_pool(fn, *args):
+    # contexte copié : le temps Redis du pool compte dans celui de la requête
+    return asyncio.wrap_future(table_fetch_pool.submit(contextvars.copy_context().run, fn, *args))
+
+
+async def load_needed_tables(rpcs):
+    """
+    1 MGET pour les versions, 1 MGET pour les blobs absents du cache L1,
+    puis les tables manquantes sont chargées depuis Supabase en parallèle :
+    la latence à froid suit la table la plus lente, pas la somme.
+    Chaque table n'est chargée que sur l'union des colonnes déclarées dans
+    WIDGET_COLUMNS par les RPC du lot, avec un cache par projection, et
+    seulement sur la plage de dates utile (WIDGET_DATE_WINDOWS), par mois.
+    Un blob périmé reste servi pendant TABLE_STALE_GRACE et est rafraîchi en
+    tâche de fond (delta sync pour DELTA_SYNC_TABLES) ; un blob absent est
+    chargé une seule fois pour tous les workers (single-flight).
+    Les RPC servies par les agrégats journaliers (WIDGET_ROLLUPS) reçoivent
+    l'agrégat sur leur fenêtre à la place des tables de faits.
+    Lectures Redis en async ; décodage des blobs et remplissages (Supabase,
+    verrous) sur table_fetch_pool : la boucle d'événements n'attend jamais.
+    """
+    wanted = _rollups_wanted(rpcs)
+    flags = await aredis_client.mget([ready_key(n) for n in wanted]) if wanted else []
+    dependencies, spans = _rollup_plan(rpcs, {n for n, flag in zip(wanted, flags) if flag})
+    rollups = await _load_rollups(spans)
+    await _warm_table_columns(sorted(t for t, w in needed_windows(rpcs, dependencies).items() if w))
+    units = _plan_table_loads(rpcs, dependencies)
+    if not units:
+        return rollups
+
+    tables = sorted({u[0] for u in units})
+    versions = {
+        t: parse_version(v)
+        for t, v in zip(tables, await aredis_client.mget([version_key(t) for t in tables]))
+    }
+    keys = [cache_key(t, cols, part) for t, cols, part, _ in units]
+
+    parts = [l1_cache.get(key, versions[u[0]]) for key, u in zip(keys, units)]
+    pending = [i for i, p in enumerate(parts) if p is None]
+
+    if pending:
+        # la table complète (même tranche), si elle est déjà en cache, sert aussi toute projection
+        n_pending = len(pending)
+        lookup = [keys[i] for i in pending] + [cache_key(units[i][0], None, units[i][2]) for i in pending]
+        lookup += [fresh_key(keys[i]) for i in pending]
+        blobs = await aread_blobs(aredis_bin, lookup)
+        hits = [(n, i, blobs[n] or blobs[n_pending + n]) for n, i in enumerate(pending)]
+        hits = [h for h in hits if h[2]]
+        decoded = await _on_fetch_pool(lambda: [decode_table(blob) for _, _, blob in hits]) if hits else []
+        misses = sorted(set(pending) - {i for _, i, _ in hits})
+        for (n, i, _), data in zip(hits, decoded):
+            print(f"[CACHE] Table {keys[i]} récupérée depuis Redis")
+            parts[i] = data
+            version = versions[units[i][0]]
+            if blobs[2 * n_pending + n]:
+                l1_cache.put(keys[i], version, parts[i])
+            else:
+                # périmé : servi tel quel, un seul worker le rafraîchit en tâche de fond
+                l1_cache.put(keys[i], version, parts[i], ttl=TABLE_STALE_L1_TTL)
+                base = parts[i] if blobs[n] else None  # repli table complète : pas de delta
+                table_fetch_pool.submit(_revalidate, units[i], keys[i], version, base)
+
+        if misses:
+            fetched = await asyncio.gather(*(
+                _on_fetch_pool(_single_flight, keys[i], partial(_fill_unit, units[i], keys[i]))
+                for i in misses
+            ))
+            for i, data in zip(misses, fetched):
+                parts[i] = data
+                l1_cache.put(keys[i], versions[units[i][0]], data)
+
+    by_table = {}
+    for key, u, data in zip(keys, units, parts):
+        by_table.setdefault(u[0], []).append((key, data))
+    return {**{t: _assemble(t, p, versions[t]) for t, p in by_table.items()}, **rollups}
+
+
+class _Assembled:
+    """Concaténation de tranches, valable tant que les tranches sont les mêmes objets."""
+    __slots__ = ("parts", "table")
 
-            redis_client.setex(cache_key, 300, json.dumps(data))  
-            loaded[table] = data
+    def __init__(self, parts, table):
+        self.parts = parts
+        self.table = table
 
-    return loaded
+    def nbytes(self):
+        return self.table.nbytes()
+
+
+def _assemble(table, parts, version):
+    """
+    Tranches mensuelles concaténées, gardées en L1 pour la version : la même
+    fenêtre rend le même objet, avec ses index de jointure (table_store.index_by…).
+    Une tranche rafraîchie (revalidation) est un nouvel objet : concaténation refaite.
+    """
+    if len(parts) == 1:
+        return parts[0][1]
+    key = f"{table}:concat:" + "|".join(k for k, _ in parts)
+    datas = [d for _, d in parts]
+    entry = l1_cache.get(key, version)
+    if entry is None or len(entry.parts) != len(datas) or any(a is not b for a, b in zip(entry.parts, datas)):
+        entry = _Assembled(datas, ColumnarTable.concat(datas))
+        l1_cache.put(key, version, entry)
+    return entry.table
 
 WIDGET_DEPENDENCIES = {
    "chart_duree_changelog": ["changelog"],
@@ -176,11 +819,11 @@ WIDGET_DEPENDENCIES = {
     "kpi_sup_return_rate": ["reception_fournisseur", "retour_fournisseur"],
     "kpi_sup_avg_lead_time_days": ["commande_fournisseur", "reception_fournisseur"],
     "kpi_sup_transport_cost_ratio": ["commande_fournisseur", "ligne_cmd_fournisseur", "reception_fournisseur"],
-    "rpc_stock_disponible_series": ["stock"],
+    "rpc_stock_disponible_series": ["stock", "mouvement_stock"],
     "rpc_days_on_hand_series": ["stock", "mouvement_stock"],
-    "rpc_taux_rotation_series": ["stock", "commandeclient", "lignecommande", "produit"],
-    "rpc_inventory_to_sales_series": ["stock", "commandeclient", "lignecommande", "produit"],
-    "rpc_rentabilite_stock_series": ["stock", "commandeclient", "lignecommande", "produit"],
+    "rpc_taux_rotation_series": ["stock", "mouvement_stock", "commandeclient", "lignecommande", "produit"],
+    "rpc_inventory_to_sales_series": ["stock", "mouvement_stock", "commandeclient", "lignecommande", "produit"],
+    "rpc_rentabilite_stock_series": ["stock", "mouvement_stock", "commandeclient", "lignecommande", "produit"],
     "rpc_taux_rupture_series": ["stock", "mouvement_stock", "commandeclient", "lignecommande"],
     # ⚠️ Cette série lit la table "peremption"
     "rpc_remaining_shelf_life_series": ["peremption"],
@@ -204,3 +847,113 @@ WIDGET_DEPENDENCIES = {
 
 
 }
+
+
+# ============================================================
+# Colonnes lues par chaque RPC (projection des selects Supabase)
+# ------------------------------------------------------------
+# Une table absente ici pour une RPC est chargée en entier ("*").
+# Les alias (datemouvement / date_mouvement…) sont tous listés : seuls ceux
+# qui existent réellement dans la table sont demandés.
+# ============================================================
+
+_CMD_DATES = ["date_commande", "date_prevue_livraison", "date_reelle_livraison", "date_expedition"]
+_MODES = ["id", "nom"]
+_MVT = ["id", "stock_id", "entrepot_id", "produit_id", "typemouvement", "type_mouvement",
+        "datemouvement", "date_mouvement", "quantite", "qte"]
+_STOCK = ["id", "produit_id", "entrepot_id", "quantitedisponible", "quantitereserve"]
+_PEREMPTION = ["id", "stock_id", "produit_id", "dateexpiration", "date_expiration", "quantite", "qte"]
+_CMD_LIVREE = ["id", "date_reelle_livraison"]
+_LIGNES_CMD = ["commande_id", "produit_id", "quantite_commandee", "quantite", "prix_unitaire", "prix"]
+_PRODUIT_PRIX = ["id", "prix"]
+_CHANGELOG = ["commande_id", "statut", "date_changement_statut"]
+_SUP_CMD_ID = ["commande_id", "commande_fournisseur_id", "commandefournisseur_id", "id_commandefournisseur"]
+_SUP_CMD = ["id", "date_commande", "datecommande", "date_prevue_livraison", "dateprevuelivraison", "date_prevue",
+            "date_reelle_livraison", "datereellelivraison"]
+_SUP_REC = _SUP_CMD_ID + ["id", "date_reception", "datereception", "datevalidation", "date_reelle_livraison",
+                          "date_prevue_livraison", "date_prevue", "date_prevue_reception",
+                          "statut_conformite", "statutconformite"]
+_SUP_RET = ["id", "date_retour", "dateretour"]
+_SUP_LIGNE = _SUP_CMD_ID + ["id", "date_reception", "datereception", "dateprevisionnelle",
+                            "quantite_recue", "quantiterecue", "statut_conformite", "statutconformite"]
+_SUP_CMD_COUTS = _SUP_CMD + ["cout_transport", "couttransport", "montant_commande", "montantcommande"]
+_SUP = {
+    "commande_fournisseur": _SUP_CMD_COUTS,
+    "reception_fournisseur": _SUP_REC,
+    "retour_fournisseur": _SUP_RET,
+    "ligne_cmd_fournisseur": _SUP_LIGNE,
+}
+# _window_30d (stock/kpi.py) lit aussi les dates commandeclient / mouvement_stock / peremption
+_STOCK_TABLES = {
+    "stock": _STOCK,
+    "mouvement_stock": _MVT,
+    "commandeclient": _CMD_LIVREE,
+    "lignecommande": _LIGNES_CMD,
+    "produit": _PRODUIT_PRIX,
+    "peremption": _PEREMPTION,
+}
+
+WIDGET_COLUMNS = {
+    "chart_duree_changelog": {"changelog": _CHANGELOG},
+    "kpi_duree_moyenne_changelog": {"changelog": _CHANGELOG},
+    "get_table_change_log": {"changelog": _CHANGELOG},
+    "chart_duree_cycle_moyenne": {"commandeclient": _CMD_DATES + ["mode_livraison_id"], "modelivraison": _MODES},
+    "chart_taux_annulation": {"commandeclient": _CMD_DATES + ["statut", "mode_livraison_id"], "modelivraison": _MODES},
+    "chart_otif": {"commandeclient": _CMD_DATES + ["statut", "mode_livraison_id"], "modelivraison": _MODES},
+    "chart_taux_retard": {"commandeclient": _CMD_DATES + ["statut", "mode_livraison_id"], "modelivraison": _MODES},
+    "chart_commandes_client": {"commandeclient": _CMD_DATES + ["statut", "mode_livraison_id"], "modelivraison": _MODES},
+    "get_table_cmd_clients": {"commandeclient": _CMD_DATES + ["id", "statut", "contact_id"], "contact": ["id", "nom"]},
+    "kpi_nb_commandes": {"commandeclient": ["id", "statut"]},
+    "kpi_taux_retards": {"commandeclient": ["id"] + _CMD_DATES},
+    "kpi_otif": {"commandeclient": ["id"] + _CMD_DATES},
+    "kpi_taux_annulation": {"commandeclient": ["id", "statut"]},
+    "kpi_duree_cycle_moyenne_jours": {"commandeclient": ["id"] + _CMD_DATES},
+
+    **{name: _STOCK_TABLES for name in (
+        "kpi_quantite_stock", "kpi_quantite_reservee", "kpi_stock_disponible", "kpi_days_on_hand",
+        "kpi_taux_rotation", "kpi_inventory_to_sales", "kpi_rentabilite_stock", "kpi_taux_rupture",
+        "kpi_remaining_shelf_life_avg", "kpi_produits_proches_peremption", "kpi_contraction_stock_qte",
+    )},
+    **{name: _STOCK_TABLES for name in (
+        "rpc_stock_disponible_series", "rpc_days_on_hand_series", "rpc_taux_rotation_series",
+        "rpc_inventory_to_sales_series", "rpc_rentabilite_stock_series", "rpc_taux_rupture_series",
+        "rpc_remaining_shelf_life_series", "rpc_shrinkage_by_day",
+    )},
+    **{name: _SUP for name in (
+        "kpi_sup_on_time_rate", "kpi_sup_quality_conform_rate", "kpi_sup_quality_nonconform_rate",
+        "kpi_sup_return_rate", "kpi_sup_avg_lead_time_days", "kpi_sup_transport_cost_ratio",
+        "rpc_sup_on_time_rate_series", "rpc_sup_quality_conform_rate_series",
+        "rpc_sup_quality_nonconform_rate_series", "rpc_sup_return_rate_series",
+        "rpc_sup_avg_lead_time_days_series", "rpc_sup_transport_cost_ratio_series",
+    )},
+
+    "prod_volume_ok":          {"sortie_production": ["quantite_ok"]},
+    "prod_volume_nok":         {"sortie_production": ["quantite_nok"]},
+    "prod_volume_total":       {"sortie_production": ["quantite_ok", "quantite_nok"]},
+    "prod_taux_qualite":       {"sortie_production": ["quantite_ok", "quantite_nok"]},
+    "prod_taux_defauts":       {"sortie_production": ["quantite_ok", "quantite_nok"]},
+    "prod_rendement_vs_cible": {"sortie_production": ["id_op", "quantite_ok"], "ordre_production": ["id_op", "quantite_cible"]},
+    "prod_lead_time_of":       {"ordre_production": ["id_op", "date_lancement_reelle", "date_fin_reelle"],
+                                "phase_production": ["id_op", "debut_reel", "fin_reel"]},
+    "prod_wip_op_en_cours":    {"ordre_production": ["etat"]},
+}
+
+
+# ============================================================
+# Agrégats journaliers lus par chaque RPC (services/rollups.py)
+# ------------------------------------------------------------
+# Quand ils sont prêts et la fenêtre bornée, la RPC reçoit l'agrégat à la
+# place des tables de faits qu'il remplace (ROLLUPS[...].replaces).
+# ============================================================
+
+WIDGET_ROLLUPS = {
+    "rpc_stock_disponible_series": (MVT_DAILY,),
+    "rpc_days_on_hand_series": (MVT_DAILY,),
+    "rpc_taux_rotation_series": (MVT_DAILY, VENTES_DAILY),
+    "rpc_inventory_to_sales_series": (MVT_DAILY, VENTES_DAILY),
+    "rpc_rentabilite_stock_series": (MVT_DAILY, VENTES_DAILY),
+    "rpc_taux_rupture_series": (MVT_DAILY, VENTES_DAILY),
+    "rpc_shrinkage_by_day": (MVT_DAILY,),
+    "rpc_sup_quality_conform_rate_series": (RECEPTIONS_DAILY,),
+    "rpc_sup_return_rate_series": (RECEPTIONS_DAILY,),
+}
@@ -2,22 +2,11 @@ from __future__ import annotations
 from datetime import date, datetime, timedelta
 from typing import Any, Dict, List, Optional
 
-
-def _parse_date(v: Any) -> Optional[date]:
-    if v in (None, "", "null"): 
-        return None
-    if isinstance(v, date):
-        return v
-    s = str(v)
-    for fmt in ("%Y-%m-%d","%Y/%m/%d","%d/%m/%Y","%Y-%m-%d %H:%M:%S","%Y-%m-%dT%H:%M:%S"):
-        try:
-            return datetime.strptime(s[:len(fmt)], fmt).date()
-        except:
-            pass
-    try:
-        return datetime.fromisoformat(s).date()
-    except:
-        return None
+from services.table_dates import parse_date as _parse_date
+from services.table_store import row_date as _row_date, index_by, table_index
+from services.rolling import RollingSum, rolling_range
+from services.compute_graph import node
+from services.rollups import RECEPTIONS_DAILY, rollup_for
 
 def _between(d: Optional[date], a: date, b: date) -> bool:
     return bool(d and a <= d <= b)
@@ -33,21 +22,22 @@ def _g(row: Dict[str, Any], *names: str, default=None):
     return default
 
 # ---- Fenêtre auto basée sur les données fournisseur (si start/end absents) ----
+@node("fournisseur.latest_date_chart")
 def _latest_sup_date(tables: Dict[str, Any]) -> Optional[date]:
     pool: List[date] = []
 
     for c in (tables.get("commande_fournisseur", []) or []):
         for k in ("datereellelivraison","dateprevuelivraison","datecommande",
                   "date_reelle_livraison","date_prevue_livraison","date_commande"):
-            pool.append(_parse_date(c.get(k)))
+            pool.append(_row_date(c, k))
 
     for r in (tables.get("reception_fournisseur", []) or []):
         for k in ("datereception","datevalidation","date_reception","date_reelle_livraison"):
-            pool.append(_parse_date(r.get(k)))
+            pool.append(_row_date(r, k))
 
     for ret in (tables.get("retour_fournisseur", []) or []):
         for k in ("dateretour","date_retour"):
-            pool.append(_parse_date(ret.get(k)))
+            pool.append(_row_date(ret, k))
 
     pool = [d for d in pool if d]
     return max(pool) if pool else None
@@ -71,11 +61,11 @@ def _resolve_window_sup(tables: Dict[str, Any],
 # 1) % livraisons à l'heure (<= date prévue)
 # -------- On-Time rate (livré à l'heure %) — robuste --------
 def rpc_sup_on_time_rate_series(tables, start_date: str | None = None, end_date: str | None = None):
-    start, end = _resolve_window(start_date, end_date, 6)
+    start, end = _resolve_window_sup(tables, start_date, end_date, 6)
     days = _days_range(start, end)
 
     recs = tables.get("reception_fournisseur", []) or []
-    cmds_by_id = {c.get("id"): c for c in (tables.get("commande_fournisseur", []) or [])}
+    cmds_by_id = index_by(tables.get("commande_fournisseur", []) or [])
 
     def _planned_date(rec, cmd):
         """
@@ -84,11 +74,11 @@ def rpc_sup_on_time_rate_series(tables, start_date: str | None = None, end_date:
         """
         # Essayer côté réception
         for k in ("date_prevue_livraison", "date_prevue", "date_prevue_reception"):
-            d = _parse_date((rec or {}).get(k))
+            d = _row_date(rec or {}, k)
             if d: return d
         # Puis côté commande
         for k in ("date_prevue_livraison", "date_prevue"):
-            d = _parse_date((cmd or {}).get(k))
+            d = _row_date(cmd or {}, k)
             if d: return d
 
         # OPTIONAL fallback: date_commande + delai_prevu_jours
@@ -106,36 +96,34 @@ def rpc_sup_on_time_rate_series(tables, start_date: str | None = None, end_date:
         Date réelle de livraison: privilégier la réception, sinon commande.
         """
         for k in ("date_reception", "date_reelle_livraison"):
-            d = _parse_date((rec or {}).get(k))
+            d = _row_date(rec or {}, k)
             if d: return d
         for k in ("date_reelle_livraison",):
-            d = _parse_date((cmd or {}).get(k))
+            d = _row_date(cmd or {}, k)
             if d: return d
         return None
 
-    out = []
-    for d in days:
-        win_start = d - timedelta(days=29)
-        total = on_time = 0
-
-        for r in recs:
-            cmd = cmds_by_id.get(
-                _g(r, "commande_id", "commandefournisseur_id", "id_commandefournisseur", "commande_fournisseur_id")
-            )
-
-            planned = _planned_date(r, cmd)
-            actual  = _actual_date(r, cmd)
+    # une passe sur les réceptions, ventilées par date réelle (fenêtre glissante 30j)
+    lo, hi = rolling_range(start, end)
+    total_by_day, on_time_by_day = RollingSum(lo, hi), RollingSum(lo, hi)
+    for r in recs:
+        cmd = cmds_by_id.get(
+            _g(r, "commande_id", "commandefournisseur_id", "id_commandefournisseur", "commande_fournisseur_id")
+        )
 
-            if not (planned and actual):
-                continue  # sans date prévue et réelle on ne peut rien conclure
+        planned = _planned_date(r, cmd)
+        actual  = _actual_date(r, cmd)
 
-            if not _between(actual, win_start, d):
-                continue  # fenêtre glissante 30j
+        if not (planned and actual):
+            continue  # sans date prévue et réelle on ne peut rien conclure
 
-            total += 1
-            if actual <= planned:
-                on_time += 1
+        total_by_day.add(actual)
+        if actual <= planned:
+            on_time_by_day.add(actual)
 
+    out = []
+    for d in days:
+        total, on_time = total_by_day.window(d), on_time_by_day.window(d)
         val = round(100.0 * on_time / total, 2) if total > 0 else 0.0
         out.append({"day": d.strftime("%Y-%m-%d"), "On-Time %": val})
 
@@ -147,20 +135,29 @@ def rpc_sup_quality_conform_rate_series(tables, start_date: str | None = None, e
     days = _days_range(start, end)
     recs = tables.get("reception_fournisseur", []) or []
 
+    lo, hi = rolling_range(start, end)
+    total_by_day, ok_by_day = RollingSum(lo, hi), RollingSum(lo, hi)
+    rollup = rollup_for(tables, RECEPTIONS_DAILY, lo, hi)
+    if rollup is not None:
+        recs = []
+        for r in rollup:
+            dr = _row_date(r, "day")
+            total_by_day.add(dr, r.get("n_statut"))
+            ok_by_day.add(dr, r.get("n_conforme"))
+    for r in recs:
+        dr = _row_date(r, "date_reception","date_reelle_livraison","datereception","datevalidation")
+        if not _between(dr, lo, hi):
+            continue
+        statut = str(_g(r, "statut_conformite","statutconformite","")).lower()
+        if not statut:
+            continue
+        total_by_day.add(dr)
+        if statut in ("conforme","ok","valide"):
+            ok_by_day.add(dr)
+
     out = []
     for d in days:
-        win_start = d - timedelta(days=29)
-        total = ok = 0
-        for r in recs:
-            dr = _parse_date(_g(r, "date_reception","date_reelle_livraison","datereception","datevalidation"))
-            if not _between(dr, win_start, d): 
-                continue
-            statut = str(_g(r, "statut_conformite","statutconformite","")).lower()
-            if not statut:
-                continue
-            total += 1
-            if statut in ("conforme","ok","valide"):
-                ok += 1
+        total, ok = total_by_day.window(d), ok_by_day.window(d)
         val = round(100.0 * ok / total, 2) if total > 0 else 0.0
         out.append({"day": d.strftime("%Y-%m-%d"), "Conformité %": val})
     return out
@@ -170,25 +167,27 @@ def rpc_sup_quality_nonconform_rate_series(tables, start_date: str | None = None
     start, end = _resolve_window_sup(tables, start_date, end_date, 6)
     days = _days_range(start, end)
     lignes = tables.get("ligne_cmd_fournisseur", []) or []
-    cmds_by_id = {c.get("id"): c for c in (tables.get("commande_fournisseur", []) or [])}
+    cmds_by_id = index_by(tables.get("commande_fournisseur", []) or [])
+
+    lo, hi = rolling_range(start, end)
+    q_total_by_day, q_nc_by_day = RollingSum(lo, hi), RollingSum(lo, hi)
+    for l in lignes:
+        cmd = cmds_by_id.get(_g(l, "commande_id","commandefournisseur_id","id_commandefournisseur"))
+        dref = (
+            _row_date(cmd or {}, "date_reelle_livraison","datereellelivraison") 
+            or _row_date(l, "date_reception","datereception","dateprevisionnelle")
+        )
+        if not _between(dref, lo, hi):
+            continue
+        qrec = float(_g(l, "quantite_recue","quantiterecue", default=0) or 0)
+        statut = str(_g(l, "statut_conformite","statutconformite","")).lower()
+        q_total_by_day.add(dref, max(0.0, qrec))
+        if statut in ("nonconforme","non_conforme","rejet","defaut"):
+            q_nc_by_day.add(dref, max(0.0, qrec))
 
     out = []
     for d in days:
-        win_start = d - timedelta(days=29)
-        q_total = q_nc = 0.0
-        for l in lignes:
-            cmd = cmds_by_id.get(_g(l, "commande_id","commandefournisseur_id","id_commandefournisseur"))
-            dref = (
-                _parse_date(_g(cmd or {}, "date_reelle_livraison","datereellelivraison")) 
-                or _parse_date(_g(l, "date_reception","datereception","dateprevisionnelle"))
-            )
-            if not _between(dref, win_start, d): 
-                continue
-            qrec = float(_g(l, "quantite_recue","quantiterecue", default=0) or 0)
-            statut = str(_g(l, "statut_conformite","statutconformite","")).lower()
-            q_total += max(0.0, qrec)
-            if statut in ("nonconforme","non_conforme","rejet","defaut"):
-                q_nc += max(0.0, qrec)
+        q_total, q_nc = q_total_by_day.window(d), q_nc_by_day.window(d)
         val = round(100.0 * q_nc / q_total, 2) if q_total > 0 else 0.0
         out.append({"day": d.strftime("%Y-%m-%d"), "Non-conformité %": val})
     return out
@@ -200,41 +199,58 @@ def rpc_sup_return_rate_series(tables, start_date: str | None = None, end_date:
     retours = tables.get("retour_fournisseur", []) or []
     recs    = tables.get("reception_fournisseur", []) or []
 
+    lo, hi = rolling_range(start, end)
+    ret_by_day, rec_by_day = RollingSum(lo, hi), RollingSum(lo, hi)
+    for r in retours:
+        ret_by_day.add(_row_date(r, "date_retour","dateretour"))
+    rollup = rollup_for(tables, RECEPTIONS_DAILY, lo, hi)
+    if rollup is not None:
+        recs = []
+        for r in rollup:
+            rec_by_day.add(_row_date(r, "day"), r.get("n"))
+    for r in recs:
+        rec_by_day.add(_row_date(r, "date_reception","date_reelle_livraison","datereception","datevalidation"))
+
     out = []
     for d in days:
-        win_start = d - timedelta(days=29)
-        nb_ret = sum(1 for r in retours if _between(_parse_date(_g(r, "date_retour","dateretour")), win_start, d))
-        nb_rec = sum(1 for r in recs    if _between(_parse_date(_g(r, "date_reception","date_reelle_livraison","datereception","datevalidation")), win_start, d))
+        nb_ret, nb_rec = ret_by_day.window(d), rec_by_day.window(d)
         val = round(100.0 * nb_ret / nb_rec, 2) if nb_rec > 0 else 0.0
         out.append({"day": d.strftime("%Y-%m-%d"), "Retours %": val})
     return out
 
+def _first_reception_by_cmd(recs) -> Dict[Any, date]:
+    """Première date de réception par commande (gardée avec la table des réceptions)."""
+    first: Dict[Any, date] = {}
+    for r in recs:
+        cid = _g(r, "commande_id","commandefournisseur_id","id_commandefournisseur")
+        drec = _row_date(r, "date_reception","date_reelle_livraison","datereception","datevalidation")
+        if cid is not None and drec and (cid not in first or drec < first[cid]):
+            first[cid] = drec
+    return first
+
 # 5) Lead time moyen (jours)
 def rpc_sup_avg_lead_time_days_series(tables, start_date: str | None = None, end_date: str | None = None):
     start, end = _resolve_window_sup(tables, start_date, end_date, 6)
     days = _days_range(start, end)
     cmds = tables.get("commande_fournisseur", []) or []
     recs = tables.get("reception_fournisseur", []) or []
-    recs_by_cmd: Dict[Any, List[date]] = {}
-    for r in recs:
-        cid = _g(r, "commande_id","commandefournisseur_id","id_commandefournisseur")
-        drec = _parse_date(_g(r, "date_reception","date_reelle_livraison","datereception","datevalidation"))
-        if cid is not None and drec:
-            recs_by_cmd.setdefault(cid, []).append(drec)
+    first_rec_by_cmd = table_index(recs, _first_reception_by_cmd)
+
+    # moyenne glissante = somme des délais / nombre de commandes, par jour de réception
+    lo, hi = rolling_range(start, end)
+    delais_by_day, nb_by_day = RollingSum(lo, hi), RollingSum(lo, hi)
+    for c in cmds:
+        dcmd = _row_date(c, "date_commande","datecommande")
+        drec = first_rec_by_cmd.get(c.get("id")) or _row_date(c, "date_reelle_livraison","datereellelivraison")
+        if not (dcmd and drec):
+            continue
+        delais_by_day.add(drec, (drec - dcmd).days)
+        nb_by_day.add(drec)
 
     out = []
     for d in days:
-        win_start = d - timedelta(days=29)
-        delais: List[int] = []
-        for c in cmds:
-            dcmd = _parse_date(_g(c, "date_commande","datecommande"))
-            drec = min(recs_by_cmd.get(c.get("id"), []), default=None) or _parse_date(_g(c, "date_reelle_livraison","datereellelivraison"))
-            if not (dcmd and drec):
-                continue
-            if not _between(drec, win_start, d):
-                continue
-            delais.append((drec - dcmd).days)
-        val = round(sum(delais)/len(delais), 2) if delais else 0.0
+        nb = nb_by_day.window(d)
+        val = round(delais_by_day.window(d)/nb, 2) if nb else 0.0
         out.append({"day": d.strftime("%Y-%m-%d"), "Lead time (j)": val})
     return out
 
@@ -244,16 +260,16 @@ def rpc_sup_transport_cost_ratio_series(tables, start_date: str | None = None, e
     days = _days_range(start, end)
     cmds = tables.get("commande_fournisseur", []) or []
 
+    lo, hi = rolling_range(start, end)
+    cost_by_day, base_by_day = RollingSum(lo, hi), RollingSum(lo, hi)
+    for c in cmds:
+        dref = _row_date(c, "date_reelle_livraison","datereellelivraison") or _row_date(c, "date_commande","datecommande")
+        cost_by_day.add(dref, float(_g(c, "cout_transport","couttransport", default=0) or 0))
+        base_by_day.add(dref, float(_g(c, "montant_commande","montantcommande", default=0) or 0))
+
     out = []
     for d in days:
-        win_start = d - timedelta(days=29)
-        cost = base = 0.0
-        for c in cmds:
-            dref = _parse_date(_g(c, "date_reelle_livraison","datereellelivraison")) or _parse_date(_g(c, "date_commande","datecommande"))
-            if not _between(dref, win_start, d):
-                continue
-            cost += float(_g(c, "cout_transport","couttransport", default=0) or 0)
-            base += float(_g(c, "montant_commande","montantcommande", default=0) or 0)
+        cost, base = cost_by_day.window(d), base_by_day.window(d)
         val = round(cost / base, 4) if base > 0 else 0.0
         out.append({"day": d.strftime("%Y-%m-%d"), "Transport/Commande": val})
     return out
@@ -3,23 +3,11 @@ from __future__ import annotations
 from datetime import datetime, date, timedelta
 from typing import Any, Optional, Dict, List
 
-# ---------- utilitaires déjà présents (garde-les) ----------
-def _parse_date(v: Any) -> Optional[date]:
-    if v in (None, "", "null"):
-        return None
-    if isinstance(v, date):
-        return v
-    s = str(v)
-    for fmt in ("%Y-%m-%d","%Y/%m/%d","%d/%m/%Y","%Y-%m-%d %H:%M:%S","%Y-%m-%dT%H:%M:%S"):
-        try:
-            return datetime.strptime(s[:len(fmt)], fmt).date()
-        except:
-            pass
-    try:
-        return datetime.fromisoformat(s).date()
-    except:
-        return None
+from services.table_dates import parse_date as _parse_date
+from services.table_store import row_date as _row_date, index_by, table_index
+from services.compute_graph import node
 
+# ---------- utilitaires déjà présents (garde-les) ----------
 def _between(d: Optional[date], a: date, b: date) -> bool:
     return bool(d and a <= d <= b)
 
@@ -33,18 +21,19 @@ def _days_range(start: date, end: date) -> List[date]:
     return [start + timedelta(days=i) for i in range((end - start).days + 1)]
 
 # ---- même window que les charts ----
+@node("fournisseur.latest_date_kpi")
 def _latest_sup_date(tables: Dict[str, Any]) -> Optional[date]:
     pool: List[date] = []
     for c in (tables.get("commande_fournisseur", []) or []):
         for k in ("date_reelle_livraison","date_prevue_livraison","date_commande",
                   "datereellelivraison","dateprevuelivraison","datecommande"):
-            pool.append(_parse_date(c.get(k)))
+            pool.append(_row_date(c, k))
     for r in (tables.get("reception_fournisseur", []) or []):
         for k in ("date_reception","date_reelle_livraison","datereception","datevalidation"):
-            pool.append(_parse_date(r.get(k)))
+            pool.append(_row_date(r, k))
     for ret in (tables.get("retour_fournisseur", []) or []):
         for k in ("date_retour","dateretour"):
-            pool.append(_parse_date(ret.get(k)))
+            pool.append(_row_date(ret, k))
     pool = [d for d in pool if d]
     return max(pool) if pool else None
 
@@ -72,24 +61,24 @@ def get_sup_on_time_rate(tables: Dict[str, Any],
     start, end = _resolve_window_sup(tables, start_date, end_date)
 
     recs = tables.get("reception_fournisseur", []) or []
-    cmds_by_id = {c.get("id"): c for c in (tables.get("commande_fournisseur", []) or [])}
+    cmds_by_id = index_by(tables.get("commande_fournisseur", []) or [])
 
     def _planned_date(rec, cmd):
         # d'abord sur la réception, puis sur la commande (comme les séries)
         for k in ("date_prevue_livraison", "date_prevue", "date_prevue_reception"):
-            d = _parse_date((rec or {}).get(k))
+            d = _row_date(rec or {}, k)
             if d: return d
         for k in ("date_prevue_livraison", "date_prevue"):
-            d = _parse_date((cmd or {}).get(k))
+            d = _row_date(cmd or {}, k)
             if d: return d
         return None
 
     def _actual_date(rec, cmd):
         for k in ("date_reception", "date_reelle_livraison"):
-            d = _parse_date((rec or {}).get(k))
+            d = _row_date(rec or {}, k)
             if d: return d
         for k in ("date_reelle_livraison",):
-            d = _parse_date((cmd or {}).get(k))
+            d = _row_date(cmd or {}, k)
             if d: return d
         return None
 
@@ -118,7 +107,7 @@ def get_sup_quality_conform_rate(tables: Dict[str, Any],
 
     total = ok = 0
     for r in recs:
-        d = _parse_date(_g(r, "date_reception","date_reelle_livraison","datereception","datevalidation"))
+        d = _row_date(r, "date_reception","date_reelle_livraison","datereception","datevalidation")
         if not _between(d, start, end):
             continue
         statut = str(_g(r, "statut_conformite","statutconformite","")).lower()
@@ -137,14 +126,14 @@ def get_sup_quality_nonconform_rate(tables: Dict[str, Any],
     """(Qté non conforme / Qté totale reçue) * 100 (mêmes clés/logic que chart)."""
     start, end = _resolve_window_sup(tables, start_date, end_date)
     lignes = tables.get("ligne_cmd_fournisseur", []) or []
-    cmds_by_id = {c.get("id"): c for c in (tables.get("commande_fournisseur", []) or [])}
+    cmds_by_id = index_by(tables.get("commande_fournisseur", []) or [])
 
     q_total = q_nc = 0.0
     for l in lignes:
         cmd = cmds_by_id.get(_g(l, "commande_id","commande_fournisseur_id","commandefournisseur_id","id_commandefournisseur"))
         d = (
-            _parse_date(_g(cmd or {}, "date_reelle_livraison","datereellelivraison"))
-            or _parse_date(_g(l, "date_reception","datereception"))
+            _row_date(cmd or {}, "date_reelle_livraison","datereellelivraison")
+            or _row_date(l, "date_reception","datereception")
         )
         if not _between(d, start, end):
             continue
@@ -167,12 +156,23 @@ def get_sup_return_rate(tables: Dict[str, Any],
     retours = tables.get("retour_fournisseur", []) or []
     recs    = tables.get("reception_fournisseur", []) or []
 
-    nb_retours = sum(1 for r in retours if _between(_parse_date(_g(r, "date_retour","dateretour")), start, end))
-    nb_recs    = sum(1 for r in recs    if _between(_parse_date(_g(r, "date_reception","date_reelle_livraison","datereception","datevalidation")), start, end))
+    nb_retours = sum(1 for r in retours if _between(_row_date(r, "date_retour","dateretour"), start, end))
+    nb_recs    = sum(1 for r in recs    if _between(_row_date(r, "date_reception","date_reelle_livraison","datereception","datevalidation"), start, end))
 
     return round(100.0 * nb_retours / nb_recs, 2) if nb_recs > 0 else 0.0
 
 
+def _first_reception_by_cmd(recs) -> Dict[Any, date]:
+    """Première date de réception par commande (gardée avec la table des réceptions)."""
+    first: Dict[Any, date] = {}
+    for r in recs:
+        cid = _g(r, "commande_id","commande_fournisseur_id","commandefournisseur_id","id_commandefournisseur")
+        drec = _row_date(r, "date_reception","date_reelle_livraison","datereception","datevalidation")
+        if cid is not None and drec and (cid not in first or drec < first[cid]):
+            first[cid] = drec
+    return first
+
+
 def get_sup_avg_lead_time_days(tables: Dict[str, Any],
                                start_date: str | None = None,
                                end_date: str | None = None):
@@ -182,17 +182,12 @@ def get_sup_avg_lead_time_days(tables: Dict[str, Any],
     cmds = tables.get("commande_fournisseur", []) or []
     recs = tables.get("reception_fournisseur", []) or []
 
-    recs_by_cmd: Dict[Any, List[date]] = {}
-    for r in recs:
-        cid = _g(r, "commande_id","commande_fournisseur_id","commandefournisseur_id","id_commandefournisseur")
-        drec = _parse_date(_g(r, "date_reception","date_reelle_livraison","datereception","datevalidation"))
-        if cid is not None and drec:
-            recs_by_cmd.setdefault(cid, []).append(drec)
+    first_rec_by_cmd = table_index(recs, _first_reception_by_cmd)
 
     delais: List[int] = []
     for c in cmds:
-        dcmd = _parse_date(_g(c, "date_commande","datecommande"))
-        drec = min(recs_by_cmd.get(c.get("id"), []), default=None) or _parse_date(_g(c, "date_reelle_livraison","datereellelivraison"))
+        dcmd = _row_date(c, "date_commande","datecommande")
+        drec = first_rec_by_cmd.get(c.get("id")) or _row_date(c, "date_reelle_livraison","datereellelivraison")
         if not (dcmd and drec):
             continue
         if not _between(drec, start, end):
@@ -211,7 +206,7 @@ def get_sup_transport_cost_ratio(tables: Dict[str, Any],
 
     cost = base = 0.0
     for c in cmds:
-        dref = _parse_date(_g(c, "date_reelle_livraison","datereellelivraison")) or _parse_date(_g(c, "date_commande","datecommande"))
+        dref = _row_date(c, "date_reelle_livraison","datereellelivraison") or _row_date(c, "date_commande","datecommande")
         if not _between(dref, start, end):
             continue
         cost += float(_g(c, "cout_transport","couttransport", default=0) or 0)
@@ -0,0 +1,73 @@
+# services/rolling.py
+from __future__ import annotations
+from datetime import date, timedelta
+from itertools import accumulate
+from typing import Any, Dict, List, Optional
+
+# ============================================================
+# Agrégats glissants par jour (prefix sums)
+# ------------------------------------------------------------
+# Les séries "fenêtre 30 jours" ([d-29..d] pour chaque jour d) rescannaient
+# toutes les lignes pour chaque jour : O(jours × lignes).
+# Ici les lignes sont ventilées une seule fois par jour, puis chaque somme
+# de fenêtre se lit en O(1) sur les sommes cumulées : O(lignes + jours).
+# Un ratio = deux RollingSum (numérateur / dénominateur), une moyenne =
+# somme / comptage.
+# ============================================================
+
+ROLLING_DAYS = 30
+
+
+class RollingSum:
+    """Somme par jour sur [lo..hi] ; les jours hors plage sont ignorés."""
+    __slots__ = ("lo", "_buckets", "_prefix")
+
+    def __init__(self, lo: date, hi: date):
+        self.lo = lo.toordinal()
+        self._buckets: List[float] = [0.0] * max(0, (hi - lo).days + 1)
+        self._prefix: Optional[List[float]] = None
+
+    def add(self, d: Optional[date], value: float = 1.0) -> None:
+        if d is None:
+            return
+        i = d.toordinal() - self.lo
+        if 0 <= i < len(self._buckets):
+            self._buckets[i] += value
+            self._prefix = None
+
+    def between(self, a: date, b: date) -> float:
+        """Somme sur [a..b] (bornes incluses, tronquées à la plage)."""
+        if self._prefix is None:
+            self._prefix = [0.0, *accumulate(self._buckets)]
+        n = len(self._buckets)
+        i = min(max(a.toordinal() - self.lo, 0), n)
+        j = min(max(b.toordinal() - self.lo + 1, 0), n)
+        return self._prefix[j] - self._prefix[i] if j > i else 0.0
+
+    def window(self, d: date, days: int = ROLLING_DAYS) -> float:
+        """Somme sur la fenêtre glissante [d-(days-1)..d]."""
+        return self.between(d - timedelta(days=days - 1), d)
+
+
+class KeyedRollingSum:
+    """Une RollingSum par clé (ex. par produit), créée à la première valeur."""
+    __slots__ = ("lo", "hi", "sums")
+
+    def __init__(self, lo: date, hi: date):
+        self.lo = lo
+        self.hi = hi
+        self.sums: Dict[Any, RollingSum] = {}
+
+    def add(self, key: Any, d: Optional[date], value: float = 1.0) -> None:
+        s = self.sums.get(key)
+        if s is None:
+            s = self.sums[key] = RollingSum(self.lo, self.hi)
+        s.add(d, value)
+
+    def window(self, d: date, days: int = ROLLING_DAYS) -> Dict[Any, float]:
+        return {k: s.window(d, days) for k, s in self.sums.items()}
+
+
+def rolling_range(start: date, end: date, days: int = ROLLING_DAYS) -> tuple[date, date]:
+    """Plage à ventiler pour servir toutes les fenêtres des jours [start..end]."""
+    return start - timedelta(days=days - 1), end
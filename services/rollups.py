@@ -0,0 +1,505 @@
+# services/rollups.py
+from __future__ import annotations
+import json
+import os
+import sys
+from collections import defaultdict
+from datetime import date, timedelta
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+from services.table_store import ColumnarTable, row_date
+
+# ============================================================
+# Agrégats journaliers maintenus en continu (rollups)
+# ------------------------------------------------------------
+# Les séries stock / fournisseur rescannaient tout l'historique des tables
+# de faits à chaque requête. Ici les faits sont pré-agrégés par jour :
+#   - mvt_daily       : mouvement_stock, jour × entrepôt × stock × produit × type
+#   - ventes_daily    : lignecommande, jour de livraison (commandeclient) × produit
+#   - receptions_daily: reception_fournisseur, jour × fournisseur (commande_fournisseur)
+# Le consumer CDC (consumer.py) applique chaque event en delta : la
+# contribution courante de chaque ligne est mémorisée, un UPDATE / DELETE
+# retire l'ancienne avant d'ajouter la nouvelle (rejouer un event est sans
+# effet). Un changement sur la table parente (date de livraison, fournisseur)
+# re-ventile les lignes filles.
+# Une requête lit un hash par jour : coût en O(jours), pas en O(historique).
+#
+# Clés Redis (par agrégat) :
+#   rollup:{nom}:{YYYY-MM-DD}       hash [dims…, mesure] -> somme
+#   rollup_rows:{nom}               hash id -> contribution (+ champs si parent)
+#   rollup_parent:{nom}             hash id parent -> valeur jointe
+#   rollup_children:{nom}:{parent}  set des ids fils
+#   rollup_ready:{nom}              posé par la reconstruction complète (TTL ROLLUP_READY_TTL)
+#   rollup_version:{nom}            incrémenté à chaque changement (cache L1)
+#
+# Reconstruction : python -m services.rollups [nom…] (consumer arrêté, puis
+# relancé : les events rejoués sont idempotents), en une transaction : les
+# lecteurs ne voient jamais d'agrégat partiel. Tant que rollup_ready est
+# absent, les RPC lisent les tables brutes.
+#
+# Les deltas ne valent que si le consumer reçoit les events de toutes les
+# tables de ROLLUPS (faits et parents, cf. rollup_tables()) : topics
+# stock_events, orders_events et supplier_events dans consumer.py. Un trou
+# (table non publiée, consumer arrêté au-delà de la rétention Kafka) ne se
+# rattrape pas par delta : rollup_ready expire donc après ROLLUP_READY_TTL,
+# et le consumer reconstruit chaque agrégat avant (rollups_due), ce qui
+# borne la durée de vie d'une dérive.
+# ============================================================
+
+MVT_DAILY = "mvt_daily"
+VENTES_DAILY = "ventes_daily"
+RECEPTIONS_DAILY = "receptions_daily"
+
+_WRITE_CHUNK = 1000
+
+ROLLUP_READY_TTL = int(os.getenv("ROLLUP_READY_TTL", str(6 * 3600)))
+# reconstruction planifiée quand rollup_ready expire dans moins de ROLLUP_REBUILD_MARGIN
+ROLLUP_REBUILD_MARGIN = int(os.getenv("ROLLUP_REBUILD_MARGIN", str(15 * 60)))
+
+# (jour ISO, dims, {mesure: valeur}) ou None si la ligne ne compte pas
+Contribution = Optional[List[Any]]
+
+
+def _g(row: Dict[str, Any], *names: str, default=None):
+    for n in names:
+        if n in row and row[n] is not None:
+            return row[n]
+    return default
+
+
+def _iso(d: Optional[date]) -> Optional[str]:
+    return d.isoformat() if d else None
+
+
+class RollupParent:
+    """Jointure vers une table parente : clé étrangère + valeur lue sur le parent."""
+    __slots__ = ("table", "columns", "fk", "value")
+
+    def __init__(self, table: str, columns: List[str], fk: Tuple[str, ...], value: Callable[[Any], Any]):
+        self.table = table
+        self.columns = columns
+        self.fk = fk
+        self.value = value
+
+
+class RollupSpec:
+    __slots__ = ("name", "table", "columns", "dims", "measures", "contribution", "date_table", "replaces", "parent")
+
+    def __init__(self, name, table, columns, dims, measures, contribution, date_table, replaces, parent=None):
+        self.name = name
+        self.table = table
+        self.columns = columns
+        self.dims: Tuple[str, ...] = dims
+        self.measures: Tuple[str, ...] = measures
+        self.contribution: Callable[[Any, Any], Contribution] = contribution
+        self.date_table = date_table      # table dont WIDGET_DATE_WINDOWS donne la fenêtre
+        self.replaces: Tuple[str, ...] = replaces
+        self.parent: Optional[RollupParent] = parent
+
+
+# ---------- contributions (mêmes règles que les RPC brutes) ----------
+def _mvt_contribution(m, _parent) -> Contribution:
+    dm = row_date(m, "datemouvement", "date_mouvement")
+    if dm is None:
+        return None
+    q = float(_g(m, "quantite", "qte", default=0) or 0)
+    dims = [m.get("entrepot_id"), m.get("stock_id"), m.get("produit_id"), m.get("typemouvement", "")]
+    return [dm.isoformat(), dims, {"q": q, "q_pos": max(0.0, q), "q_neg": max(0.0, -q)}]
+
+
+def _vente_contribution(lc, livraison) -> Contribution:
+    if livraison is None:
+        return None
+    q = float(_g(lc, "quantite_commandee", "quantite", default=0) or 0)
+    pu = float(_g(lc, "prix_unitaire", "prix", default=0) or 0)
+    return [livraison, [lc.get("produit_id")], {"ca": max(0.0, q * pu), "qte": max(0.0, q)}]
+
+
+def _reception_contribution(r, fournisseur) -> Contribution:
+    dr = row_date(r, "date_reception", "date_reelle_livraison", "datereception", "datevalidation")
+    if dr is None:
+        return None
+    statut = str(_g(r, "statut_conformite", "statutconformite", "")).lower()
+    return [dr.isoformat(), [fournisseur], {
+        "n": 1.0,
+        "n_statut": 1.0 if statut else 0.0,
+        "n_conforme": 1.0 if statut in ("conforme", "ok", "valide") else 0.0,
+    }]
+
+
+_SUP_CMD_ID = ("commande_id", "commande_fournisseur_id", "commandefournisseur_id", "id_commandefournisseur")
+
+ROLLUPS: Dict[str, RollupSpec] = {
+    MVT_DAILY: RollupSpec(
+        MVT_DAILY, "mouvement_stock",
+        ["id", "stock_id", "entrepot_id", "produit_id", "typemouvement", "datemouvement", "date_mouvement", "quantite", "qte"],
+        ("entrepot_id", "stock_id", "produit_id", "typemouvement"), ("q", "q_pos", "q_neg"),
+        _mvt_contribution, "mouvement_stock", ("mouvement_stock",),
+    ),
+    VENTES_DAILY: RollupSpec(
+        VENTES_DAILY, "lignecommande",
+        ["id", "commande_id", "produit_id", "quantite_commandee", "quantite", "prix_unitaire", "prix"],
+        ("produit_id",), ("ca", "qte"),
+        _vente_contribution, "commandeclient", ("lignecommande", "commandeclient"),
+        RollupParent("commandeclient", ["id", "date_reelle_livraison"], ("commande_id",),
+                     lambda c: _iso(row_date(c, "date_reelle_livraison"))),
+    ),
+    RECEPTIONS_DAILY: RollupSpec(
+        RECEPTIONS_DAILY, "reception_fournisseur",
+        list(_SUP_CMD_ID) + ["id", "date_reception", "date_reelle_livraison", "datereception", "datevalidation",
+                             "statut_conformite", "statutconformite"],
+        ("fournisseur_id",), ("n", "n_statut", "n_conforme"),
+        _reception_contribution, "reception_fournisseur", ("reception_fournisseur",),
+        RollupParent("commande_fournisseur", ["id", "tiers_id", "fournisseur_id"], _SUP_CMD_ID,
+                     lambda c: _g(c, "tiers_id", "fournisseur_id")),
+    ),
+}
+
+
+# ---------- clés ----------
+def table_key(name: str) -> str:
+    """Clé de l'agrégat dans le dict tables passé aux RPC."""
+    return f"rollup:{name}"
+
+
+def day_key(name: str, day: str) -> str:
+    return f"rollup:{name}:{day}"
+
+
+def rows_key(name: str) -> str:
+    return f"rollup_rows:{name}"
+
+
+def parent_key(name: str) -> str:
+    return f"rollup_parent:{name}"
+
+
+def children_key(name: str, parent_id: Any) -> str:
+    return f"rollup_children:{name}:{parent_id}"
+
+
+def ready_key(name: str) -> str:
+    return f"rollup_ready:{name}"
+
+
+def rollup_version_key(name: str) -> str:
+    return f"rollup_version:{name}"
+
+
+def _field(dims: List[Any], measure: str) -> str:
+    return json.dumps([*dims, measure], separators=(",", ":"))
+
+
+# ---------- lecture ----------
+class DailyRollup:
+    """Agrégat lu sur [lo..hi] : une ligne par jour × dims (colonne "day" + dims + mesures)."""
+    __slots__ = ("name", "lo", "hi", "rows")
+
+    def __init__(self, name: str, lo: date, hi: date, rows: ColumnarTable):
+        self.name = name
+        self.lo = lo
+        self.hi = hi
+        self.rows = rows
+
+    def covers(self, lo: date, hi: date) -> bool:
+        return self.lo <= lo and hi <= self.hi
+
+    def nbytes(self) -> int:
+        return self.rows.nbytes()
+
+
+class RollupUnavailable(RuntimeError):
+    """Ni l'agrégat sur la plage demandée, ni les tables de faits qu'il remplace."""
+
+
+def rollup_for(tables: Dict[str, Any], name: str, lo: date, hi: date) -> Optional[ColumnarTable]:
+    """
+    Lignes de l'agrégat si le lot l'a chargé sur une plage couvrant [lo..hi],
+    None si la RPC doit lire les tables brutes. Si l'agrégat a été planifié
+    pour ce lot (présent dans tables) sans couvrir [lo..hi] alors que les
+    tables qu'il remplace n'ont pas été chargées, lève RollupUnavailable
+    plutôt que de calculer sur des tables vides.
+    """
+    rollup = tables.get(table_key(name))
+    if not isinstance(rollup, DailyRollup):
+        return None
+    if rollup.covers(lo, hi):
+        return rollup.rows
+    missing = [t for t in ROLLUPS[name].replaces if t not in tables]
+    if missing:
+        raise RollupUnavailable(
+            f"agrégat {name} ({rollup.lo}..{rollup.hi}) ne couvre pas {lo}..{hi} et {missing} non chargé(s)"
+        )
+    return None
+
+
+def has_rollups(tables: Dict[str, Any]) -> bool:
+    return any(isinstance(v, DailyRollup) for v in tables.values())
+
+
+def _to_table(spec: RollupSpec, buckets: Iterable[Tuple[str, Tuple[Any, ...], Dict[str, float]]]) -> ColumnarTable:
+    rows = []
+    for day, dims, values in buckets:
+        row = {"day": day, **dict(zip(spec.dims, dims))}
+        for m in spec.measures:
+            row[m] = float(values.get(m, 0.0))
+        rows.append(row)
+    return ColumnarTable.from_rows(rows)
+
+
+def _days(lo: date, hi: date) -> List[str]:
+    return [(lo + timedelta(days=i)).isoformat() for i in range((hi - lo).days + 1)]
+
+
+def _parse_days(name: str, lo: date, hi: date, days: List[str], hashes: List[Dict[str, str]]) -> DailyRollup:
+    buckets = []
+    for day, fields in zip(days, hashes):
+        grouped: Dict[Tuple[Any, ...], Dict[str, float]] = {}
+        for raw, value in fields.items():
+            *dims, measure = json.loads(raw)
+            grouped.setdefault(tuple(dims), {})[measure] = float(value)
+        buckets.extend((day, dims, values) for dims, values in grouped.items())
+    return DailyRollup(name, lo, hi, _to_table(ROLLUPS[name], buckets))
+
+
+def read_rollup(client, name: str, lo: date, hi: date) -> DailyRollup:
+    """Un HGETALL par jour de [lo..hi], en un seul pipeline."""
+    days = _days(lo, hi)
+    pipe = client.pipeline(transaction=False)
+    for day in days:
+        pipe.hgetall(day_key(name, day))
+    return _parse_days(name, lo, hi, days, pipe.execute())
+
+
+async def aread_rollup(client, name: str, lo: date, hi: date) -> DailyRollup:
+    """read_rollup sur un client redis.asyncio."""
+    days = _days(lo, hi)
+    pipe = client.pipeline(transaction=False)
+    for day in days:
+        pipe.hgetall(day_key(name, day))
+    return _parse_days(name, lo, hi, days, await pipe.execute())
+
+
+# ---------- construction complète ----------
+def _parent_values(spec: RollupSpec, tables: Dict[str, Any]) -> Dict[Any, Any]:
+    if spec.parent is None:
+        return {}
+    values = {}
+    for p in tables.get(spec.parent.table, []) or []:
+        v = spec.parent.value(p)
+        if v is not None:
+            values[p.get("id")] = v
+    return values
+
+
+def _memo(spec: RollupSpec, rec: Any, parent_id: Any, contribution: Contribution) -> Dict[str, Any]:
+    memo = {"c": contribution}
+    if spec.parent is not None:
+        memo["p"] = parent_id
+        memo["r"] = {c: rec.get(c) for c in spec.columns if rec.get(c) is not None}
+    return memo
+
+
+def build_rollup(name: str, tables: Dict[str, Any]):
+    """
+    Agrégat complet depuis les tables brutes :
+    (sommes {(jour, dims): {mesure: v}}, mémo par id, valeurs parentes).
+    """
+    spec = ROLLUPS[name]
+    parents = _parent_values(spec, tables)
+    sums: Dict[Tuple[str, Tuple[Any, ...]], Dict[str, float]] = defaultdict(lambda: defaultdict(float))
+    memos: Dict[Any, Dict[str, Any]] = {}
+    for rec in tables.get(spec.table, []) or []:
+        pid = _g(rec, *spec.parent.fk) if spec.parent else None
+        c = spec.contribution(rec, parents.get(pid))
+        if c is not None:
+            bucket = sums[(c[0], tuple(c[1]))]
+            for m, v in c[2].items():
+                bucket[m] += v
+        rid = rec.get("id")
+        if rid is not None:
+            memos[rid] = _memo(spec, rec, pid, c)
+    return sums, memos, parents
+
+
+def rollup_from_tables(name: str, tables: Dict[str, Any], lo: date, hi: date) -> DailyRollup:
+    """Même DailyRollup que read_rollup, calculé en mémoire (scripts, vérifications)."""
+    sums = build_rollup(name, tables)[0]
+    a, b = lo.isoformat(), hi.isoformat()
+    buckets = sorted(((day, dims, v) for (day, dims), v in sums.items() if a <= day <= b), key=lambda x: x[0])
+    return DailyRollup(name, lo, hi, _to_table(ROLLUPS[name], buckets))
+
+
+def _chunks(items: List[Any]):
+    for i in range(0, len(items), _WRITE_CHUNK):
+        yield items[i:i + _WRITE_CHUNK]
+
+
+def rebuild_rollup(client, name: str, tables: Dict[str, Any]) -> None:
+    """
+    Remplace l'agrégat dans Redis en une seule transaction (MULTI/EXEC) :
+    les lecteurs voient l'ancien agrégat complet ou le nouveau, jamais un
+    agrégat partiel, et rollup_ready reste posé pendant la reconstruction.
+    """
+    spec = ROLLUPS[name]
+    sums, memos, parents = build_rollup(name, tables)
+    stale = [rows_key(name), parent_key(name)]
+    stale += list(client.scan_iter(match=f"{day_key(name, '*')}"))
+    stale += list(client.scan_iter(match=children_key(name, "*")))
+
+    by_day: Dict[str, Dict[str, float]] = defaultdict(dict)
+    for (day, dims), values in sums.items():
+        for m, v in values.items():
+            by_day[day][_field(list(dims), m)] = v
+    children: Dict[Any, List[Any]] = defaultdict(list)
+    for rid, memo in memos.items():
+        if memo.get("p") is not None:
+            children[memo["p"]].append(rid)
+
+    pipe = client.pipeline(transaction=True)
+    for keys in _chunks(stale):
+        pipe.delete(*keys)
+    for day, fields in by_day.items():
+        pipe.hset(day_key(name, day), mapping=fields)
+    for ids in _chunks(list(memos)):
+        pipe.hset(rows_key(name), mapping={str(i): json.dumps(memos[i]) for i in ids})
+    for pids in _chunks(list(parents)):
+        pipe.hset(parent_key(name), mapping={str(p): json.dumps(parents[p]) for p in pids})
+    for pid, ids in children.items():
+        pipe.sadd(children_key(name, pid), *[str(i) for i in ids])
+    pipe.incr(rollup_version_key(name))
+    pipe.set(ready_key(name), "1", ex=ROLLUP_READY_TTL)
+    pipe.execute()
+    print(f"[ROLLUP] {name} reconstruit : {len(by_day)} jour(s), {len(memos)} ligne(s) de {spec.table}")
+
+
+def rollup_tables() -> List[str]:
+    """Tables dont les events CDC doivent parvenir au consumer."""
+    tables = {spec.table for spec in ROLLUPS.values()}
+    tables |= {spec.parent.table for spec in ROLLUPS.values() if spec.parent}
+    return sorted(tables)
+
+
+def rollups_due(client) -> List[str]:
+    """Agrégats à reconstruire : rollup_ready absent ou expirant dans moins de ROLLUP_REBUILD_MARGIN."""
+    names = sorted(ROLLUPS)
+    pipe = client.pipeline(transaction=False)
+    for name in names:
+        pipe.ttl(ready_key(name))
+    # ttl : -2 clé absente, -1 sans expiration (posée avant ROLLUP_READY_TTL)
+    return [n for n, ttl in zip(names, pipe.execute()) if ttl == -1 or ttl < ROLLUP_REBUILD_MARGIN]
+
+
+# ---------- maintenance incrémentale (consumer CDC) ----------
+def _incr(pipe, name: str, contribution: Contribution, sign: float) -> None:
+    if contribution is None:
+        return
+    day, dims, values = contribution
+    for m, v in values.items():
+        if v:
+            pipe.hincrbyfloat(day_key(name, day), _field(dims, m), sign * v)
+
+
+def _changes(events) -> Dict[Any, Any]:
+    """Dernier état par id ({id: record} ou {id: None} pour un DELETE) ; events sans id ignorés."""
+    changes = {}
+    for action, record in events:
+        rid = record.get("id")
+        if rid is not None:
+            changes[rid] = None if action == "DELETE" else record
+    return changes
+
+
+def _apply_facts(client, spec: RollupSpec, changes: Dict[Any, Any]) -> None:
+    ids = list(changes)
+    olds = client.hmget(rows_key(spec.name), [str(i) for i in ids])
+    fks = {i: _g(rec, *spec.parent.fk) if spec.parent and rec else None for i, rec in changes.items()}
+    pids = sorted({str(p) for p in fks.values() if p is not None})
+    parents = dict(zip(pids, client.hmget(parent_key(spec.name), pids))) if pids else {}
+
+    pipe = client.pipeline()
+    for rid, raw in zip(ids, olds):
+        old = json.loads(raw) if raw else None
+        rec, pid = changes[rid], fks[rid]
+        value = parents.get(str(pid)) if pid is not None else None
+        new = spec.contribution(rec, json.loads(value) if value else None) if rec is not None else None
+        if old is not None:
+            _incr(pipe, spec.name, old["c"], -1.0)
+            if old.get("p") is not None and old["p"] != pid:
+                pipe.srem(children_key(spec.name, old["p"]), str(rid))
+        _incr(pipe, spec.name, new, +1.0)
+        if rec is None:
+            pipe.hdel(rows_key(spec.name), str(rid))
+            continue
+        pipe.hset(rows_key(spec.name), str(rid), json.dumps(_memo(spec, rec, pid, new)))
+        if pid is not None:
+            pipe.sadd(children_key(spec.name, pid), str(rid))
+    pipe.incr(rollup_version_key(spec.name))
+    pipe.execute()
+
+
+def _apply_parents(client, spec: RollupSpec, changes: Dict[Any, Any]) -> None:
+    """Nouvelle valeur jointe (date de livraison, fournisseur…) -> re-ventilation des lignes filles."""
+    pids = [str(p) for p in changes]
+    olds = client.hmget(parent_key(spec.name), pids)
+    moved = {}
+    for pid, rec, raw in zip(pids, changes.values(), olds):
+        value = spec.parent.value(rec) if rec is not None else None
+        if (json.loads(raw) if raw else None) != value:
+            moved[pid] = value
+    if not moved:
+        return
+
+    pipe = client.pipeline(transaction=False)
+    for pid in moved:
+        pipe.smembers(children_key(spec.name, pid))
+    children = dict(zip(moved, pipe.execute()))
+    child_ids = [c for pid in moved for c in children[pid]]
+    memos = dict(zip(child_ids, client.hmget(rows_key(spec.name), child_ids))) if child_ids else {}
+
+    pipe = client.pipeline()
+    for pid, value in moved.items():
+        if value is None:
+            pipe.hdel(parent_key(spec.name), pid)
+        else:
+            pipe.hset(parent_key(spec.name), pid, json.dumps(value))
+        for cid in children[pid]:
+            raw = memos.get(cid)
+            if not raw:
+                continue
+            memo = json.loads(raw)
+            new = spec.contribution(memo["r"], value)
+            if new == memo["c"]:
+                continue
+            _incr(pipe, spec.name, memo["c"], -1.0)
+            _incr(pipe, spec.name, new, +1.0)
+            memo["c"] = new
+            pipe.hset(rows_key(spec.name), cid, json.dumps(memo))
+    pipe.incr(rollup_version_key(spec.name))
+    pipe.execute()
+
+
+def apply_rollup_events(client, table: str, events) -> None:
+    """Répercute un lot d'events CDC d'une table sur les agrégats qui en dépendent."""
+    changes = None
+    for spec in ROLLUPS.values():
+        if table not in (spec.table, spec.parent.table if spec.parent else None):
+            continue
+        changes = _changes(events) if changes is None else changes
+        if not changes:
+            return
+        if table == spec.table:
+            _apply_facts(client, spec, changes)
+        else:
+            _apply_parents(client, spec, changes)
+        print(f"[ROLLUP] {spec.name} mis à jour ({len(changes)} ligne(s) de {table})")
+
+
+def main(argv: List[str]) -> int:
+    from services.config_service import rebuild_rollups
+    rebuild_rollups(argv or None)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,84 @@
+# services/rpc_cache.py
+from __future__ import annotations
+import hashlib
+import json
+import os
+from datetime import date, datetime
+from typing import Any, Optional, Sequence
+
+from services.table_cache import TABLE_CACHE_TTL, L1TableCache
+
+# ============================================================
+# Cache des résultats de RPC
+# ------------------------------------------------------------
+# Clé = rpc_name + params normalisés + versions des tables de
+# WIDGET_DEPENDENCIES (et des agrégats de WIDGET_ROLLUPS) + date du jour.
+#   - le consumer CDC incrémente table_version:{table} à chaque event :
+#     la clé change, l'ancien résultat n'est plus jamais lu (pas de purge) ;
+#   - la date du jour couvre les fenêtres par défaut (end_date absent =
+#     date.today()) et les KPI relatifs à aujourd'hui : nouvelle clé à minuit ;
+#   - TTL = TABLE_CACHE_TTL : un résultat ne survit pas aux snapshots de
+#     tables dont il est issu (tables non écoutées par le consumer).
+# Stocké dans Redis (partagé entre workers) et, si RPC_RESULT_L1=1, dans un
+# LRU par worker. Les {"error": ...} ne sont jamais mis en cache.
+# ============================================================
+
+RPC_RESULT_TTL = int(os.getenv("RPC_RESULT_TTL", str(TABLE_CACHE_TTL)))
+RPC_RESULT_L1 = os.getenv("RPC_RESULT_L1", "1") == "1"
+RPC_RESULT_L1_BYTES = int(os.getenv("RPC_RESULT_L1_BYTES", str(32 * 1024 * 1024)))
+
+# la clé porte déjà les versions : version L1 constante
+_L1_VERSION = "1"
+
+
+class _Payload:
+    """Résultat sérialisé (JSON) : chaque lecture rend une copie neuve."""
+    __slots__ = ("raw",)
+
+    def __init__(self, raw: str):
+        self.raw = raw
+
+    def nbytes(self) -> int:
+        return len(self.raw)
+
+
+result_l1 = L1TableCache(max_bytes=RPC_RESULT_L1_BYTES, ttl=RPC_RESULT_TTL)
+
+
+def normalize_params(params: Optional[dict]) -> str:
+    """Params absents, {} et valeurs None (= défaut de la RPC) donnent la même clé."""
+    kept = {k: v for k, v in (params or {}).items() if v is not None}
+    return json.dumps(kept, sort_keys=True, separators=(",", ":"), default=str)
+
+
+def result_key(rpc_name: str, params: Optional[dict], stamps: Sequence[str], today: date) -> str:
+    raw = "|".join([normalize_params(params), today.isoformat(), *stamps])
+    return f"rpc_result:{rpc_name}:{hashlib.sha1(raw.encode()).hexdigest()}"
+
+
+def _json_default(v: Any) -> Any:
+    if isinstance(v, (date, datetime)):
+        return v.isoformat()  # comme l'encodeur JSON de FastAPI
+    raise TypeError(type(v).__name__)
+
+
+def encode_result(value: Any) -> Optional[str]:
+    """JSON du résultat, None s'il ne doit pas être mis en cache (erreur, non sérialisable)."""
+    if isinstance(value, dict) and set(value) == {"error"}:
+        return None
+    try:
+        return json.dumps(value, default=_json_default, separators=(",", ":"), allow_nan=False)
+    except (TypeError, ValueError):
+        return None
+
+
+def l1_get(key: str) -> Optional[str]:
+    if not RPC_RESULT_L1:
+        return None
+    payload = result_l1.get(key, _L1_VERSION)
+    return payload.raw if payload is not None else None
+
+
+def l1_put(key: str, raw: str) -> None:
+    if RPC_RESULT_L1:
+        result_l1.put(key, _L1_VERSION, _Payload(raw))
@@ -0,0 +1,157 @@
+# services/rpc_executor.py
+from __future__ import annotations
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from datetime import date
+from multiprocessing import shared_memory
+from typing import Any, Dict, Optional, Tuple
+
+from services.compute_graph import request_scope
+from services.rollups import DailyRollup
+from services.table_codec import encode_table, decode_table
+from services.table_store import ColumnarTable
+from services.widgets_service import RPC_PYTHON_MAP
+
+# ============================================================
+# Exécution des RPC d'un lot dans un pool de processus
+# ------------------------------------------------------------
+# get_widget_data évalue les RPC l'une après l'autre sur un seul cœur.
+# Avec RPC_EXECUTOR=process, les RPC d'un lot sont réparties sur un pool de
+# RPC_PROCESS_WORKERS processus (spawn, créé au premier lot).
+# Les tables du lot sont encodées une seule fois (format de table_codec,
+# sans zlib) dans un segment de mémoire partagée : une tâche ne transporte
+# que le nom du segment, le manifeste et la RPC. Chaque worker décode le lot
+# une fois et garde ses intermédiaires (@node) pour les RPC suivantes du
+# même lot. Une erreur de RPC revient en {"error": ...} comme en mode inline ;
+# si le segment ne peut pas être créé (/dev/shm plein…), le lot reste inline.
+# ============================================================
+
+RPC_EXECUTOR = os.getenv("RPC_EXECUTOR", "inline").strip().lower()
+RPC_PROCESS_WORKERS = int(os.getenv("RPC_PROCESS_WORKERS", str(os.cpu_count() or 2)))
+# en dessous, le coût d'encodage + aller-retour dépasse le gain
+RPC_PROCESS_MIN_BATCH = int(os.getenv("RPC_PROCESS_MIN_BATCH", "2"))
+
+# (offset, taille, (nom, début, fin) si DailyRollup sinon None)
+Manifest = Dict[str, Tuple[int, int, Optional[Tuple[str, int, int]]]]
+
+_pool: Optional[ProcessPoolExecutor] = None
+_pool_lock = threading.Lock()
+
+
+def _get_pool() -> ProcessPoolExecutor:
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(
+                max_workers=RPC_PROCESS_WORKERS,
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+        return _pool
+
+
+def _reset_pool(pool: ProcessPoolExecutor) -> None:
+    global _pool
+    with _pool_lock:
+        if _pool is pool:
+            _pool = None
+    pool.shutdown(wait=False, cancel_futures=True)
+
+
+def use_process_pool(rpcs) -> bool:
+    return RPC_EXECUTOR == "process" and len(rpcs) >= RPC_PROCESS_MIN_BATCH
+
+
+# ---------- côté API ----------
+def share_tables(tables: Dict[str, Any]) -> Tuple[shared_memory.SharedMemory, Manifest]:
+    blobs, manifest, offset = [], {}, 0
+    for name, table in tables.items():
+        meta = None
+        if isinstance(table, DailyRollup):
+            meta = (table.name, table.lo.toordinal(), table.hi.toordinal())
+            table = table.rows
+        elif not isinstance(table, ColumnarTable):
+            table = ColumnarTable.from_rows(table or [])
+        blob = encode_table(table, compress=False)
+        manifest[name] = (offset, len(blob), meta)
+        blobs.append(blob)
+        offset += len(blob)
+    shm = shared_memory.SharedMemory(create=True, size=max(1, offset))
+    pos = 0
+    for blob in blobs:
+        shm.buf[pos:pos + len(blob)] = blob
+        pos += len(blob)
+    return shm, manifest
+
+
+def run_rpcs(tables: Dict[str, Any], rpcs) -> Optional[Dict[str, Any]]:
+    """{rpc_name: résultat} calculés dans le pool ; None si le lot doit rester inline."""
+    try:
+        shm, manifest = share_tables(tables)
+    except OSError as e:
+        print(f"[RPC] Mémoire partagée indisponible ({e}), lot exécuté inline")
+        return None
+    pool = _get_pool()
+    try:
+        futures = [
+            (rpc.rpc_name, pool.submit(_run_in_worker, shm.name, manifest, rpc.rpc_name, rpc.params or {}))
+            for rpc in rpcs
+        ]
+        results = {}
+        for name, future in futures:
+            try:
+                results[name] = future.result()
+            except BrokenProcessPool as e:
+                _reset_pool(pool)
+                results[name] = {"error": f"worker RPC interrompu: {e}"}
+            except Exception as e:  # résultat non transférable…
+                results[name] = {"error": str(e)}
+        return results
+    finally:
+        shm.close()
+        shm.unlink()
+
+
+# ---------- côté worker ----------
+# (nom du segment, tables décodées, intermédiaires @node) du dernier lot vu
+_batch: Optional[Tuple[str, Dict[str, Any], Dict]] = None
+
+
+def _attach(name: str) -> shared_memory.SharedMemory:
+    # le processus API reste seul propriétaire du segment (unlink en fin de lot) ;
+    # avant 3.13, les workers spawn partagent son resource_tracker
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)  # Python 3.13+
+    except TypeError:
+        return shared_memory.SharedMemory(name=name)
+
+
+def _batch_tables(shm_name: str, manifest: Manifest) -> Tuple[Dict[str, Any], Dict]:
+    global _batch
+    if _batch is None or _batch[0] != shm_name:
+        shm = _attach(shm_name)
+        try:
+            tables: Dict[str, Any] = {}
+            for name, (offset, size, meta) in manifest.items():
+                table = decode_table(bytes(shm.buf[offset:offset + size]))
+                if meta is not None:
+                    table = DailyRollup(meta[0], date.fromordinal(meta[1]), date.fromordinal(meta[2]), table)
+                tables[name] = table
+        finally:
+            shm.close()
+        _batch = (shm_name, tables, {})
+    return _batch[1], _batch[2]
+
+
+def _run_in_worker(shm_name: str, manifest: Manifest, rpc_name: str, params: Dict[str, Any]) -> Any:
+    func = RPC_PYTHON_MAP.get(rpc_name)
+    if func is None:
+        return {"error": f"RPC {rpc_name} non défini"}
+    tables, store = _batch_tables(shm_name, manifest)
+    try:
+        with request_scope(store):
+            return func(tables, **params)
+    except Exception as e:
+        return {"error": str(e)}
@@ -3,16 +3,14 @@ from datetime import date, datetime, timedelta
 from typing import Any, Dict, List, Optional
 from collections import defaultdict
 
-
-def _parse_date(v: Any) -> Optional[date]:
-    if v in (None, "", "null"): return None
-    if isinstance(v, date): return v
-    s = str(v)
-    for fmt in ("%Y-%m-%d","%Y/%m/%d","%d/%m/%Y","%Y-%m-%d %H:%M:%S","%Y-%m-%dT%H:%M:%S"):
-        try: return datetime.strptime(s[:len(fmt)], fmt).date()
-        except: pass
-    try: return datetime.fromisoformat(s).date()
-    except: return None
+from services.table_dates import parse_date as _parse_date
+from services.table_store import row_date as _row_date, index_by, lookup_by
+from services.rolling import RollingSum, KeyedRollingSum, rolling_range
+from services.compute_graph import node
+from services.rollups import MVT_DAILY, VENTES_DAILY, rollup_for
+from services.stock.entrepots import (
+    stock_for_entrepot, mvts_for_entrepot, peremptions_for_entrepot, stock_ids_for_entrepot,
+)
 
 def _between(d: Optional[date], a: date, b: date) -> bool:
     return bool(d and a <= d <= b)
@@ -46,6 +44,18 @@ def _mvt_signed_quantity(typemvt: str, q: float) -> float:
         return -abs(q)
     return 0.0
 
+def _mvt_signed_total(typemvt: str, q: float, q_abs: float) -> float:
+    """_mvt_signed_quantity sur une somme de mouvements d'un même type (q_abs = Σ|q|)."""
+    if (typemvt or "").strip().lower() in ("perte", "shrink", "shrinkage"):
+        return -q_abs
+    return _mvt_signed_quantity(typemvt, q)
+
+def _in_entrepot(m: Any, entrepot_id: Any | None, stock_ids_target: Optional[set]) -> bool:
+    """Filtre entrepôt (via entrepot_id direct ou via stock_id relié à cet entrepôt)."""
+    if entrepot_id is None or m.get("entrepot_id") == entrepot_id:
+        return True
+    return bool(stock_ids_target) and m.get("stock_id") in stock_ids_target
+
 # ============================================================
 # Reconstruction du stock disponible quotidien
 # ------------------------------------------------------------
@@ -56,42 +66,42 @@ def _mvt_signed_quantity(typemvt: str, q: float) -> float:
 # C’est stable et donne une vraie valeur par jour même sans historiques journaliers.
 # ============================================================
 
+@node("stock.disponible_end")
 def _disponible_snapshot_end(tables: Dict[str, Any], entrepot_id: Any | None) -> float:
-    stock_rows = tables.get("stock", []) or []
+    stock_rows = stock_for_entrepot(tables.get("stock", []) or [], entrepot_id)
     total = 0.0
     for s in stock_rows:
-        if entrepot_id is not None and s.get("entrepot_id") != entrepot_id:
-            continue
         qd = float(s.get("quantitedisponible", 0) or 0)
         qr = float(s.get("quantitereserve", 0) or 0)
         total += max(0.0, qd - qr)
     return float(total)
 
+@node("stock.mvts_by_day")
 def _aggregate_mvts_by_day(tables: Dict[str, Any], start: date, end: date, entrepot_id: Any | None) -> Dict[date, float]:
-    mvts = tables.get("mouvement_stock", []) or []
     stock_rows = tables.get("stock", []) or []
-    stock_ids_target = None
-    if entrepot_id is not None:
-        stock_ids_target = {s.get("id") for s in stock_rows if s.get("entrepot_id") == entrepot_id}
-
     by_day: Dict[date, float] = defaultdict(float)
+    rollup = rollup_for(tables, MVT_DAILY, start, end)
+    if rollup is not None:
+        # agrégats journaliers (services/rollups.py) : une ligne par jour × stock × type
+        stock_ids_target = stock_ids_for_entrepot(stock_rows, entrepot_id) if entrepot_id is not None else None
+        for r in rollup:
+            dm = _row_date(r, "day")
+            if _between(dm, start, end) and _in_entrepot(r, entrepot_id, stock_ids_target):
+                by_day[dm] += _mvt_signed_total(str(r.get("typemouvement")), r.get("q"), r.get("q_pos") + r.get("q_neg"))
+        return by_day
+
+    # filtre entrepôt (via entrepot_id direct ou via stock_id relié à cet entrepôt)
+    mvts = mvts_for_entrepot(tables.get("mouvement_stock", []) or [], stock_rows, entrepot_id)
     for m in mvts:
-        dm = _parse_date(_g(m, "datemouvement", "date_mouvement"))
+        dm = _row_date(m, "datemouvement", "date_mouvement")
         if not _between(dm, start, end): 
             continue
-        # filtre entrepôt (via entrepot_id direct ou via stock_id relié à cet entrepôt)
-        if entrepot_id is not None:
-            if m.get("entrepot_id") == entrepot_id:
-                pass
-            elif stock_ids_target and m.get("stock_id") in stock_ids_target:
-                pass
-            else:
-                continue
         q = float(_g(m, "quantite", "qte", default=0) or 0)
         delta = _mvt_signed_quantity(str(m.get("typemouvement","")), q)
         by_day[dm] += delta
     return by_day
 
+@node("stock.disponible_series")
 def _disponible_series_absolute(tables: Dict[str, Any], start: date, end: date, entrepot_id: Any | None) -> Dict[str, float]:
     days = _days_range(start, end)
     # delta mouvements par jour
@@ -130,18 +140,16 @@ def rpc_days_on_hand_series(tables, start_date: str | None = None, end_date: str
     days = _days_range(start, end)
     dispo_by_day = _disponible_series_absolute(tables, start, end, entrepot_id)
 
-    mvts_by_day = _aggregate_mvts_by_day(tables, start - timedelta(days=29), end, entrepot_id)
+    lo, hi = rolling_range(start, end)
+    mvts_by_day = _aggregate_mvts_by_day(tables, lo, hi, entrepot_id)
+    # conso = sorties nettes (Δ négatifs) => on somme uniquement les -Δ
+    conso_by_day = RollingSum(lo, hi)
+    for day, delta in mvts_by_day.items():
+        conso_by_day.add(day, max(0.0, -delta))
 
     out = []
     for d in days:
-        win_start = d - timedelta(days=29)
-        # conso = sorties nettes (Δ négatifs) => on somme uniquement les -Δ
-        conso = 0.0
-        cur = win_start
-        while cur <= d:
-            delta = mvts_by_day.get(cur, 0.0)
-            conso += max(0.0, -delta)
-            cur += timedelta(days=1)
+        conso = conso_by_day.window(d)
         doh = 0.0
         if conso > 0:
             avg = conso / 30.0
@@ -156,33 +164,44 @@ def rpc_days_on_hand_series(tables, start_date: str | None = None, end_date: str
 # Coût des ventes 30j ≈ Σ (quantite_commandee * prix_unitaire) sur commandes livrées [d-29..d]
 # ============================================================
 
+@node("stock.value_end")
 def _stock_value_end(tables: Dict[str, Any], entrepot_id: Any | None) -> float:
-    produits = {p.get("id"): p for p in (tables.get("produit", []) or [])}
-    stock_rows = tables.get("stock", []) or []
+    produits = index_by(tables.get("produit", []) or [])
+    stock_rows = stock_for_entrepot(tables.get("stock", []) or [], entrepot_id)
     total = 0.0
     for s in stock_rows:
-        if entrepot_id is not None and s.get("entrepot_id") != entrepot_id:
-            continue
         pid = s.get("produit_id")
         prix = float((produits.get(pid) or {}).get("prix", 0) or 0)
         q = float(s.get("quantitedisponible", 0) or 0)
         total += max(0.0, q) * max(0.0, prix)
     return float(total)
 
-def _ca_30d(tables: Dict[str, Any], win_start: date, d: date) -> float:
-    # calcule "coût des ventes" ou "CA" selon besoin — ici CA
-    cmds = {c.get("id"): c for c in (tables.get("commandeclient", []) or [])}
+def _cmds_by_id(tables: Dict[str, Any]) -> Dict[Any, Any]:
+    return index_by(tables.get("commandeclient", []) or [])
+
+@node("stock.ca_by_day")
+def _ca_by_day(tables: Dict[str, Any], start: date, end: date) -> RollingSum:
+    # calcule "coût des ventes" ou "CA" selon besoin — ici CA, ventilé par jour de livraison
+    # une seule passe sur les lignes ; CA 30j(d) = ca_by_day.window(d)
+    lo, hi = rolling_range(start, end)
+    ca_by_day = RollingSum(lo, hi)
+    rollup = rollup_for(tables, VENTES_DAILY, lo, hi)
+    if rollup is not None:
+        for r in rollup:
+            ca_by_day.add(_row_date(r, "day"), r.get("ca"))
+        return ca_by_day
+
+    cmds = _cmds_by_id(tables)
     lignes = (tables.get("lignecommande", []) or [])
-    total = 0.0
     for lc in lignes:
         cc = cmds.get(lc.get("commande_id"))
-        dr = _parse_date(_g(cc or {}, "date_reelle_livraison"))
-        if not _between(dr, win_start, d):
+        dr = _row_date(cc or {}, "date_reelle_livraison")
+        if not _between(dr, lo, hi):
             continue
         q = float(_g(lc, "quantite_commandee", "quantite", default=0) or 0)
         pu = float(_g(lc, "prix_unitaire", "prix", default=0) or 0)
-        total += max(0.0, q * pu)
-    return float(total)
+        ca_by_day.add(dr, max(0.0, q * pu))
+    return ca_by_day
 
 def rpc_taux_rotation_series(tables, start_date: str | None = None, end_date: str | None = None, entrepot_id: Any | None = None):
     start, end = _resolve_window(start_date, end_date, default_days=6)
@@ -191,11 +210,11 @@ def rpc_taux_rotation_series(tables, start_date: str | None = None, end_date: st
     dispo_by_day = _disponible_series_absolute(tables, start, end, entrepot_id)
     dispo_end = max(0.0001, sum([0.0]) + dispo_by_day.get(end.strftime("%Y-%m-%d"), 0.0))  # évite /0
     stock_val_end = _stock_value_end(tables, entrepot_id)
+    ca_by_day = _ca_by_day(tables, start, end)
 
     out = []
     for d in days:
-        win_start = d - timedelta(days=29)
-        ca = _ca_30d(tables, win_start, d)
+        ca = ca_by_day.window(d)
         # valeur stock d (approx. proportionnelle au dispo)
         dispo_d = dispo_by_day[d.strftime("%Y-%m-%d")]
         stock_val_d = (stock_val_end * dispo_d / dispo_end) if dispo_end > 0 else 0.0
@@ -215,11 +234,11 @@ def rpc_inventory_to_sales_series(tables, start_date: str | None = None, end_dat
     dispo_by_day = _disponible_series_absolute(tables, start, end, entrepot_id)
     dispo_end = max(0.0001, dispo_by_day.get(end.strftime("%Y-%m-%d"), 0.0))
     stock_val_end = _stock_value_end(tables, entrepot_id)
+    ca_by_day = _ca_by_day(tables, start, end)
 
     out = []
     for d in days:
-        win_start = d - timedelta(days=29)
-        ca = _ca_30d(tables, win_start, d)
+        ca = ca_by_day.window(d)
         dispo_d = dispo_by_day[d.strftime("%Y-%m-%d")]
         stock_val_d = (stock_val_end * dispo_d / dispo_end) if dispo_end > 0 else 0.0
         i2s = round(stock_val_d / ca, 2) if ca > 0 else 0.0
@@ -246,11 +265,11 @@ def rpc_rentabilite_stock_series(
     dispo_by_day = _disponible_series_absolute(tables, start, end, entrepot_id)
     dispo_end = max(0.0001, dispo_by_day.get(end.strftime("%Y-%m-%d"), 0.0))
     stock_val_end = _stock_value_end(tables, entrepot_id)
+    ca_by_day = _ca_by_day(tables, start, end)
 
     out = []
     for d in days:
-        win_start = d - timedelta(days=29)
-        ca = _ca_30d(tables, win_start, d)
+        ca = ca_by_day.window(d)
         cdv = ca * max(0.0, min(1.0, cout_ratio))
         marge = ca - cdv - max(0.0, couts_logistiques)
 
@@ -272,62 +291,65 @@ def rpc_taux_rupture_series(tables, start_date: str | None = None, end_date: str
     start, end = _resolve_window(start_date, end_date, default_days=6)
     days = _days_range(start, end)
 
-    cmds = {c.get("id"): c for c in (tables.get("commandeclient", []) or [])}
+    cmds = _cmds_by_id(tables)
     lignes = (tables.get("lignecommande", []) or [])
     stock_rows = tables.get("stock", []) or []
 
     # mapping stock_id -> produit_id (pour mvts sans produit_id)
-    stock_prod_map = { s.get("id"): s.get("produit_id") for s in stock_rows }
-
-    # Pré-agrégation des mouvements par jour/produit (sorties)
-    mvts = tables.get("mouvement_stock", []) or []
-    if entrepot_id is not None:
-        stock_ids_target = {s.get("id") for s in stock_rows if s.get("entrepot_id") == entrepot_id}
-    else:
-        stock_ids_target = None
-
-    sorties_by_day_prod: Dict[date, Dict[Any, float]] = defaultdict(lambda: defaultdict(float))
+    stock_prod_map = lookup_by(stock_rows, "id", "produit_id")
+
+    # Pré-agrégation des mouvements par jour/produit (sorties), lignes de l'entrepôt seulement
+    mvts = mvts_for_entrepot(tables.get("mouvement_stock", []) or [], stock_rows, entrepot_id)
+
+    lo, hi = rolling_range(start, end)
+    sorties_by_prod = KeyedRollingSum(lo, hi)
+    mvt_rollup = rollup_for(tables, MVT_DAILY, lo, hi)
+    if mvt_rollup is not None:
+        mvts = []
+        stock_ids_target = stock_ids_for_entrepot(stock_rows, entrepot_id) if entrepot_id is not None else None
+        for r in mvt_rollup:
+            if not str(r.get("typemouvement")).lower().startswith("sortie"):
+                continue
+            if not _in_entrepot(r, entrepot_id, stock_ids_target):
+                continue
+            pid = r.get("produit_id") or stock_prod_map.get(r.get("stock_id"))
+            if pid is not None:
+                sorties_by_prod.add(pid, _row_date(r, "day"), r.get("q_pos"))
     for m in mvts:
         typ = str(m.get("typemouvement","")).lower()
         if not typ.startswith("sortie"): 
             continue
-        dm = _parse_date(_g(m, "datemouvement", "date_mouvement"))
+        dm = _row_date(m, "datemouvement", "date_mouvement")
         if dm is None: 
             continue
-        if entrepot_id is not None:
-            if m.get("entrepot_id") == entrepot_id:
-                pass
-            elif stock_ids_target and m.get("stock_id") in stock_ids_target:
-                pass
-            else:
-                continue
         pid = m.get("produit_id") or stock_prod_map.get(m.get("stock_id"))
         if pid is None: 
             continue
         q = float(_g(m, "quantite", "qte", default=0) or 0)
-        sorties_by_day_prod[dm][pid] += max(0.0, q)
+        sorties_by_prod.add(pid, dm, max(0.0, q))
+
+    # Demande par produit (lignes livrées), ventilée par jour de livraison
+    demande_by_prod = KeyedRollingSum(lo, hi)
+    ventes_rollup = rollup_for(tables, VENTES_DAILY, lo, hi)
+    if ventes_rollup is not None:
+        lignes = []
+        for r in ventes_rollup:
+            demande_by_prod.add(r.get("produit_id"), _row_date(r, "day"), r.get("qte"))
+    for lc in lignes:
+        cc = cmds.get(lc.get("commande_id"))
+        dr = _row_date(cc or {}, "date_reelle_livraison")
+        if not _between(dr, lo, hi):
+            continue
+        pid = lc.get("produit_id")
+        demande_by_prod.add(pid, dr, max(0.0, float(_g(lc, "quantite_commandee", "quantite", default=0) or 0)))
 
     out = []
     for d in days:
-        win_start = d - timedelta(days=29)
-        # Demande par produit (lignes livrées)
-        dem: Dict[Any, float] = defaultdict(float)
-        for lc in lignes:
-            cc = cmds.get(lc.get("commande_id"))
-            dr = _parse_date(_g(cc or {}, "date_reelle_livraison"))
-            if not _between(dr, win_start, d): 
-                continue
-            pid = lc.get("produit_id")
-            dem[pid] += max(0.0, float(_g(lc, "quantite_commandee", "quantite", default=0) or 0))
+        dem = demande_by_prod.window(d)
         total_dem = sum(dem.values())
 
         # Servi par produit via mvts "sortie" sur la fenêtre
-        serv: Dict[Any, float] = defaultdict(float)
-        cur = win_start
-        while cur <= d:
-            for pid, q in sorties_by_day_prod.get(cur, {}).items():
-                serv[pid] += q
-            cur += timedelta(days=1)
+        serv = sorties_by_prod.window(d)
 
         non_serv = 0.0
         for pid, qd in dem.items():
@@ -348,23 +370,14 @@ def rpc_remaining_shelf_life_series(tables, start_date: str | None = None, end_d
     start, end = _resolve_window(start_date, end_date, default_days=6)
     days = _days_range(start, end)
 
-    per = tables.get("peremption", []) or []
-    stock_rows = tables.get("stock", []) or []
-    if entrepot_id is not None:
-        stock_ids_target = {s.get("id") for s in stock_rows if s.get("entrepot_id") == entrepot_id}
-    else:
-        stock_ids_target = None
+    # filtre entrepôt si possible via stock_id
+    per = peremptions_for_entrepot(tables.get("peremption", []) or [], tables.get("stock", []) or [], entrepot_id)
 
     out = []
     for d in days:
         tot_q = tot_j = 0.0
         for r in per:
-            # filtre entrepôt si possible via stock_id
-            if stock_ids_target is not None:
-                sid = r.get("stock_id")
-                if sid not in stock_ids_target:
-                    continue
-            exp = _parse_date(_g(r, "dateexpiration", "date_expiration"))
+            exp = _row_date(r, "dateexpiration", "date_expiration")
             if not exp: 
                 continue
             q = float(_g(r, "quantite", "qte", default=0) or 0)
@@ -383,25 +396,31 @@ def rpc_shrinkage_by_day(tables, start_date: str | None = None, end_date: str |
     start, end = _resolve_window(start_date, end_date, default_days=6)
     days = _days_range(start, end)
 
-    mvts = tables.get("mouvement_stock", []) or []
     stock_rows = tables.get("stock", []) or []
-    if entrepot_id is not None:
-        stock_ids_target = {s.get("id") for s in stock_rows if s.get("entrepot_id") == entrepot_id}
-    else:
-        stock_ids_target = None
+    mvts = mvts_for_entrepot(tables.get("mouvement_stock", []) or [], stock_rows, entrepot_id)
 
     agg = { d.strftime("%Y-%m-%d"): 0.0 for d in days }
+    rollup = rollup_for(tables, MVT_DAILY, start, end)
+    if rollup is not None:
+        mvts = []
+        stock_ids_target = stock_ids_for_entrepot(stock_rows, entrepot_id) if entrepot_id is not None else None
+        for r in rollup:
+            dm = _row_date(r, "day")
+            if not _between(dm, start, end) or not _in_entrepot(r, entrepot_id, stock_ids_target):
+                continue
+            t = str(r.get("typemouvement")).strip().lower()
+            if t in ("perte","shrink","shrinkage"):
+                val = r.get("q_pos") + r.get("q_neg")
+            elif t.startswith("ajustement"):
+                val = r.get("q_neg")
+            else:
+                continue
+            k = dm.strftime("%Y-%m-%d")
+            agg[k] = agg.get(k, 0.0) + val
     for m in mvts:
-        dm = _parse_date(_g(m, "datemouvement", "date_mouvement"))
+        dm = _row_date(m, "datemouvement", "date_mouvement")
         if not _between(dm, start, end): 
             continue
-        if entrepot_id is not None:
-            if m.get("entrepot_id") == entrepot_id:
-                pass
-            elif stock_ids_target and m.get("stock_id") in stock_ids_target:
-                pass
-            else:
-                continue
         t = str(m.get("typemouvement","")).strip().lower()
         q = float(_g(m, "quantite", "qte", default=0) or 0)
         # on ne garde QUE les pertes / ajustements négatifs
@@ -412,8 +431,9 @@ def rpc_shrinkage_by_day(tables, start_date: str | None = None, end_date: str |
         else:
             val = 0.0
         k = dm.strftime("%Y-%m-%d")
-        agg[k] = round(agg.get(k, 0.0) + val, 2)
+        agg[k] = agg.get(k, 0.0) + val
 
-    return [{"day": day, "Quantité": agg[day]} for day in sorted(agg)]
+    # arrondi une seule fois : mêmes totaux par lignes brutes ou par agrégat journalier
+    return [{"day": day, "Quantité": round(agg[day], 2)} for day in sorted(agg)]
 
 
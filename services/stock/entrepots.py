@@ -0,0 +1,96 @@
+# services/stock/entrepots.py
+from __future__ import annotations
+from typing import Any, Dict, List
+
+from services.table_store import ColumnarTable, table_index
+
+# ============================================================
+# Partitions par entrepôt (mouvement_stock, stock, peremption)
+# ------------------------------------------------------------
+# Avec entrepot_id, les séries stock ne lisent que les lignes de l'entrepôt :
+#   - stock       : stock.entrepot_id == entrepot_id
+#   - mouvements  : m.entrepot_id == entrepot_id, ou m.stock_id rattaché à
+#                   l'entrepôt (même règle que les filtres ligne à ligne)
+#   - peremption  : p.stock_id rattaché à l'entrepôt
+# Le lien stock_id -> entrepot_id est résolu une fois, et chaque partition
+# est construite au premier appel puis gardée avec la table (table_index) :
+# une fois par version de table, pas une fois par requête.
+# Les lignes gardent l'ordre de la table : sommes identiques au filtre.
+# ============================================================
+
+
+def _take(rows: Any, indices: List[int]) -> Any:
+    if isinstance(rows, ColumnarTable):
+        return rows.take(indices)
+    return [rows[i] for i in indices]
+
+
+def _split(rows: Any, keys_of) -> Dict[Any, Any]:
+    buckets: Dict[Any, List[int]] = {}
+    for i, r in enumerate(rows):
+        for eid in keys_of(r):
+            buckets.setdefault(eid, []).append(i)
+    return {eid: _take(rows, idx) for eid, idx in buckets.items()}
+
+
+def _entrepots_by_stock(stock_rows: Any) -> Dict[Any, List[Any]]:
+    """stock.id -> entrepôts (un id en doublon peut être rattaché à plusieurs)."""
+    out: Dict[Any, List[Any]] = {}
+    for s in stock_rows:
+        eid = s.get("entrepot_id")
+        if eid is not None:
+            eids = out.setdefault(s.get("id"), [])
+            if eid not in eids:
+                eids.append(eid)
+    return out
+
+
+def _stock_partitions(stock_rows: Any) -> Dict[Any, Any]:
+    return _split(stock_rows, lambda s: () if s.get("entrepot_id") is None else (s.get("entrepot_id"),))
+
+
+def _linked_partitions(rows: Any, stock_rows: Any, direct: bool) -> Dict[Any, Any]:
+    by_stock = table_index(stock_rows, _entrepots_by_stock)
+
+    def keys_of(r):
+        eids = by_stock.get(r.get("stock_id"), ())
+        own = r.get("entrepot_id") if direct else None
+        if own is None or own in eids:
+            return eids
+        return [own, *eids]
+
+    return _split(rows, keys_of)
+
+
+def _partition(parts: Dict[Any, Any], rows: Any, entrepot_id: Any) -> Any:
+    try:
+        found = parts.get(entrepot_id)
+    except TypeError:  # identifiant non hashable : aucune ligne ne lui est égale
+        found = None
+    return found if found is not None else _take(rows, [])
+
+
+def stock_for_entrepot(stock_rows: Any, entrepot_id: Any | None) -> Any:
+    """Lignes de stock de l'entrepôt (toutes si entrepot_id est None)."""
+    if entrepot_id is None:
+        return stock_rows
+    return _partition(table_index(stock_rows, _stock_partitions), stock_rows, entrepot_id)
+
+
+def mvts_for_entrepot(mvts: Any, stock_rows: Any, entrepot_id: Any | None) -> Any:
+    """Mouvements de l'entrepôt : entrepot_id direct ou stock_id rattaché."""
+    if entrepot_id is None:
+        return mvts
+    return _partition(table_index(mvts, _linked_partitions, stock_rows, True), mvts, entrepot_id)
+
+
+def peremptions_for_entrepot(per: Any, stock_rows: Any, entrepot_id: Any | None) -> Any:
+    """Péremptions de l'entrepôt, via stock_id uniquement."""
+    if entrepot_id is None:
+        return per
+    return _partition(table_index(per, _linked_partitions, stock_rows, False), per, entrepot_id)
+
+
+def stock_ids_for_entrepot(stock_rows: Any, entrepot_id: Any) -> set:
+    """{stock.id} de l'entrepôt (filtre des agrégats journaliers)."""
+    return {s.get("id") for s in stock_for_entrepot(stock_rows, entrepot_id)}
@@ -3,29 +3,18 @@ from __future__ import annotations
 from datetime import datetime, date, timedelta
 from typing import Any, Optional, Dict, List
 
+from services.table_dates import parse_date as _parse_date
+from services.table_store import row_date as _row_date, index_by, lookup_by
+from services.compute_graph import node
+
 
 # =========================
 # Utils dates / fenêtres
 # =========================
-def _parse_date(v: Any) -> Optional[date]:
-    if v in (None, "", "null"):
-        return None
-    if isinstance(v, date):
-        return v
-    s = str(v)
-    for fmt in ("%Y-%m-%d","%Y/%m/%d","%d/%m/%Y","%Y-%m-%d %H:%M:%S","%Y-%m-%dT%H:%M:%S"):
-        try:
-            return datetime.strptime(s[:len(fmt)], fmt).date()
-        except:
-            pass
-    try:
-        return datetime.fromisoformat(s).date()
-    except:
-        return None
-
 def _between(d: Optional[date], a: date, b: date) -> bool:
     return bool(d and a <= d <= b)
 
+@node("stock.window_30d")
 def _window_30d(tables: Dict[str, Any], start_date: Optional[str], end_date: Optional[str]) -> tuple[date, date]:
     """
     Si end_date n'est pas donnée, on la déduit du max des dates connues
@@ -38,17 +27,17 @@ def _window_30d(tables: Dict[str, Any], start_date: Optional[str], end_date: Opt
 
         # commandeclient.date_reelle_livraison
         for c in (tables.get("commandeclient", []) or []):
-            d = _parse_date(c.get("date_reelle_livraison"))
+            d = _row_date(c, "date_reelle_livraison")
             if d: candidates.append(d)
 
         # mouvement_stock.datemouvement / date_mouvement
         for m in (tables.get("mouvement_stock", []) or []):
-            d = _parse_date(m.get("datemouvement") or m.get("date_mouvement"))
+            d = _row_date(m, "datemouvement", "date_mouvement")
             if d: candidates.append(d)
 
         # peremption.dateexpiration
         for p in (tables.get("peremption", []) or []):
-            d = _parse_date(p.get("dateexpiration") or p.get("date_expiration"))
+            d = _row_date(p, "dateexpiration", "date_expiration")
             if d: candidates.append(d)
 
         end = max(candidates) if candidates else date.today()
@@ -62,12 +51,13 @@ def _window_30d(tables: Dict[str, Any], start_date: Optional[str], end_date: Opt
 # =========================
 # Aides métier stock/ventes
 # =========================
+@node("stock.valeur_courante")
 def _valeur_stock_courante(tables: Dict[str, Any]) -> float:
     """
     Valorisation courante = Σ (stock.quantitedisponible * produit.prix)
     (instantané — pas de reconstitution par jour)
     """
-    produits = {p.get("id"): p for p in (tables.get("produit", []) or [])}
+    produits = index_by(tables.get("produit", []) or [])
     total = 0.0
     for s in (tables.get("stock", []) or []):
         pid = s.get("produit_id")
@@ -76,6 +66,7 @@ def _valeur_stock_courante(tables: Dict[str, Any]) -> float:
         total += max(0.0, q) * max(0.0, prix)
     return float(total)
 
+@node("stock.disponible_now")
 def _stock_disponible_now(tables: Dict[str, Any]) -> float:
     """
     Disponibilité actuelle = Σ max(0, quantitedisponible - quantitereserve)
@@ -87,16 +78,17 @@ def _stock_disponible_now(tables: Dict[str, Any]) -> float:
         total += max(0.0, qd - qr)
     return float(total)
 
+@node("stock.ca_30j")
 def _ca_30j(tables: Dict[str, Any], start: date, end: date) -> float:
     """
     CA sur 30j = Σ (lignecommande.quantite_commandee * prix_unitaire)
     pour les commandes livrées réellement dans [start..end]
     """
-    cmds = {c.get("id"): c for c in (tables.get("commandeclient", []) or [])}
+    cmds = index_by(tables.get("commandeclient", []) or [])
     total = 0.0
     for lc in (tables.get("lignecommande", []) or []):
         cc = cmds.get(lc.get("commande_id"))
-        d = _parse_date(cc.get("date_reelle_livraison")) if cc else None
+        d = _row_date(cc, "date_reelle_livraison") if cc else None
         if not _between(d, start, end):
             continue
         q = float(lc.get("quantite_commandee", lc.get("quantite", 0)) or 0)
@@ -104,6 +96,7 @@ def _ca_30j(tables: Dict[str, Any], start: date, end: date) -> float:
         total += max(0.0, q * pu)
     return float(total)
 
+@node("stock.conso_sorties_30j")
 def _conso_sorties_30j(tables: Dict[str, Any], start: date, end: date) -> float:
     """
     Consommation = Σ des 'sorties' sur [start..end]
@@ -114,7 +107,7 @@ def _conso_sorties_30j(tables: Dict[str, Any], start: date, end: date) -> float:
         typ = str(m.get("typemouvement", "")).strip().lower()
         if not typ.startswith("sortie"):
             continue
-        d = _parse_date(m.get("datemouvement") or m.get("date_mouvement"))
+        d = _row_date(m, "datemouvement", "date_mouvement")
         if not _between(d, start, end):
             continue
         total += max(0.0, float(m.get("quantite", 0) or 0))
@@ -216,11 +209,11 @@ def get_kpi_taux_rupture(tables: Dict[str, Any], start_date: str | None = None,
     start, end = _window_30d(tables, start_date, end_date)
 
     # Demande par produit
-    cmds = {c.get("id"): c for c in (tables.get("commandeclient", []) or [])}
+    cmds = index_by(tables.get("commandeclient", []) or [])
     demande: Dict[Any, float] = {}
     for lc in (tables.get("lignecommande", []) or []):
         cc = cmds.get(lc.get("commande_id"))
-        d = _parse_date(cc.get("date_reelle_livraison")) if cc else None
+        d = _row_date(cc, "date_reelle_livraison") if cc else None
         if not _between(d, start, end):
             continue
         pid = lc.get("produit_id")
@@ -234,14 +227,14 @@ def get_kpi_taux_rupture(tables: Dict[str, Any], start_date: str | None = None,
     # Servi via mouvements 'sortie'
     mvts = (tables.get("mouvement_stock", []) or [])
     has_ms_prod = any("produit_id" in m for m in mvts)
-    stock_map = {s.get("id"): s.get("produit_id") for s in (tables.get("stock", []) or [])}
+    stock_map = lookup_by(tables.get("stock", []) or [], "id", "produit_id")
 
     servi: Dict[Any, float] = {}
     for m in mvts:
         typ = str(m.get("typemouvement", "")).strip().lower()
         if not typ.startswith("sortie"):
             continue
-        d = _parse_date(m.get("datemouvement") or m.get("date_mouvement"))
+        d = _row_date(m, "datemouvement", "date_mouvement")
         if not _between(d, start, end):
             continue
         pid = m.get("produit_id") if has_ms_prod else stock_map.get(m.get("stock_id"))
@@ -261,7 +254,7 @@ def get_kpi_remaining_shelf_life_avg(tables: Dict[str, Any], start_date: str | N
     _, ref = _window_30d(tables, start_date, end_date)
     tot_q = tot_j = 0.0
     for r in (tables.get("peremption", []) or []):
-        exp = _parse_date(r.get("dateexpiration") or r.get("date_expiration"))
+        exp = _row_date(r, "dateexpiration", "date_expiration")
         if not exp:
             continue
         q = max(0.0, float(r.get("quantite", 0) or 0))
@@ -278,7 +271,7 @@ def get_kpi_produits_proches_peremption(tables: Dict[str, Any], start_date: str
     seuil_jours = 30
     out: List[Dict[str, Any]] = []
     for r in (tables.get("peremption", []) or []):
-        exp = _parse_date(r.get("dateexpiration") or r.get("date_expiration"))
+        exp = _row_date(r, "dateexpiration", "date_expiration")
         if not exp:
             continue
         j = (exp - ref).days
@@ -297,7 +290,7 @@ def get_kpi_contraction_stock_qte(tables: Dict[str, Any], start_date: str | None
     start, end = _window_30d(tables, start_date, end_date)
     total = 0.0
     for m in (tables.get("mouvement_stock", []) or []):
-        d = _parse_date(m.get("datemouvement") or m.get("date_mouvement"))
+        d = _row_date(m, "datemouvement", "date_mouvement")
         if not _between(d, start, end):
             continue
         t = str(m.get("typemouvement", "")).strip().lower()
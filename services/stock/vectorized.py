@@ -0,0 +1,652 @@
+# services/stock/vectorized.py
+from __future__ import annotations
+import os
+from datetime import date, timedelta
+from typing import Any, Callable, Dict, List, Optional
+
+try:
+    import numpy as np
+except ImportError:  # dépendance optionnelle : backend "python" seulement
+    np = None
+
+from services.table_store import ColumnarTable, KIND_DATE, KIND_FLOAT, KIND_INT, row_date, lookup_by, table_index
+from services.compute_graph import node
+from services.rollups import has_rollups
+from services.stock import chart as _chart
+from services.stock import kpi as _kpi
+from services.stock.entrepots import stock_for_entrepot, mvts_for_entrepot, peremptions_for_entrepot
+
+# ============================================================
+# Backend NumPy des KPI et séries stock
+# ------------------------------------------------------------
+# Mêmes RPC que services/stock/kpi.py et services/stock/chart.py, calculées
+# sur des tableaux : filtres en masques, quantités signées par table de
+# correspondance sur les types de mouvement, ventilation par jour avec
+# np.bincount, prix produits joints par index.
+# Choisi par déploiement : STOCK_COMPUTE_BACKEND=numpy (numpy requis),
+# sinon les fonctions Python restent utilisées.
+# Les sommes passent par np.cumsum (même ordre d'addition que les boucles
+# Python) : les sorties sont identiques, pas seulement proches
+# (vérification : python -m benchmarks.stock_backend).
+# Les séries servies par les agrégats journaliers (services/rollups.py)
+# restent calculées en Python : elles ne lisent que quelques lignes par jour.
+# ============================================================
+
+STOCK_COMPUTE_BACKEND = os.getenv("STOCK_COMPUTE_BACKEND", "python").strip().lower()
+
+_NUMERIC = (KIND_INT, KIND_FLOAT)
+_MVT_IN, _MVT_OUT, _MVT_ADJ, _MVT_LOSS = 1, 2, 3, 4
+_LOSS_TYPES = ("perte", "shrink", "shrinkage")
+
+
+# ---------- extraction des colonnes ----------
+def _seq_sum(x) -> float:
+    """Somme dans l'ordre des lignes (np.sum est par paires)."""
+    return float(np.cumsum(x)[-1]) if len(x) else 0.0
+
+
+def _numeric(col, n: int):
+    data = np.frombuffer(col.data, dtype=col.data.typecode) if n else np.zeros(0)
+    if col.kind == KIND_FLOAT:
+        return data, np.isnan(data)
+    null = np.frombuffer(col.nulls, dtype=np.uint8).astype(bool) if col.nulls is not None else np.zeros(n, bool)
+    return data.astype(float), null
+
+
+def _pick(row, names, present: bool):
+    if present:  # row.get(a, row.get(b, …)) : première colonne présente, même nulle
+        for n in names:
+            if n in row:
+                return row[n]
+        return None
+    for n in names:  # _g : première valeur non nulle
+        v = row.get(n)
+        if v is not None:
+            return v
+    return None
+
+
+def _num(rows, *names: str, present: bool = False):
+    """float(_g(r, *names) or 0) (ou la variante row.get imbriquée si present)."""
+    n = len(rows)
+    if isinstance(rows, ColumnarTable):
+        cols = [rows.columns[c] for c in names if c in rows.columns]
+        if present:
+            cols = cols[:1]
+        if all(c.kind in _NUMERIC for c in cols):
+            out, filled = np.zeros(n), np.zeros(n, bool)
+            for c in cols:
+                vals, null = _numeric(c, n)
+                take = ~filled & ~null
+                out[take] = vals[take]
+                filled |= take
+            return out
+    return np.array([float(_pick(r, names, present) or 0) for r in rows], dtype=float)
+
+
+def _days(rows, *names: str):
+    """Ordinaux de row_date(r, *names), 0 = pas de date."""
+    n = len(rows)
+    if not isinstance(rows, ColumnarTable):
+        return np.array([d.toordinal() if d else 0 for d in (row_date(r, *names) for r in rows)], dtype=np.int64)
+    out, filled = np.zeros(n, np.int64), np.zeros(n, bool)
+    for name in names:
+        col = rows.columns.get(name)
+        if col is None or not n:
+            continue
+        if col.kind == KIND_DATE:
+            parsed = np.frombuffer(col.data, dtype=col.data.typecode).astype(np.int64)
+            null = parsed == 0
+        else:
+            parsed = np.array([d.toordinal() if d else 0 for d in rows.dates(name)], dtype=np.int64)
+            if col.kind in _NUMERIC:
+                null = _numeric(col, n)[1]
+            else:
+                null = np.array([v is None for v in col.data], dtype=bool)
+        take = ~filled & ~null
+        out[take] = parsed[take]
+        filled |= take
+    return out
+
+
+def _values(rows, name: str, default: Any = None) -> List[Any]:
+    """[r.get(name, default) for r in rows]"""
+    if isinstance(rows, ColumnarTable):
+        col = rows.columns.get(name)
+        return col.values() if col is not None else [default] * len(rows)
+    return [r.get(name, default) for r in rows]
+
+
+def _codes(values: List[Any], classify: Callable[[Any], int]):
+    """Classification par valeur distincte (types de mouvement), pas par ligne."""
+    lut: Dict[Any, int] = {}
+    for v in values:
+        if v not in lut:
+            lut[v] = classify(v)
+    return np.fromiter((lut[v] for v in values), dtype=np.int8, count=len(values))
+
+
+def _mvt_kind(typemvt: Any) -> int:
+    t = (str(typemvt) or "").strip().lower()
+    if t.startswith("entr") or t == "entrée":
+        return _MVT_IN
+    if t.startswith("sort"):
+        return _MVT_OUT
+    if t.startswith("ajust"):
+        return _MVT_ADJ
+    if t in _LOSS_TYPES:
+        return _MVT_LOSS
+    return 0
+
+
+def _lookup(keys: List[Any], mapping: Dict[Any, Any], default: Any = 0):
+    return np.array([mapping.get(k, default) for k in keys])
+
+
+def _in_range(ords, lo: date, hi: date):
+    return (ords >= lo.toordinal()) & (ords <= hi.toordinal())
+
+
+def _entrepot_mvts(tables: Dict[str, Any], entrepot_id: Any):
+    """Mouvements de l'entrepôt (partition gardée avec la table, services/stock/entrepots.py)."""
+    return mvts_for_entrepot(tables.get("mouvement_stock", []) or [], tables.get("stock", []) or [], entrepot_id)
+
+
+def _entrepot_stock(tables: Dict[str, Any], entrepot_id: Any):
+    return stock_for_entrepot(tables.get("stock", []) or [], entrepot_id)
+
+
+def _factorize(keys: List[Any]):
+    """Codes entiers par clé, dans l'ordre de première apparition."""
+    index: Dict[Any, int] = {}
+    codes = np.fromiter((index.setdefault(k, len(index)) for k in keys), dtype=np.int64, count=len(keys))
+    return codes, index
+
+
+# ---------- briques communes ----------
+def _prix_by_id(produits) -> Dict[Any, float]:
+    return {p.get("id"): float(p.get("prix", 0) or 0) for p in produits}
+
+
+def _prix_stock(tables: Dict[str, Any], stock_rows):
+    prix = table_index(tables.get("produit", []) or [], _prix_by_id)
+    return _lookup(_values(stock_rows, "produit_id"), prix, 0.0).astype(float)
+
+
+def _livraison_by_id(cmds) -> Dict[Any, int]:
+    return dict(zip(_values(cmds, "id"), _days(cmds, "date_reelle_livraison").tolist()))
+
+
+@node("stock.np.livraison_lignes")
+def _livraison_lignes(tables: Dict[str, Any], lignes):
+    """Ordinal de commandeclient.date_reelle_livraison pour chaque ligne (0 = absente)."""
+    livr = table_index(tables.get("commandeclient", []) or [], _livraison_by_id)
+    return _lookup(_values(lignes, "commande_id"), livr, 0).astype(np.int64)
+
+
+def _bucket(ords, weights, lo: date, n_days: int, mask):
+    idx = ords[mask] - lo.toordinal()
+    return np.bincount(idx, weights=weights[mask], minlength=n_days)[:n_days]
+
+
+def _prefix(buckets):
+    return np.concatenate(([0.0], np.cumsum(buckets, axis=-1))) if buckets.ndim == 1 else \
+        np.concatenate((np.zeros((buckets.shape[0], 1)), np.cumsum(buckets, axis=1)), axis=1)
+
+
+# ============================================================
+# KPI (services/stock/kpi.py)
+# ============================================================
+@node("stock.np.window_30d")
+def _window_30d(tables: Dict[str, Any], start_date: Optional[str], end_date: Optional[str]) -> tuple[date, date]:
+    end = _kpi._parse_date(end_date)
+    if not end:
+        candidates = [
+            _days(tables.get("commandeclient", []) or [], "date_reelle_livraison"),
+            _days(tables.get("mouvement_stock", []) or [], "datemouvement", "date_mouvement"),
+            _days(tables.get("peremption", []) or [], "dateexpiration", "date_expiration"),
+        ]
+        latest = max((int(c.max()) for c in candidates if len(c)), default=0)
+        end = date.fromordinal(latest) if latest else date.today()
+    start = _kpi._parse_date(start_date) or (end - timedelta(days=29))
+    if start > end:
+        start, end = end, start
+    return start, end
+
+
+@node("stock.np.valeur_courante")
+def _valeur_stock_courante(tables: Dict[str, Any]) -> float:
+    stock_rows = tables.get("stock", []) or []
+    q = _num(stock_rows, "quantitedisponible", present=True)
+    return _seq_sum(np.maximum(0.0, q) * np.maximum(0.0, _prix_stock(tables, stock_rows)))
+
+
+@node("stock.np.disponible_now")
+def _stock_disponible_now(tables: Dict[str, Any]) -> float:
+    stock_rows = tables.get("stock", []) or []
+    qd = _num(stock_rows, "quantitedisponible", present=True)
+    qr = _num(stock_rows, "quantitereserve", present=True)
+    return _seq_sum(np.maximum(0.0, qd - qr))
+
+
+def _lignes_livrees(tables: Dict[str, Any], start: date, end: date):
+    lignes = tables.get("lignecommande", []) or []
+    return lignes, _in_range(_livraison_lignes(tables, lignes), start, end)
+
+
+def _ca_30j(tables: Dict[str, Any], start: date, end: date) -> float:
+    lignes, mask = _lignes_livrees(tables, start, end)
+    q = _num(lignes, "quantite_commandee", "quantite", present=True)
+    pu = _num(lignes, "prix_unitaire", "prix", present=True)
+    return _seq_sum(np.maximum(0.0, (q * pu)[mask]))
+
+
+def _sorties_30j(mvts, start: date, end: date):
+    typ = _codes(_values(mvts, "typemouvement", ""), lambda t: int(str(t).strip().lower().startswith("sortie")))
+    return (typ == 1) & _in_range(_days(mvts, "datemouvement", "date_mouvement"), start, end)
+
+
+def _conso_sorties_30j(tables: Dict[str, Any], start: date, end: date) -> float:
+    mvts = tables.get("mouvement_stock", []) or []
+    mask = _sorties_30j(mvts, start, end)
+    return _seq_sum(np.maximum(0.0, _num(mvts, "quantite", present=True)[mask]))
+
+
+def get_kpi_quantite_stock(tables: Dict[str, Any], start_date: str | None = None, end_date: str | None = None):
+    q = _num(tables.get("stock", []) or [], "quantitedisponible", present=True)
+    return _seq_sum(np.maximum(0.0, q))
+
+
+def get_kpi_quantite_reservee(tables: Dict[str, Any], start_date: str | None = None, end_date: str | None = None):
+    q = _num(tables.get("stock", []) or [], "quantitereserve", present=True)
+    return _seq_sum(np.maximum(0.0, q))
+
+
+def get_kpi_stock_disponible(tables: Dict[str, Any], start_date: str | None = None, end_date: str | None = None):
+    return _stock_disponible_now(tables)
+
+
+def get_kpi_days_on_hand(tables: Dict[str, Any], start_date: str | None = None, end_date: str | None = None):
+    _, end = _window_30d(tables, start_date, end_date)
+    conso = _conso_sorties_30j(tables, end - timedelta(days=29), end)
+    if conso <= 0:
+        return None
+    avg = conso / 30.0
+    return round(_stock_disponible_now(tables) / avg, 2) if avg > 0 else None
+
+
+def get_kpi_taux_rotation(tables: Dict[str, Any], start_date: str | None = None, end_date: str | None = None):
+    start, end = _window_30d(tables, start_date, end_date)
+    ca = _ca_30j(tables, start, end)
+    stock_val = _valeur_stock_courante(tables)
+    if stock_val <= 0:
+        return None
+    return round(ca / stock_val, 2)
+
+
+def get_kpi_inventory_to_sales(tables: Dict[str, Any], start_date: str | None = None, end_date: str | None = None):
+    start, end = _window_30d(tables, start_date, end_date)
+    ca = _ca_30j(tables, start, end)
+    if ca <= 0:
+        return None
+    return round(_valeur_stock_courante(tables) / ca, 2)
+
+
+def get_kpi_rentabilite_stock(
+    tables: Dict[str, Any],
+    start_date: str | None = None,
+    end_date: str | None = None,
+    cout_ratio: float = 0.7,
+    couts_logistiques: float = 0.0,
+):
+    start, end = _window_30d(tables, start_date, end_date)
+    ca = _ca_30j(tables, start, end)
+    cdv = ca * max(0.0, min(1.0, float(cout_ratio)))
+    marge = ca - cdv - max(0.0, float(couts_logistiques))
+    stock_val = _valeur_stock_courante(tables)
+    if stock_val <= 0:
+        return None
+    return round(marge / stock_val, 2)
+
+
+def get_kpi_taux_rupture(tables: Dict[str, Any], start_date: str | None = None, end_date: str | None = None):
+    start, end = _window_30d(tables, start_date, end_date)
+
+    # Demande par produit (lignes livrées sur la fenêtre)
+    lignes, livrees = _lignes_livrees(tables, start, end)
+    dem_pids = [p for p, keep in zip(_values(lignes, "produit_id"), livrees) if keep]
+    q = np.maximum(0.0, _num(lignes, "quantite_commandee", "quantite", present=True)[livrees])
+    codes, index = _factorize(dem_pids)
+    demande = np.bincount(codes, weights=q, minlength=len(index))
+    total_dem = _seq_sum(demande)
+    if total_dem <= 0:
+        return None
+
+    # Servi via mouvements 'sortie', sur les mêmes produits
+    mvts = tables.get("mouvement_stock", []) or []
+    sorties = _sorties_30j(mvts, start, end)
+    if isinstance(mvts, ColumnarTable):
+        has_ms_prod = "produit_id" in mvts.columns and len(mvts) > 0
+    else:
+        has_ms_prod = any("produit_id" in m for m in mvts)
+    if has_ms_prod:
+        pids = _values(mvts, "produit_id")
+    else:
+        stock_map = lookup_by(tables.get("stock", []) or [], "id", "produit_id")
+        pids = [stock_map.get(sid) for sid in _values(mvts, "stock_id")]
+    qs = np.maximum(0.0, _num(mvts, "quantite", present=True))
+    servi = np.zeros(len(index))
+    serv_codes = np.array([index.get(p, -1) if p is not None else -1 for p in pids], dtype=np.int64)
+    keep = sorties & (serv_codes >= 0)
+    if keep.any():
+        servi = np.bincount(serv_codes[keep], weights=qs[keep], minlength=len(index))
+
+    non_serv = _seq_sum(np.maximum(0.0, demande - np.minimum(demande, servi)))
+    return round(100.0 * non_serv / total_dem, 2)
+
+
+def _peremptions(tables: Dict[str, Any]):
+    per = tables.get("peremption", []) or []
+    return per, _days(per, "dateexpiration", "date_expiration")
+
+
+def get_kpi_remaining_shelf_life_avg(tables: Dict[str, Any], start_date: str | None = None, end_date: str | None = None):
+    _, ref = _window_30d(tables, start_date, end_date)
+    per, exp = _peremptions(tables)
+    mask = exp != 0
+    q = np.maximum(0.0, _num(per, "quantite", present=True))[mask]
+    j = np.maximum(0, exp[mask] - ref.toordinal())
+    tot_q = _seq_sum(q)
+    return round(_seq_sum(q * j) / tot_q, 1) if tot_q > 0 else None
+
+
+def get_kpi_produits_proches_peremption(tables: Dict[str, Any], start_date: str | None = None, end_date: str | None = None):
+    _, ref = _window_30d(tables, start_date, end_date)
+    per, exp = _peremptions(tables)
+    jours = exp - ref.toordinal()
+    selected = np.flatnonzero((exp != 0) & (jours <= 30))
+    pids = _values(per, "produit_id")
+    q = _num(per, "quantite", present=True)
+    return [
+        {"produit_id": pids[i], "jours_restants": max(0, int(jours[i])), "quantite": float(q[i])}
+        for i in selected.tolist()
+    ]
+
+
+def get_kpi_contraction_stock_qte(tables: Dict[str, Any], start_date: str | None = None, end_date: str | None = None):
+    start, end = _window_30d(tables, start_date, end_date)
+    mvts = tables.get("mouvement_stock", []) or []
+    in_window = _in_range(_days(mvts, "datemouvement", "date_mouvement"), start, end)
+    q = _num(mvts, "quantite", present=True)
+    kind = _codes(
+        _values(mvts, "typemouvement", ""),
+        lambda t: 1 if str(t).strip().lower() in _LOSS_TYPES else 2 if str(t).strip().lower().startswith("ajustement") else 0,
+    )
+    val = np.where(kind == 1, np.abs(q), np.where((kind == 2) & (q < 0), -q, 0.0))
+    return float(round(_seq_sum(val[in_window & (kind != 0)]), 2))
+
+
+# ============================================================
+# Séries (services/stock/chart.py)
+# ============================================================
+def _signed_deltas(mvts):
+    """_mvt_signed_quantity(typemouvement, _g(quantite, qte)) pour toutes les lignes."""
+    kind = _codes(_values(mvts, "typemouvement", ""), _mvt_kind)
+    q = _num(mvts, "quantite", "qte")
+    return np.select(
+        [kind == _MVT_IN, kind == _MVT_OUT, kind == _MVT_ADJ, kind == _MVT_LOSS],
+        [q, -q, q, -np.abs(q)],
+        0.0,
+    )
+
+
+@node("stock.np.deltas_by_day")
+def _deltas_by_day(tables: Dict[str, Any], lo: date, hi: date, entrepot_id: Any | None):
+    """Δ stock par jour sur [lo..hi] (index 0 = lo)."""
+    mvts = _entrepot_mvts(tables, entrepot_id)
+    n_days = (hi - lo).days + 1
+    ords = _days(mvts, "datemouvement", "date_mouvement")
+    mask = _in_range(ords, lo, hi)
+    return _bucket(ords, _signed_deltas(mvts), lo, n_days, mask), mask
+
+
+@node("stock.np.disponible_end")
+def _disponible_snapshot_end(tables: Dict[str, Any], entrepot_id: Any | None) -> float:
+    stock_rows = _entrepot_stock(tables, entrepot_id)
+    qd = _num(stock_rows, "quantitedisponible", present=True)
+    qr = _num(stock_rows, "quantitereserve", present=True)
+    return _seq_sum(np.maximum(0.0, qd - qr))
+
+
+@node("stock.np.disponible_series")
+def _disponible_series(tables: Dict[str, Any], start: date, end: date, entrepot_id: Any | None):
+    """dispo(d) = dispo(end) - Σ Δ(d+1..end), somme suffixe par cumsum inversé."""
+    delta, _ = _deltas_by_day(tables, start, end, entrepot_id)
+    suffix_after = np.concatenate((np.cumsum(delta[::-1])[::-1][1:], [0.0]))
+    return _disponible_snapshot_end(tables, entrepot_id) - suffix_after
+
+
+def _day_keys(days: List[date]) -> List[str]:
+    return [d.strftime("%Y-%m-%d") for d in days]
+
+
+def rpc_stock_disponible_series(tables, start_date: str | None = None, end_date: str | None = None, entrepot_id: Any | None = None):
+    if has_rollups(tables):
+        return _chart.rpc_stock_disponible_series(tables, start_date, end_date, entrepot_id)
+    start, end = _chart._resolve_window(start_date, end_date, default_days=6)
+    days = _chart._days_range(start, end)
+    dispo = _disponible_series(tables, start, end, entrepot_id)
+    return [{"day": k, "Disponible": round(float(v), 2)} for k, v in zip(_day_keys(days), dispo.tolist())]
+
+
+def rpc_days_on_hand_series(tables, start_date: str | None = None, end_date: str | None = None, entrepot_id: Any | None = None):
+    if has_rollups(tables):
+        return _chart.rpc_days_on_hand_series(tables, start_date, end_date, entrepot_id)
+    start, end = _chart._resolve_window(start_date, end_date, default_days=6)
+    days = _chart._days_range(start, end)
+    dispo = _disponible_series(tables, start, end, entrepot_id)
+
+    lo = start - timedelta(days=29)
+    delta, _ = _deltas_by_day(tables, lo, end, entrepot_id)
+    prefix = _prefix(np.maximum(0.0, -delta))
+    conso = prefix[30:] - prefix[:-30]
+
+    out = []
+    for k, c, dispo_d in zip(_day_keys(days), conso.tolist(), dispo.tolist()):
+        doh = 0.0
+        if c > 0:
+            avg = c / 30.0
+            doh = round(round(dispo_d, 2) / avg, 2) if avg > 0 else 0.0
+        out.append({"day": k, "DOH": doh})
+    return out
+
+
+@node("stock.np.value_end")
+def _stock_value_end(tables: Dict[str, Any], entrepot_id: Any | None) -> float:
+    stock_rows = _entrepot_stock(tables, entrepot_id)
+    q = _num(stock_rows, "quantitedisponible", present=True)
+    val = np.maximum(0.0, q) * np.maximum(0.0, _prix_stock(tables, stock_rows))
+    return _seq_sum(val)
+
+
+@node("stock.np.ca_30d_series")
+def _ca_30d_series(tables: Dict[str, Any], start: date, end: date):
+    """CA glissant [d-29..d] pour chaque jour de [start..end]."""
+    lo = start - timedelta(days=29)
+    lignes = tables.get("lignecommande", []) or []
+    ords = _livraison_lignes(tables, lignes)
+    q = _num(lignes, "quantite_commandee", "quantite")
+    pu = _num(lignes, "prix_unitaire", "prix")
+    buckets = _bucket(ords, np.maximum(0.0, q * pu), lo, (end - lo).days + 1, _in_range(ords, lo, end))
+    prefix = _prefix(buckets)
+    return prefix[30:] - prefix[:-30]
+
+
+def _stock_value_series(tables, start_date, end_date, entrepot_id):
+    start, end = _chart._resolve_window(start_date, end_date, default_days=6)
+    days = _chart._days_range(start, end)
+    # round() Python (np.round n'arrondit pas pareil) : mêmes valeurs que dispo_by_day
+    dispo = [round(v, 2) for v in _disponible_series(tables, start, end, entrepot_id).tolist()]
+    dispo_end = max(0.0001, dispo[-1])
+    stock_val_end = _stock_value_end(tables, entrepot_id)
+    stock_val = [(stock_val_end * d / dispo_end) if dispo_end > 0 else 0.0 for d in dispo]
+    return days, _ca_30d_series(tables, start, end).tolist(), stock_val
+
+
+def rpc_taux_rotation_series(tables, start_date: str | None = None, end_date: str | None = None, entrepot_id: Any | None = None):
+    if has_rollups(tables):
+        return _chart.rpc_taux_rotation_series(tables, start_date, end_date, entrepot_id)
+    days, ca, stock_val = _stock_value_series(tables, start_date, end_date, entrepot_id)
+    return [
+        {"day": k, "Rotation": round((c / v), 2) if v > 0 else 0.0}
+        for k, c, v in zip(_day_keys(days), ca, stock_val)
+    ]
+
+
+def rpc_inventory_to_sales_series(tables, start_date: str | None = None, end_date: str | None = None, entrepot_id: Any | None = None):
+    if has_rollups(tables):
+        return _chart.rpc_inventory_to_sales_series(tables, start_date, end_date, entrepot_id)
+    days, ca, stock_val = _stock_value_series(tables, start_date, end_date, entrepot_id)
+    return [
+        {"day": k, "I2S": round(v / c, 2) if c > 0 else 0.0}
+        for k, c, v in zip(_day_keys(days), ca, stock_val)
+    ]
+
+
+def rpc_rentabilite_stock_series(
+    tables,
+    start_date: str | None = None,
+    end_date: str | None = None,
+    entrepot_id: Any | None = None,
+    cout_ratio: float = 0.7,
+    couts_logistiques: float = 0.0
+):
+    if has_rollups(tables):
+        return _chart.rpc_rentabilite_stock_series(tables, start_date, end_date, entrepot_id, cout_ratio, couts_logistiques)
+    days, ca, stock_val = _stock_value_series(tables, start_date, end_date, entrepot_id)
+    out = []
+    for k, c, v in zip(_day_keys(days), ca, stock_val):
+        cdv = c * max(0.0, min(1.0, cout_ratio))
+        marge = c - cdv - max(0.0, couts_logistiques)
+        out.append({"day": k, "Rentabilité": round(marge / v, 2) if v > 0 else 0.0})
+    return out
+
+
+def rpc_taux_rupture_series(tables, start_date: str | None = None, end_date: str | None = None, entrepot_id: Any | None = None):
+    if has_rollups(tables):
+        return _chart.rpc_taux_rupture_series(tables, start_date, end_date, entrepot_id)
+    start, end = _chart._resolve_window(start_date, end_date, default_days=6)
+    days = _chart._days_range(start, end)
+    lo = start - timedelta(days=29)
+    n_days = (end - lo).days + 1
+
+    # Demande par produit et par jour de livraison
+    lignes = tables.get("lignecommande", []) or []
+    livr = _livraison_lignes(tables, lignes)
+    livrees = _in_range(livr, lo, end)
+    codes, index = _factorize([p for p, keep in zip(_values(lignes, "produit_id"), livrees) if keep])
+    q = np.maximum(0.0, _num(lignes, "quantite_commandee", "quantite"))[livrees]
+    n_prod = len(index)
+    flat = codes * n_days + (livr[livrees] - lo.toordinal())
+    demande = np.bincount(flat, weights=q, minlength=n_prod * n_days).reshape(n_prod, n_days)
+
+    # Sorties par produit et par jour (mêmes produits)
+    mvts = _entrepot_mvts(tables, entrepot_id)
+    stock_prod_map = lookup_by(tables.get("stock", []) or [], "id", "produit_id")
+    typ = _codes(_values(mvts, "typemouvement", ""), lambda t: int(str(t).lower().startswith("sortie")))
+    ords = _days(mvts, "datemouvement", "date_mouvement")
+    pids = [p or stock_prod_map.get(sid) for p, sid in zip(_values(mvts, "produit_id"), _values(mvts, "stock_id"))]
+    serv_codes = np.array([index.get(p, -1) if p is not None else -1 for p in pids], dtype=np.int64)
+    mask = (typ == 1) & _in_range(ords, lo, end) & (serv_codes >= 0)
+    qs = np.maximum(0.0, _num(mvts, "quantite", "qte"))[mask]
+    flat = serv_codes[mask] * n_days + (ords[mask] - lo.toordinal())
+    sorties = np.bincount(flat, weights=qs, minlength=n_prod * n_days).reshape(n_prod, n_days)
+
+    dem_prefix, serv_prefix = _prefix(demande), _prefix(sorties)
+    out = []
+    for i, k in enumerate(_day_keys(days)):
+        dem = dem_prefix[:, i + 30] - dem_prefix[:, i]
+        serv = serv_prefix[:, i + 30] - serv_prefix[:, i]
+        total_dem = _seq_sum(dem)
+        non_serv = _seq_sum(np.maximum(0.0, dem - np.minimum(dem, serv)))
+        taux = round(100.0 * non_serv / total_dem, 2) if total_dem > 0 else 0.0
+        out.append({"day": k, "Rupture %": taux})
+    return out
+
+
+def rpc_remaining_shelf_life_series(tables, start_date: str | None = None, end_date: str | None = None, entrepot_id: Any | None = None):
+    start, end = _chart._resolve_window(start_date, end_date, default_days=6)
+    days = _chart._days_range(start, end)
+
+    per = peremptions_for_entrepot(tables.get("peremption", []) or [], tables.get("stock", []) or [], entrepot_id)
+    exp = _days(per, "dateexpiration", "date_expiration")
+    mask = exp != 0
+    q = _num(per, "quantite", "qte")[mask]
+    exp = exp[mask]
+    tot_q = _seq_sum(q)
+
+    out = []
+    for d, k in zip(days, _day_keys(days)):
+        j = np.maximum(0, exp - d.toordinal())
+        avg = round(_seq_sum(q * j) / tot_q, 1) if tot_q > 0 else 0.0
+        out.append({"day": k, "Avg days": avg})
+    return out
+
+
+def rpc_shrinkage_by_day(tables, start_date: str | None = None, end_date: str | None = None, entrepot_id: Any | None = None):
+    if has_rollups(tables):
+        return _chart.rpc_shrinkage_by_day(tables, start_date, end_date, entrepot_id)
+    start, end = _chart._resolve_window(start_date, end_date, default_days=6)
+    days = _chart._days_range(start, end)
+
+    mvts = _entrepot_mvts(tables, entrepot_id)
+    ords = _days(mvts, "datemouvement", "date_mouvement")
+    q = _num(mvts, "quantite", "qte")
+    kind = _codes(
+        _values(mvts, "typemouvement", ""),
+        lambda t: 1 if str(t).strip().lower() in _LOSS_TYPES else 2 if str(t).strip().lower().startswith("ajustement") else 0,
+    )
+    val = np.where(kind == 1, np.abs(q), np.where((kind == 2) & (q < 0), np.abs(q), 0.0))
+    mask = _in_range(ords, start, end) & (val != 0)
+
+    # sommes brutes par jour, arrondies une seule fois (comme services/stock/chart.py)
+    agg = [0.0] * len(days)
+    for o, v in zip(ords[mask].tolist(), val[mask].tolist()):
+        agg[o - start.toordinal()] += v
+    return [{"day": k, "Quantité": round(a, 2)} for k, a in zip(_day_keys(days), agg)]
+
+
+# ============================================================
+# Sélection du backend
+# ============================================================
+VECTORIZED_RPCS = {
+    "kpi_quantite_stock": get_kpi_quantite_stock,
+    "kpi_quantite_reservee": get_kpi_quantite_reservee,
+    "kpi_stock_disponible": get_kpi_stock_disponible,
+    "kpi_days_on_hand": get_kpi_days_on_hand,
+    "kpi_taux_rotation": get_kpi_taux_rotation,
+    "kpi_inventory_to_sales": get_kpi_inventory_to_sales,
+    "kpi_rentabilite_stock": get_kpi_rentabilite_stock,
+    "kpi_taux_rupture": get_kpi_taux_rupture,
+    "kpi_remaining_shelf_life_avg": get_kpi_remaining_shelf_life_avg,
+    "kpi_produits_proches_peremption": get_kpi_produits_proches_peremption,
+    "kpi_contraction_stock_qte": get_kpi_contraction_stock_qte,
+    "rpc_stock_disponible_series": rpc_stock_disponible_series,
+    "rpc_days_on_hand_series": rpc_days_on_hand_series,
+    "rpc_taux_rotation_series": rpc_taux_rotation_series,
+    "rpc_inventory_to_sales_series": rpc_inventory_to_sales_series,
+    "rpc_rentabilite_stock_series": rpc_rentabilite_stock_series,
+    "rpc_taux_rupture_series": rpc_taux_rupture_series,
+    "rpc_remaining_shelf_life_series": rpc_remaining_shelf_life_series,
+    "rpc_shrinkage_by_day": rpc_shrinkage_by_day,
+}
+
+
+def stock_backend_rpcs() -> Dict[str, Callable]:
+    """RPC à substituer dans RPC_PYTHON_MAP selon STOCK_COMPUTE_BACKEND."""
+    if STOCK_COMPUTE_BACKEND != "numpy":
+        return {}
+    if np is None:
+        print("[STOCK] STOCK_COMPUTE_BACKEND=numpy mais numpy n'est pas installé, backend Python conservé")
+        return {}
+    return dict(VECTORIZED_RPCS)
@@ -0,0 +1,152 @@
+# services/table_cache.py
+from __future__ import annotations
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Iterable, Optional, Tuple
+
+# ============================================================
+# Cache L1 (par worker) des tables décodées, devant Redis
+# ------------------------------------------------------------
+# Redis :
+#   table_cache:{table}    -> blob de la table complète (TTL TABLE_CACHE_TTL)
+#   table_cache:{table}:p… -> blob d'une projection (sous-ensemble de colonnes)
+#   …:s{colonne}:{YYYY-MM} -> tranche mensuelle d'une table bornée en dates
+#   table_columns:{table}  -> colonnes réelles de la table (TTL TABLE_SCHEMA_TTL)
+#   table_fresh:{clé}      -> présent tant que le blob est à jour (TTL TABLE_CACHE_TTL) ;
+#                             au-delà le blob reste servi (stale-while-revalidate)
+#   table_lock:{clé}       -> verrou de remplissage (single-flight entre workers),
+#                             valeur = jeton de fencing tiré de table_fence:{clé}
+#   table_version:{table}  -> compteur de version, incrémenté par consumer.py
+#                             à chaque invalidation (pas de TTL)
+# L1 : une entrée = (version, date d'expiration, ColumnarTable).
+#   Valide tant que la version Redis n'a pas bougé et que l'entrée n'a pas
+#   expiré (TABLE_CACHE_TTL par défaut). Bornée en mémoire, éviction LRU.
+# ============================================================
+
+TABLE_CACHE_TTL = 300  # secondes
+TABLE_SCHEMA_TTL = 24 * 60 * 60
+# Delta sync : le blob vit TABLE_RECONCILE_TTL ; à expiration -> rechargement complet
+TABLE_RECONCILE_TTL = int(os.getenv("TABLE_RECONCILE_TTL", str(60 * 60)))
+DELTA_SYNC_TABLES = {
+    t.strip()
+    for t in os.getenv("DELTA_SYNC_TABLES", "mouvement_stock,changelog,reception_fournisseur").split(",")
+    if t.strip()
+}
+# Stale-while-revalidate : durée pendant laquelle un blob périmé reste servi
+TABLE_STALE_GRACE = int(os.getenv("TABLE_STALE_GRACE", "120"))
+# Un snapshot servi périmé n'est gardé en L1 que brièvement
+TABLE_STALE_L1_TTL = 5
+# Single-flight : durée du verrou et attente max d'un worker suiveur
+TABLE_LOCK_TTL_MS = int(os.getenv("TABLE_LOCK_TTL_MS", "30000"))
+TABLE_LOCK_WAIT = float(os.getenv("TABLE_LOCK_WAIT", "10"))
+L1_MAX_BYTES = int(os.getenv("TABLE_L1_MAX_BYTES", str(256 * 1024 * 1024)))
+
+
+def cache_key(table: str, columns: Optional[Iterable[str]] = None, part: Optional[str] = None) -> str:
+    """
+    columns=None -> table complète ; sinon une clé par projection.
+    part -> tranche de la table (ex. 'datemouvement:2025-09').
+    """
+    key = f"table_cache:{table}"
+    if columns is not None:
+        digest = hashlib.sha1(",".join(sorted(columns)).encode()).hexdigest()[:12]
+        key += f":p{digest}"
+    if part is not None:
+        key += f":s{part}"
+    return key
+
+
+def cache_key_pattern(table: str) -> str:
+    """Motif SCAN de toutes les variantes (projections, tranches) d'une table."""
+    return f"table_cache:{table}:*"
+
+
+def slice_of(key: str) -> Optional[Tuple[str, str]]:
+    """(colonne date, 'YYYY-MM') d'une clé de tranche mensuelle, None sinon."""
+    parts = key.split(":")
+    if len(parts) < 4 or not parts[-2].startswith("s"):
+        return None
+    month = parts[-1]
+    if len(month) != 7 or month[4] != "-" or not (month[:4] + month[5:]).isdigit():
+        return None
+    return parts[-2][1:], month
+
+
+def fresh_key(key: str) -> str:
+    return f"table_fresh:{key}"
+
+
+def lock_key(key: str) -> str:
+    return f"table_lock:{key}"
+
+
+def fence_key(key: str) -> str:
+    return f"table_fence:{key}"
+
+
+def schema_key(table: str) -> str:
+    return f"table_columns:{table}"
+
+
+def version_key(table: str) -> str:
+    return f"table_version:{table}"
+
+
+def parse_version(raw: Any) -> str:
+    """Version absente = '0' (table jamais invalidée)."""
+    if raw is None:
+        return "0"
+    return raw.decode() if isinstance(raw, bytes) else str(raw)
+
+
+class L1TableCache:
+    def __init__(self, max_bytes: int = L1_MAX_BYTES, ttl: float = TABLE_CACHE_TTL):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._entries: "OrderedDict[str, Tuple[str, float, Any, int]]" = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def get(self, key: str, version: str) -> Optional[Any]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            v, expires_at, table, _ = entry
+            if v != version or time.monotonic() > expires_at:
+                self._drop(key)
+                return None
+            self._entries.move_to_end(key)
+            return table
+
+    def put(self, key: str, version: str, table: Any, ttl: Optional[float] = None) -> None:
+        nbytes = table.nbytes() if hasattr(table, "nbytes") else 0
+        if nbytes > self.max_bytes:
+            return
+        with self._lock:
+            self._drop(key)
+            expires_at = time.monotonic() + (self.ttl if ttl is None else ttl)
+            self._entries[key] = (version, expires_at, table, nbytes)
+            self._size += nbytes
+            while self._size > self.max_bytes and self._entries:
+                self._drop(next(iter(self._entries)))
+
+    def evict(self, key: str) -> None:
+        with self._lock:
+            self._drop(key)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
+
+    def _drop(self, key: str) -> None:
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._size -= entry[3]
+
+
+l1_cache = L1TableCache()
@@ -0,0 +1,220 @@
+# services/table_codec.py
+from __future__ import annotations
+import json
+import os
+import struct
+import sys
+import uuid
+import zlib
+from array import array
+from typing import Any, List, Optional, Sequence, Tuple
+
+from services.table_store import ColumnarTable, _Column, KIND_INT, KIND_FLOAT, KIND_DATE, KIND_OBJ
+
+# ============================================================
+# Format binaire du cache Redis des tables (v1)
+# ------------------------------------------------------------
+# blob  = b"TCB" + version(1o) + flags(1o) + corps (zlib si flags & 1)
+# corps = n_lignes(u32) n_colonnes(u16) puis par colonne :
+#         nom(u16 + utf8) type(u8) a_nulls(u8) taille(u32) données [+ masque nulls]
+#   int -> int64 LE, float -> float64 LE, date -> int32 LE (ordinaux),
+#   obj -> liste JSON compacte.
+# Au-delà de TABLE_CHUNK_BYTES, le blob est découpé : la clé table_cache:…
+# ne contient qu'un en-tête b"TCH" + version + n_chunks(u32) + nonce, et les
+# morceaux vivent sous table_chunk:{clé}:{nonce}:{i}. Le nonce change à chaque
+# écriture : un lecteur ne mélange jamais deux versions. Les morceaux de
+# l'écriture précédente (lus dans l'en-tête courant, sous WATCH) sont retirés
+# dans la même transaction : TTL ramené à TABLE_CHUNK_GRACE secondes, le
+# temps qu'un lecteur en cours finisse son second MGET.
+# Lu en bytes bruts (client Redis sans decode_responses).
+# Commandes Redis 6 uniquement (SETEX, EXPIRE sans option, TTL).
+# ============================================================
+
+FORMAT_VERSION = 1
+_MAGIC = b"TCB"
+_CHUNK_MAGIC = b"TCH"
+_FLAG_ZLIB = 1
+
+TABLE_CHUNK_BYTES = int(os.getenv("TABLE_CHUNK_BYTES", str(512 * 1024)))
+TABLE_CHUNK_GRACE = int(os.getenv("TABLE_CHUNK_GRACE", "5"))
+TABLE_COMPRESS_MIN_BYTES = int(os.getenv("TABLE_COMPRESS_MIN_BYTES", str(16 * 1024)))
+
+_KIND_CODES = {KIND_INT: 1, KIND_FLOAT: 2, KIND_DATE: 3, KIND_OBJ: 4}
+_CODE_KINDS = {v: k for k, v in _KIND_CODES.items()}
+_TYPECODES = {KIND_INT: "q", KIND_FLOAT: "d", KIND_DATE: "i"}
+_BIG_ENDIAN = sys.byteorder == "big"
+
+
+def _array_bytes(data: array) -> bytes:
+    if _BIG_ENDIAN:
+        data = array(data.typecode, data)
+        data.byteswap()
+    return data.tobytes()
+
+
+def _bytes_array(typecode: str, raw: bytes) -> array:
+    data = array(typecode)
+    data.frombytes(raw)
+    if _BIG_ENDIAN:
+        data.byteswap()
+    return data
+
+
+def encode_table(table: ColumnarTable, compress: bool = True) -> bytes:
+    out = [struct.pack("<IH", table.length, len(table.columns))]
+    for name, col in table.columns.items():
+        if col.kind == KIND_OBJ:
+            raw = json.dumps(col.data, separators=(",", ":"), default=str).encode()
+        else:
+            raw = _array_bytes(col.data)
+        name_b = name.encode()
+        out.append(struct.pack("<H", len(name_b)))
+        out.append(name_b)
+        out.append(struct.pack("<BBI", _KIND_CODES[col.kind], 1 if col.nulls is not None else 0, len(raw)))
+        out.append(raw)
+        if col.nulls is not None:
+            out.append(bytes(col.nulls))
+    body = b"".join(out)
+    flags = 0
+    if compress and len(body) >= TABLE_COMPRESS_MIN_BYTES:
+        body = zlib.compress(body, 1)
+        flags |= _FLAG_ZLIB
+    return _MAGIC + bytes((FORMAT_VERSION, flags)) + body
+
+
+def decode_table(blob: Any) -> ColumnarTable:
+    """Format binaire, ou ancien format JSON (colonnaire / liste de dicts)."""
+    if isinstance(blob, str):
+        return ColumnarTable.from_payload(json.loads(blob))
+    if not blob.startswith(_MAGIC):
+        return ColumnarTable.from_payload(json.loads(blob))
+    version, flags = blob[3], blob[4]
+    if version != FORMAT_VERSION:
+        raise ValueError(f"format de cache inconnu: v{version}")
+    body = blob[5:]
+    if flags & _FLAG_ZLIB:
+        body = zlib.decompress(body)
+    view = memoryview(body)
+    n_rows, n_cols = struct.unpack_from("<IH", view, 0)
+    pos = 6
+    columns = {}
+    for _ in range(n_cols):
+        (name_len,) = struct.unpack_from("<H", view, pos)
+        pos += 2
+        name = bytes(view[pos:pos + name_len]).decode()
+        pos += name_len
+        code, has_nulls, size = struct.unpack_from("<BBI", view, pos)
+        pos += 6
+        raw = bytes(view[pos:pos + size])
+        pos += size
+        kind = _CODE_KINDS[code]
+        nulls = None
+        if has_nulls:
+            nulls = bytearray(view[pos:pos + n_rows])
+            pos += n_rows
+        if kind == KIND_OBJ:
+            columns[name] = _Column(kind, json.loads(raw))
+        else:
+            columns[name] = _Column(kind, _bytes_array(_TYPECODES[kind], raw), nulls)
+    return ColumnarTable(columns, n_rows)
+
+
+# ---------- découpage en morceaux ----------
+def _chunk_key(key: str, nonce: str, i: int) -> str:
+    return f"table_chunk:{key}:{nonce}:{i}"
+
+
+def _chunk_header(head: bytes) -> Optional[Tuple[int, str]]:
+    if not head.startswith(_CHUNK_MAGIC):
+        return None
+    (count,) = struct.unpack_from("<I", head, 4)
+    return count, head[8:].decode()
+
+
+def _retire_chunks(pipe, key: str, previous: Optional[bytes]) -> None:
+    """Ramène le TTL des morceaux de l'ancien en-tête à TABLE_CHUNK_GRACE."""
+    header = _chunk_header(previous) if previous else None
+    if header:
+        count, nonce = header
+        for i in range(count):
+            pipe.expire(_chunk_key(key, nonce, i), TABLE_CHUNK_GRACE)
+
+
+def remaining_ttl(pipe, key: str, ttl: int) -> int:
+    """
+    TTL restant de la clé, ttl si elle n'en a pas (ou plus). À lire sous WATCH,
+    avant MULTI : remplace SET KEEPTTL + EXPIRE NX (Redis 7) par un SETEX.
+    """
+    current = pipe.ttl(key)
+    return current if current and current > 0 else ttl
+
+
+def write_blob(pipe, key: str, blob: bytes, ttl: int, previous: Optional[bytes] = None) -> None:
+    """
+    Écrit un blob (découpé si besoin) dans un pipeline, clé et morceaux sous ttl.
+    previous : en-tête actuellement stocké sous la clé (lu sous WATCH) ;
+    ses morceaux sont retirés.
+    """
+    _retire_chunks(pipe, key, previous)
+    chunks: List[bytes] = []
+    head = blob
+    if len(blob) > TABLE_CHUNK_BYTES:
+        chunks = [blob[i:i + TABLE_CHUNK_BYTES] for i in range(0, len(blob), TABLE_CHUNK_BYTES)]
+        nonce = uuid.uuid4().hex[:12]
+        head = _CHUNK_MAGIC + bytes((FORMAT_VERSION,)) + struct.pack("<I", len(chunks)) + nonce.encode()
+        for i, chunk in enumerate(chunks):
+            pipe.setex(_chunk_key(key, nonce, i), ttl, chunk)
+    pipe.setex(key, ttl, head)
+
+
+def delete_blob(pipe, key: str, previous: Optional[bytes] = None) -> None:
+    """Supprime la clé et retire les morceaux de son en-tête."""
+    _retire_chunks(pipe, key, previous)
+    pipe.delete(key)
+
+
+def _chunk_lookups(keys: Sequence[str], heads: List[Optional[bytes]]) -> List[Tuple[int, List[str]]]:
+    wanted = []
+    for n, head in enumerate(heads):
+        header = _chunk_header(head) if head else None
+        if header:
+            count, nonce = header
+            wanted.append((n, [_chunk_key(keys[n], nonce, i) for i in range(count)]))
+    return wanted
+
+
+def _join_chunks(heads: List[Optional[bytes]], wanted: List[Tuple[int, List[str]]], values: List[Optional[bytes]]):
+    pos = 0
+    for n, ks in wanted:
+        parts = values[pos:pos + len(ks)]
+        pos += len(ks)
+        heads[n] = None if any(p is None for p in parts) else b"".join(parts)
+    return heads
+
+
+def read_blobs_with_heads(client, keys: Sequence[str]) -> Tuple[List[Optional[bytes]], List[Optional[bytes]]]:
+    """
+    MGET des clés, puis un second MGET pour les morceaux des blobs découpés.
+    Renvoie (blobs, en-têtes) : les en-têtes servent à retirer les anciens
+    morceaux lors d'une réécriture (write_blob(previous=...)).
+    Un morceau manquant (expiré, réécrit) = blob absent.
+    """
+    heads = client.mget(list(keys)) if keys else []
+    wanted = _chunk_lookups(keys, heads)
+    if not wanted:
+        return list(heads), heads
+    return _join_chunks(list(heads), wanted, client.mget([k for _, ks in wanted for k in ks])), heads
+
+
+def read_blobs(client, keys: Sequence[str]) -> List[Optional[bytes]]:
+    """Blobs des clés (morceaux réassemblés), None si absent."""
+    return read_blobs_with_heads(client, keys)[0]
+
+
+async def aread_blobs(client, keys: Sequence[str]) -> List[Optional[bytes]]:
+    """read_blobs sur un client redis.asyncio."""
+    heads = await client.mget(list(keys)) if keys else []
+    wanted = _chunk_lookups(keys, heads)
+    if not wanted:
+        return heads
+    return _join_chunks(heads, wanted, await client.mget([k for _, ks in wanted for k in ks]))
@@ -0,0 +1,44 @@
+# services/table_dates.py
+from __future__ import annotations
+from datetime import date, datetime
+from functools import lru_cache
+from typing import Any, Optional
+
+# ============================================================
+# Parsing des dates partagé par les widgets
+# ------------------------------------------------------------
+# Chemin rapide ISO-8601 ('YYYY-MM-DD…', timestamps Supabase compris),
+# puis repli sur les anciens formats tolérés. Les chaînes déjà vues sont
+# mémorisées : une même date n'est parsée qu'une fois par worker.
+# Les colonnes des tables chargées passent par ColumnarTable.dates(),
+# calculé une fois par version de table (voir services/table_store.py).
+# ============================================================
+
+_LEGACY_FORMATS = ("%Y-%m-%d", "%Y/%m/%d", "%d/%m/%Y", "%Y-%m-%d %H:%M:%S", "%Y-%m-%dT%H:%M:%S")
+_PARSE_CACHE_SIZE = 1 << 16
+
+
+@lru_cache(maxsize=_PARSE_CACHE_SIZE)
+def _parse_str(s: str) -> Optional[date]:
+    if len(s) >= 10 and s[4] == "-" and s[7] == "-":
+        try:
+            return date.fromisoformat(s[:10])
+        except ValueError:
+            pass
+    for fmt in _LEGACY_FORMATS:
+        try:
+            return datetime.strptime(s[:len(fmt)], fmt).date()
+        except ValueError:
+            pass
+    try:
+        return datetime.fromisoformat(s).date()
+    except ValueError:
+        return None
+
+
+def parse_date(v: Any) -> Optional[date]:
+    if v is None or isinstance(v, str) and v in ("", "null"):
+        return None
+    if isinstance(v, date):
+        return v
+    return _parse_str(v if isinstance(v, str) else str(v))
@@ -0,0 +1,452 @@
+# services/table_store.py
+from __future__ import annotations
+from array import array
+from collections.abc import Mapping
+from datetime import date
+from math import isnan
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional
+
+from services.table_dates import parse_date
+
+# ============================================================
+# Stockage colonnaire des tables chargées
+# ------------------------------------------------------------
+# Une colonne = un tableau typé :
+#   - "int"   : array('q')  + masque des nulls (bytearray)
+#   - "float" : array('d')  (NaN = null)
+#   - "date"  : array('i')  ordinaux (0 = null), valeurs 'YYYY-MM-DD' uniquement
+#   - "obj"   : list Python (textes, booléens, timestamps, json…)
+# Une colonne qui mêle entiers et flottants est "obj" : chaque valeur garde
+# son type (12 reste 12, pas 12.0).
+# Les fonctions de RPC_PYTHON_MAP lisent la table via RowView, qui se comporte
+# comme le dict d'origine (get, [], in, itération des clés).
+# Les colonnes de dates sont parsées une seule fois par table (dates()) :
+# une table en cache L1 = une version, donc un parsing par version.
+# Même principe pour les index de jointure (index_by, lookup_by, group_by,
+# table_index) : construits au premier appel, gardés avec la table, donc
+# reconstruits seulement quand la version de la table change.
+# ============================================================
+
+KIND_INT = "int"
+KIND_FLOAT = "float"
+KIND_DATE = "date"
+KIND_OBJ = "obj"
+
+_INT64_MIN = -(2 ** 63)
+_INT64_MAX = 2 ** 63 - 1
+_NAN = float("nan")
+
+
+def _is_iso_day(v: Any) -> bool:
+    if not isinstance(v, str) or len(v) != 10 or v[4] != "-" or v[7] != "-":
+        return False
+    try:
+        date.fromisoformat(v)
+        return True
+    except ValueError:
+        return False
+
+
+def _infer_kind(values: List[Any]) -> str:
+    kind = None
+    for v in values:
+        if v is None:
+            continue
+        if isinstance(v, bool):
+            return KIND_OBJ
+        if isinstance(v, int):
+            if not (_INT64_MIN <= v <= _INT64_MAX):
+                return KIND_OBJ
+            if kind is None:
+                kind = KIND_INT
+            elif kind != KIND_INT:
+                return KIND_OBJ
+        elif isinstance(v, float):
+            if kind in (None, KIND_FLOAT):
+                kind = KIND_FLOAT
+            else:
+                return KIND_OBJ
+        elif isinstance(v, str) and kind in (None, KIND_DATE) and _is_iso_day(v):
+            kind = KIND_DATE
+        else:
+            return KIND_OBJ
+    return kind or KIND_OBJ
+
+
+class _Column:
+    __slots__ = ("kind", "data", "nulls")
+
+    def __init__(self, kind: str, data, nulls: Optional[bytearray] = None):
+        self.kind = kind
+        self.data = data
+        self.nulls = nulls
+
+    @classmethod
+    def build(cls, values: List[Any], kind: Optional[str] = None) -> "_Column":
+        kind = kind or _infer_kind(values)
+        if kind == KIND_INT:
+            nulls = bytearray(1 if v is None else 0 for v in values)
+            data = array("q", (0 if v is None else v for v in values))
+            return cls(kind, data, nulls if any(nulls) else None)
+        if kind == KIND_FLOAT:
+            return cls(kind, array("d", (_NAN if v is None else float(v) for v in values)))
+        if kind == KIND_DATE:
+            return cls(kind, array("i", (0 if v is None else date.fromisoformat(v).toordinal() for v in values)))
+        return cls(KIND_OBJ, list(values))
+
+    def value(self, i: int) -> Any:
+        kind = self.kind
+        if kind == KIND_OBJ:
+            return self.data[i]
+        if kind == KIND_FLOAT:
+            v = self.data[i]
+            return None if isnan(v) else v
+        if kind == KIND_INT:
+            if self.nulls is not None and self.nulls[i]:
+                return None
+            return self.data[i]
+        o = self.data[i]
+        return date.fromordinal(o).isoformat() if o else None
+
+    def values(self) -> List[Any]:
+        return [self.value(i) for i in range(len(self.data))]
+
+    def payload_values(self) -> List[Any]:
+        """Valeurs sérialisables JSON (ordinaux bruts pour les dates)."""
+        if self.kind == KIND_DATE:
+            return [o or None for o in self.data]
+        return self.values()
+
+    @classmethod
+    def from_payload(cls, kind: str, values: List[Any]) -> "_Column":
+        if kind == KIND_DATE:
+            return cls(kind, array("i", (v or 0 for v in values)))
+        return cls.build(values, kind)
+
+
+class RowView(Mapping):
+    """Vue 'dict' en lecture seule sur la ligne i d'une ColumnarTable."""
+    __slots__ = ("_table", "_i")
+
+    def __init__(self, table: "ColumnarTable", i: int):
+        self._table = table
+        self._i = i
+
+    def __getitem__(self, key: str) -> Any:
+        col = self._table.columns.get(key)
+        if col is None:
+            raise KeyError(key)
+        return col.value(self._i)
+
+    def get(self, key: str, default: Any = None) -> Any:
+        col = self._table.columns.get(key)
+        if col is None:
+            return default
+        return col.value(self._i)
+
+    def __contains__(self, key: object) -> bool:
+        return key in self._table.columns
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._table.columns)
+
+    def __len__(self) -> int:
+        return len(self._table.columns)
+
+    def date(self, *names: str) -> Optional[date]:
+        """Date de la première colonne non nulle parmi les alias (cache de la table)."""
+        columns = self._table.columns
+        for n in names:
+            col = columns.get(n)
+            if col is not None and col.value(self._i) is not None:
+                return self._table.dates(n)[self._i]
+        return None
+
+    def __repr__(self) -> str:
+        return f"RowView({dict(self)!r})"
+
+
+def row_date(row: Any, *names: str) -> Optional[date]:
+    """
+    parse_date(_g(row, *names)) : lit le cache de dates si row vient d'une
+    ColumnarTable, parse la valeur sinon (dict, {} de repli…).
+    """
+    if isinstance(row, RowView):
+        return row.date(*names)
+    for n in names:
+        v = row.get(n)
+        if v is not None:
+            return parse_date(v)
+    return None
+
+
+class ColumnarTable:
+    """
+    Table en mémoire, un tableau typé par colonne.
+    Se comporte comme une liste de lignes (len, itération, index) pour rester
+    compatible avec les fonctions qui attendent une liste de dicts.
+    """
+    __slots__ = ("columns", "length", "_dates", "_indexes")
+
+    def __init__(self, columns: Dict[str, _Column], length: int):
+        self.columns = columns
+        self.length = length
+        self._dates: Dict[str, List[Optional[date]]] = {}
+        self._indexes: Dict[Any, Any] = {}
+
+    # ---------- construction ----------
+    @classmethod
+    def from_rows(cls, rows: Iterable[Dict[str, Any]]) -> "ColumnarTable":
+        rows = rows if isinstance(rows, list) else list(rows)
+        names: Dict[str, None] = {}
+        for r in rows:
+            for k in r:
+                if k not in names:
+                    names[k] = None
+        columns = {n: _Column.build([r.get(n) for r in rows]) for n in names}
+        return cls(columns, len(rows))
+
+    @classmethod
+    def from_payload(cls, payload: Any) -> "ColumnarTable":
+        """Accepte le format colonnaire (to_payload) ou l'ancien format liste de dicts."""
+        if isinstance(payload, list):
+            return cls.from_rows(payload)
+        columns = {
+            name: _Column.from_payload(spec["kind"], spec["values"])
+            for name, spec in (payload.get("columns") or {}).items()
+        }
+        return cls(columns, int(payload.get("n", 0)))
+
+    @classmethod
+    def from_pages(cls, pages: Iterable[List[Dict[str, Any]]]) -> "ColumnarTable":
+        """
+        Construit la table page par page (fetch paginé) : seule la page en
+        cours existe sous forme de liste de dicts.
+        """
+        return cls.concat([cls.from_rows(rows) for rows in pages])
+
+    @classmethod
+    def concat(cls, parts: List["ColumnarTable"]) -> "ColumnarTable":
+        """Concatène des tranches (ex. partitions mensuelles) d'une même table."""
+        parts = [p for p in parts if p.length]
+        if not parts:
+            return cls({}, 0)
+        if len(parts) == 1:
+            return parts[0]
+        names: Dict[str, None] = {}
+        for p in parts:
+            for n in p.columns:
+                names.setdefault(n, None)
+        columns: Dict[str, _Column] = {}
+        for n in names:
+            cols = [p.columns.get(n) for p in parts]
+            kinds = {c.kind if c is not None else None for c in cols}
+            if len(kinds) == 1 and None not in kinds:
+                data = cols[0].data[:0]
+                for c in cols:
+                    data.extend(c.data)
+                nulls = None
+                if any(c.nulls is not None for c in cols):
+                    nulls = bytearray()
+                    for c in cols:
+                        nulls += c.nulls if c.nulls is not None else bytearray(len(c.data))
+                columns[n] = _Column(cols[0].kind, data, nulls)
+            else:
+                values: List[Any] = []
+                for p, c in zip(parts, cols):
+                    values.extend(c.values() if c is not None else [None] * p.length)
+                columns[n] = _Column.build(values)
+        return cls(columns, sum(p.length for p in parts))
+
+    def take(self, indices: List[int]) -> "ColumnarTable":
+        """Sous-table des lignes d'indices donnés (dans l'ordre)."""
+        columns: Dict[str, _Column] = {}
+        for name, col in self.columns.items():
+            data = col.data
+            if isinstance(data, array):
+                picked = array(data.typecode, (data[i] for i in indices))
+            else:
+                picked = [data[i] for i in indices]
+            nulls = bytearray(col.nulls[i] for i in indices) if col.nulls is not None else None
+            columns[name] = _Column(col.kind, picked, nulls if nulls and any(nulls) else None)
+        return ColumnarTable(columns, len(indices))
+
+    def without(self, keys: Iterable[Any], key: str = "id") -> "ColumnarTable":
+        """Copie sans les lignes dont la clé est dans keys."""
+        col = self.columns.get(key)
+        keys = set(keys)
+        if col is None or not keys or not self.length:
+            return self
+        keep = [i for i in range(self.length) if col.value(i) not in keys]
+        return self if len(keep) == self.length else self.take(keep)
+
+    def upsert(self, other: "ColumnarTable", key: str = "id") -> "ColumnarTable":
+        """
+        Remplace les lignes de même clé par celles de other, à leur position,
+        et ajoute les nouvelles à la fin (clé en double dans other : la dernière).
+        """
+        if not other.length:
+            return self
+        own, col = self.columns.get(key), other.columns.get(key)
+        if own is None or col is None:
+            return ColumnarTable.concat([self, other])
+        incoming: Dict[Any, int] = {}
+        for j, v in enumerate(col.values()):
+            if v is not None:
+                incoming[v] = j
+        offset = self.length
+        order: List[int] = []
+        placed = set()
+        for i, v in enumerate(own.values()):
+            j = incoming.get(v)
+            if j is None:
+                order.append(i)
+            elif v not in placed:
+                placed.add(v)
+                order.append(offset + j)
+        for j, v in enumerate(col.values()):
+            if v is None or (v not in placed and incoming[v] == j):
+                order.append(offset + j)
+        merged = ColumnarTable.concat([self, other])
+        if order == list(range(merged.length)):
+            return merged
+        return merged.take(order)
+
+    def max_value(self, name: str) -> Any:
+        """Plus grande valeur non nulle de la colonne (watermark), None si vide."""
+        col = self.columns.get(name)
+        if col is None:
+            return None
+        values = [v for v in col.values() if v is not None]
+        return max(values) if values else None
+
+    def to_payload(self) -> Dict[str, Any]:
+        return {
+            "n": self.length,
+            "columns": {
+                name: {"kind": col.kind, "values": col.payload_values()}
+                for name, col in self.columns.items()
+            },
+        }
+
+    def to_rows(self) -> List[Dict[str, Any]]:
+        names = list(self.columns)
+        cols = [self.columns[n].values() for n in names]
+        return [dict(zip(names, vals)) for vals in zip(*cols)] if names else [{} for _ in range(self.length)]
+
+    # ---------- accès colonnaire ----------
+    def column(self, name: str):
+        """Tableau brut de la colonne (array typé ou list), None si absente."""
+        col = self.columns.get(name)
+        return col.data if col is not None else None
+
+    def kind(self, name: str) -> Optional[str]:
+        col = self.columns.get(name)
+        return col.kind if col is not None else None
+
+    def dates(self, name: str) -> List[Optional[date]]:
+        """
+        Colonne parsée en dates (None si nulle/illisible), calculée au premier
+        appel puis gardée avec la table.
+        """
+        parsed = self._dates.get(name)
+        if parsed is None:
+            col = self.columns.get(name)
+            if col is None:
+                parsed = [None] * self.length
+            elif col.kind == KIND_DATE:
+                parsed = [date.fromordinal(o) if o else None for o in col.data]
+            else:
+                parsed = [parse_date(v) for v in col.values()]
+            self._dates[name] = parsed
+        return parsed
+
+    def memo(self, build: Callable[..., Any], *args: Any) -> Any:
+        """
+        build(self, *args) calculé au premier appel puis gardé avec la table
+        (clé = fonction + arguments). Les valeurs sont partagées entre les
+        requêtes : les appelants ne doivent pas les modifier.
+        """
+        key = (build, args)
+        try:
+            value = self._indexes.get(key)
+        except TypeError:  # argument non hashable (liste de repli…) : pas de mémo
+            return build(self, *args)
+        if value is None:
+            value = build(self, *args)
+            self._indexes[key] = value
+        return value
+
+    def nbytes(self) -> int:
+        """Taille approximative en mémoire (utilisée pour borner les caches)."""
+        total = 0
+        for col in self.columns.values():
+            if isinstance(col.data, array):
+                total += col.data.itemsize * len(col.data)
+            else:
+                total += 8 * len(col.data) + sum(len(v) for v in col.data if isinstance(v, str))
+            if col.nulls is not None:
+                total += len(col.nulls)
+        return total
+
+    # ---------- protocole "liste de lignes" ----------
+    def __len__(self) -> int:
+        return self.length
+
+    def __iter__(self) -> Iterator[RowView]:
+        for i in range(self.length):
+            yield RowView(self, i)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [RowView(self, j) for j in range(*i.indices(self.length))]
+        if i < 0:
+            i += self.length
+        if not 0 <= i < self.length:
+            raise IndexError(i)
+        return RowView(self, i)
+
+    def __repr__(self) -> str:
+        return f"ColumnarTable(rows={self.length}, columns={list(self.columns)})"
+
+
+# ---------- index de jointure ----------
+def table_index(rows: Any, build: Callable[..., Any], *args: Any) -> Any:
+    """
+    build(rows, *args) gardé avec la table si rows est une ColumnarTable
+    (une version), recalculé sinon (liste de dicts, [] de repli…).
+    build doit être une fonction de module : elle fait partie de la clé.
+    """
+    if isinstance(rows, ColumnarTable):
+        return rows.memo(build, *args)
+    return build(rows, *args)
+
+
+def _index_by(rows: Any, key: str) -> Dict[Any, Any]:
+    return {r.get(key): r for r in rows}
+
+
+def _lookup_by(rows: Any, key: str, value: str) -> Dict[Any, Any]:
+    return {r.get(key): r.get(value) for r in rows}
+
+
+def _group_by(rows: Any, key: str) -> Dict[Any, List[Any]]:
+    groups: Dict[Any, List[Any]] = {}
+    for r in rows:
+        groups.setdefault(r.get(key), []).append(r)
+    return groups
+
+
+def index_by(rows: Any, key: str = "id") -> Dict[Any, Any]:
+    """{row[key]: row} (clé primaire ; en cas de doublon, la dernière ligne)."""
+    return table_index(rows, _index_by, key)
+
+
+def lookup_by(rows: Any, key: str, value: str) -> Dict[Any, Any]:
+    """{row[key]: row[value]} (ex. stock.id -> stock.produit_id)."""
+    return table_index(rows, _lookup_by, key, value)
+
+
+def group_by(rows: Any, key: str) -> Dict[Any, List[Any]]:
+    """{row[key]: [lignes]} dans l'ordre de la table (clé étrangère)."""
+    return table_index(rows, _group_by, key)
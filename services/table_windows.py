@@ -0,0 +1,149 @@
+# services/table_windows.py
+from __future__ import annotations
+from datetime import date, timedelta
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+# ============================================================
+# Fenêtres de dates par RPC (predicate pushdown)
+# ------------------------------------------------------------
+# Pour chaque RPC bornée dans le temps :
+#   - un "resolver" qui reproduit la fenêtre [start..end] calculée par la RPC
+#     à partir de ses params (None = la RPC a besoin de tout l'historique,
+#     ex. end_date absent et déduit du max des données) ;
+#   - par table : les alias de la colonne date filtrée + le lookback (jours)
+#     des fenêtres glissantes [d-29..d].
+# Une table non déclarée pour une RPC est chargée sans filtre de date.
+# Non bornées volontairement : changelog (durée depuis le statut précédent,
+# arbitrairement ancien), peremption (distance à l'expiration), et les KPI
+# fournisseur dont la date retombe sur une autre colonne/table (on-time,
+# lead time, non-conformité, transport).
+# ============================================================
+
+Window = Tuple[date, date]
+
+
+def _parse_day(v: Any) -> Optional[date]:
+    if isinstance(v, date):
+        return v
+    try:
+        return date.fromisoformat(str(v)[:10])
+    except ValueError:
+        return None
+
+
+def _window(params: Dict[str, Any], default_days: int, explicit_end: bool) -> Optional[Window]:
+    start_raw, end_raw = params.get("start_date"), params.get("end_date")
+    if end_raw:
+        end = _parse_day(end_raw)
+        if end is None:
+            return None
+    elif explicit_end:
+        return None
+    else:
+        end = date.today()
+    if start_raw:
+        start = _parse_day(start_raw)
+        if start is None:
+            return None
+    else:
+        start = end - timedelta(days=default_days)
+    if start > end:
+        start, end = end, start
+    return start, end
+
+
+def default_window(default_days: int) -> Callable[[Dict[str, Any]], Optional[Window]]:
+    """end_date par défaut = aujourd'hui (charts stock / commandes)."""
+    return lambda params: _window(params, default_days, explicit_end=False)
+
+
+def explicit_window(default_days: int) -> Callable[[Dict[str, Any]], Optional[Window]]:
+    """Borne seulement si end_date est fourni (sinon la RPC le déduit des données)."""
+    return lambda params: _window(params, default_days, explicit_end=True)
+
+
+def _stock_kpi_window(params: Dict[str, Any]) -> Optional[Window]:
+    # _window_30d : [start..end], et DOH lit toujours [end-29..end]
+    w = _window(params, 29, explicit_end=True)
+    return (min(w[0], w[1] - timedelta(days=29)), w[1]) if w else None
+
+
+_MVT_DATE = ("datemouvement", "date_mouvement")
+_LIVRAISON = ("date_reelle_livraison",)
+_CMD_DATE = ("date_commande",)
+_REC_DATE = ("date_reception", "date_reelle_livraison", "datereception", "datevalidation")
+_RET_DATE = ("date_retour", "dateretour")
+
+_CMD_CHART = (default_window(6), {"commandeclient": (_CMD_DATE, 0)})
+_STOCK_VALUE_CHART = (default_window(6), {"mouvement_stock": (_MVT_DATE, 0), "commandeclient": (_LIVRAISON, 29)})
+_STOCK_KPI = (_stock_kpi_window, {"mouvement_stock": (_MVT_DATE, 0), "commandeclient": (_LIVRAISON, 0)})
+
+WIDGET_DATE_WINDOWS = {
+    "chart_duree_cycle_moyenne": _CMD_CHART,
+    "chart_taux_annulation": _CMD_CHART,
+    "chart_otif": _CMD_CHART,
+    "chart_taux_retard": _CMD_CHART,
+    "chart_commandes_client": _CMD_CHART,
+
+    "kpi_days_on_hand": _STOCK_KPI,
+    "kpi_taux_rotation": _STOCK_KPI,
+    "kpi_inventory_to_sales": _STOCK_KPI,
+    "kpi_rentabilite_stock": _STOCK_KPI,
+    "kpi_taux_rupture": _STOCK_KPI,
+    "kpi_contraction_stock_qte": _STOCK_KPI,
+
+    "rpc_stock_disponible_series": (default_window(6), {"mouvement_stock": (_MVT_DATE, 0)}),
+    "rpc_days_on_hand_series": (default_window(6), {"mouvement_stock": (_MVT_DATE, 29)}),
+    "rpc_taux_rotation_series": _STOCK_VALUE_CHART,
+    "rpc_inventory_to_sales_series": _STOCK_VALUE_CHART,
+    "rpc_rentabilite_stock_series": _STOCK_VALUE_CHART,
+    "rpc_taux_rupture_series": (default_window(6), {"mouvement_stock": (_MVT_DATE, 29), "commandeclient": (_LIVRAISON, 29)}),
+    "rpc_shrinkage_by_day": (default_window(6), {"mouvement_stock": (_MVT_DATE, 0)}),
+
+    "kpi_sup_quality_conform_rate": (explicit_window(29), {"reception_fournisseur": (_REC_DATE, 0)}),
+    "kpi_sup_return_rate": (explicit_window(29), {"reception_fournisseur": (_REC_DATE, 0), "retour_fournisseur": (_RET_DATE, 0)}),
+    "rpc_sup_quality_conform_rate_series": (explicit_window(6), {"reception_fournisseur": (_REC_DATE, 29)}),
+    "rpc_sup_return_rate_series": (explicit_window(6), {"reception_fournisseur": (_REC_DATE, 29), "retour_fournisseur": (_RET_DATE, 29)}),
+}
+
+# (alias de la colonne date, début, fin) ou None = pas de filtre
+TableWindow = Optional[Tuple[Tuple[str, ...], date, date]]
+
+
+def needed_windows(rpcs, dependencies: Dict[str, List[str]]) -> Dict[str, TableWindow]:
+    """
+    Union, par table, des plages de dates nécessaires à un lot de RPC
+    (lookback compris). Dès qu'une RPC a besoin de tout l'historique d'une
+    table, ou que deux RPC filtrent sur des colonnes différentes -> None.
+    """
+    out: Dict[str, TableWindow] = {}
+    for rpc in rpcs:
+        resolver, per_table = WIDGET_DATE_WINDOWS.get(rpc.rpc_name, (None, {}))
+        window = resolver(rpc.params or {}) if resolver else None
+        for table in dependencies.get(rpc.rpc_name, []):
+            spec = per_table.get(table)
+            if window is None or spec is None:
+                out[table] = None
+                continue
+            aliases, lookback = spec
+            start, end = window[0] - timedelta(days=lookback), window[1]
+            if table not in out:
+                out[table] = (aliases, start, end)
+                continue
+            cur = out[table]
+            if cur is None or cur[0] != aliases:
+                out[table] = None
+            else:
+                out[table] = (aliases, min(cur[1], start), max(cur[2], end))
+    return out
+
+
+def month_slices(start: date, end: date) -> List[Tuple[date, date]]:
+    """Partitions mensuelles couvrant [start..end] (clés de cache réutilisables)."""
+    out = []
+    cur = start.replace(day=1)
+    while cur <= end:
+        nxt = (cur.replace(day=28) + timedelta(days=4)).replace(day=1)
+        out.append((cur, nxt - timedelta(days=1)))
+        cur = nxt
+    return out
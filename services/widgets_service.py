@@ -90,6 +90,7 @@ from services.fournisseur.chart import (
     rpc_sup_avg_lead_time_days_series,
     rpc_sup_transport_cost_ratio_series,
 )
+from services.stock.vectorized import stock_backend_rpcs
 
 
 RPC_PYTHON_MAP = {
@@ -159,3 +160,24 @@ RPC_PYTHON_MAP = {
     "prod_lead_time_of":       prod_lead_time_of,
     "prod_wip_op_en_cours":    prod_wip_op_en_cours,
 }
+
+# KPI/séries stock : backend NumPy si STOCK_COMPUTE_BACKEND=numpy (services/stock/vectorized.py)
+RPC_PYTHON_MAP.update(stock_backend_rpcs())
+
+
+# RPC additives sur une seule table : f({table: T}) == Σ f({table: page}).
+# Sur les tables déclarées en streaming (STREAMED_TABLES, vide par défaut :
+# le pliage est opt-in), elles sont calculées page par page sans matérialiser
+# la table.
+# Volontairement absentes : la consommation 30j (_conso_sorties_30j) n'est
+# pas une RPC mais une étape de kpi_days_on_hand, qui la divise par le stock
+# courant et déduit sa fenêtre des dates de plusieurs tables (non additif).
+# mouvement_stock y est déjà borné aux 30 jours utiles (WIDGET_DATE_WINDOWS).
+RPC_PAGE_FOLDS = {
+    "prod_volume_ok":        "sortie_production",
+    "prod_volume_nok":       "sortie_production",
+    "prod_volume_total":     "sortie_production",
+    "kpi_quantite_stock":    "stock",
+    "kpi_quantite_reservee": "stock",
+    "kpi_stock_disponible":  "stock",
+}
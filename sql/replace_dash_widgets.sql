@@ -0,0 +1,50 @@
+-- ============================================================
+-- replace_dash_widgets : remplacement atomique d'un tableau de bord
+-- ------------------------------------------------------------
+-- Appelée par post_widget (services/config_service.py) via supabase.rpc :
+-- suppression + insertion dans une seule transaction, un seul aller-retour.
+--   - verrou consultatif par (utilisateur, tableau de bord) : deux
+--     sauvegardes concurrentes s'exécutent l'une après l'autre, la seconde
+--     voit et remplace les lignes de la première (pas de doublons) ;
+--   - en cas d'échec rien n'est supprimé : l'ancien layout reste en place ;
+--   - p_widgets = [] vide le tableau de bord (comme avant).
+-- Retourne le nombre de widgets insérés.
+-- ============================================================
+
+create or replace function public.replace_dash_widgets(
+    p_user_id uuid,
+    p_dashboard text,
+    p_widgets jsonb
+)
+returns integer
+language plpgsql
+security invoker
+set search_path = public
+as $$
+declare
+    inserted integer;
+begin
+    perform pg_advisory_xact_lock(hashtext('dash_widgets:' || p_user_id::text || ':' || p_dashboard));
+
+    delete from dash_widgets
+    where user_id = p_user_id and dashboard = p_dashboard;
+
+    insert into dash_widgets (user_id, dashboard, widget_key, widget_type, x, y, w, h)
+    select p_user_id, p_dashboard, r.widget_key, r.widget_type, r.x, r.y, r.w, r.h
+    from jsonb_to_recordset(coalesce(p_widgets, '[]'::jsonb)) as r(
+        widget_key text,
+        widget_type text,
+        x double precision,
+        y double precision,
+        w double precision,
+        h double precision
+    );
+    get diagnostics inserted = row_count;
+
+    return inserted;
+end;
+$$;
+
+-- réservée au backend (clé service_role) : pas d'appel direct depuis un client
+revoke execute on function public.replace_dash_widgets(uuid, text, jsonb) from public, anon, authenticated;
+grant execute on function public.replace_dash_widgets(uuid, text, jsonb) to service_role;
@@ -0,0 +1,23 @@
+import asyncio
+from types import SimpleNamespace
+
+import redis
+
+import services.config_service as config_service
+
+
+class _DownRedis:
+    async def mget(self, *_):
+        raise redis.ConnectionError("Redis indisponible")
+
+
+def test_result_keys_skip_cache_when_redis_is_down(monkeypatch):
+    monkeypatch.setattr(config_service, "aredis_client", _DownRedis())
+    rpcs = [SimpleNamespace(rpc_name="kpi_quantite_stock", params={}),
+            SimpleNamespace(rpc_name="rpc_shrinkage_by_day", params={"start_date": "2025-03-01"})]
+    assert asyncio.run(config_service._result_keys(rpcs)) == [None, None]
+
+
+def test_read_results_treats_redis_errors_as_misses(monkeypatch):
+    monkeypatch.setattr(config_service, "aredis_client", _DownRedis())
+    assert asyncio.run(config_service._read_results(["rpc_result:absent"])) == {}
@@ -0,0 +1,115 @@
+from datetime import date, timedelta
+from types import SimpleNamespace
+
+import pytest
+
+from services.config_service import WIDGET_DEPENDENCIES, WIDGET_ROLLUPS, _rollup_plan
+from services.rollups import ROLLUPS, RollupUnavailable, rollup_for, rollup_from_tables, table_key, MVT_DAILY
+from services.table_store import ColumnarTable
+from services.widgets_service import RPC_PYTHON_MAP
+
+START, END = "2025-03-01", "2025-03-10"
+PARAMS = {"start_date": START, "end_date": END}
+
+
+def _day(n):
+    return (date(2025, 2, 1) + timedelta(days=n)).isoformat()
+
+
+@pytest.fixture
+def tables():
+    stock = [
+        {"id": 1, "produit_id": 10, "entrepot_id": 1, "quantitedisponible": 120, "quantitereserve": 20},
+        {"id": 2, "produit_id": 11, "entrepot_id": 2, "quantitedisponible": 80, "quantitereserve": 0},
+    ]
+    mvts = [
+        {"id": i, "stock_id": 1 + i % 2, "entrepot_id": 1 + i % 2, "produit_id": 10 + i % 2,
+         "typemouvement": "sortie" if i % 3 else "entree", "datemouvement": _day(i), "quantite": 3 + i % 5}
+        for i in range(40)
+    ]
+    cmds = [{"id": i, "date_reelle_livraison": _day(2 * i)} for i in range(20)]
+    lignes = [
+        {"id": i, "commande_id": i % 20, "produit_id": 10 + i % 2, "quantite_commandee": 1 + i % 4, "prix_unitaire": 9.5}
+        for i in range(60)
+    ]
+    produits = [{"id": 10, "prix": 9.5}, {"id": 11, "prix": 4.0}]
+    rows = {"stock": stock, "mouvement_stock": mvts, "commandeclient": cmds, "lignecommande": lignes, "produit": produits}
+    return {name: ColumnarTable.from_rows(r) for name, r in rows.items()}
+
+
+def _declared(tables, rpc_name, dependencies=WIDGET_DEPENDENCIES):
+    return {t: tables[t] for t in dependencies[rpc_name] if t in tables}
+
+
+@pytest.mark.parametrize("rpc_name", sorted(WIDGET_ROLLUPS))
+def test_rpc_runs_on_declared_tables_without_rollups(tables, rpc_name):
+    result = RPC_PYTHON_MAP[rpc_name](_declared(tables, rpc_name), **PARAMS)
+    assert isinstance(result, list) and len(result) == 10
+
+
+def test_stock_disponible_series_sees_movements(tables):
+    series = RPC_PYTHON_MAP["rpc_stock_disponible_series"](_declared(tables, "rpc_stock_disponible_series"), **PARAMS)
+    assert len({p["Disponible"] for p in series}) > 1
+
+
+@pytest.mark.parametrize("rpc_name", sorted(n for n in WIDGET_ROLLUPS if n in WIDGET_DEPENDENCIES))
+def test_rpc_served_by_rollups_matches_raw_tables(tables, rpc_name):
+    rpc = SimpleNamespace(rpc_name=rpc_name, params=PARAMS)
+    dependencies, spans = _rollup_plan([rpc], set(ROLLUPS))
+    served = _declared(tables, rpc_name, dependencies)
+    for name, (lo, hi) in spans.items():
+        served[table_key(name)] = rollup_from_tables(name, tables, lo, hi)
+    raw = RPC_PYTHON_MAP[rpc_name](_declared(tables, rpc_name), **PARAMS)
+    assert RPC_PYTHON_MAP[rpc_name](served, **PARAMS) == raw
+
+
+def test_rollup_for_falls_back_when_not_planned(tables):
+    assert rollup_for({}, MVT_DAILY, date(2025, 3, 1), date(2025, 3, 10)) is None
+
+
+def test_rollup_for_raises_when_planned_rollup_is_short(tables):
+    short = rollup_from_tables(MVT_DAILY, tables, date(2025, 3, 5), date(2025, 3, 10))
+    with pytest.raises(RollupUnavailable):
+        rollup_for({table_key(MVT_DAILY): short}, MVT_DAILY, date(2025, 3, 1), date(2025, 3, 10))
+    # tables brutes chargées (autre RPC du lot) : repli sans erreur
+    assert rollup_for({table_key(MVT_DAILY): short, **tables}, MVT_DAILY, date(2025, 3, 1), date(2025, 3, 10)) is None
+
+
+def test_shrinkage_rounds_once_on_both_paths(tables):
+    mvts = [
+        {"id": i, "stock_id": 1, "entrepot_id": 1, "produit_id": 10, "typemouvement": "perte",
+         "datemouvement": "2025-03-0%d" % (1 + i % 3), "quantite": 0.004}
+        for i in range(30)
+    ]
+    raw = {"stock": tables["stock"], "mouvement_stock": ColumnarTable.from_rows(mvts)}
+    rollup = rollup_from_tables(MVT_DAILY, raw, date(2025, 3, 1), date(2025, 3, 10))
+    served = {"stock": tables["stock"], table_key(MVT_DAILY): rollup}
+    expected = RPC_PYTHON_MAP["rpc_shrinkage_by_day"](raw, **PARAMS)
+    assert expected[0]["Quantité"] == 0.04
+    assert RPC_PYTHON_MAP["rpc_shrinkage_by_day"](served, **PARAMS) == expected
+
+
+def test_rebuild_replaces_rollup_in_one_transaction(tables, monkeypatch):
+    fakeredis = pytest.importorskip("fakeredis")
+    from services.rollups import read_rollup, rebuild_rollup, ready_key
+
+    client = fakeredis.FakeRedis(decode_responses=True)
+    lo, hi = date(2025, 2, 1), date(2025, 3, 20)
+    rebuild_rollup(client, MVT_DAILY, tables)
+    assert read_rollup(client, MVT_DAILY, lo, hi).rows.to_rows() == rollup_from_tables(MVT_DAILY, tables, lo, hi).rows.to_rows()
+
+    # reconstruction sur moins de lignes : un seul EXEC, les anciens jours disparaissent
+    pipeline_cls = type(client.pipeline())
+    executed = []
+    execute = pipeline_cls.execute
+
+    def spy(pipe, *args, **kwargs):
+        executed.append(pipe.transaction)
+        return execute(pipe, *args, **kwargs)
+
+    monkeypatch.setattr(pipeline_cls, "execute", spy)
+    fewer = {"mouvement_stock": ColumnarTable.from_rows(tables["mouvement_stock"].to_rows()[:5])}
+    rebuild_rollup(client, MVT_DAILY, fewer)
+    assert executed == [True]
+    assert read_rollup(client, MVT_DAILY, lo, hi).rows.to_rows() == rollup_from_tables(MVT_DAILY, fewer, lo, hi).rows.to_rows()
+    assert client.ttl(ready_key(MVT_DAILY)) > 0
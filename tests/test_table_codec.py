@@ -0,0 +1,96 @@
+import pytest
+
+from services import table_codec
+from services.table_codec import decode_table, delete_blob, encode_table, read_blobs, read_blobs_with_heads, write_blob
+from services.table_store import ColumnarTable, KIND_DATE, KIND_FLOAT, KIND_INT, KIND_OBJ
+
+ROWS = [
+    {"id": 1, "prix": 2.5, "date": "2025-03-01", "nom": "Doliprane", "actif": True, "meta": {"lot": "A"}},
+    {"id": 2, "prix": None, "date": None, "nom": None, "actif": False, "meta": None},
+    {"id": None, "prix": -0.125, "date": "2024-12-31", "nom": "é", "actif": None, "meta": [1, 2]},
+]
+
+
+@pytest.fixture
+def client():
+    fakeredis = pytest.importorskip("fakeredis")
+    return fakeredis.FakeRedis()
+
+
+def _big_table(n=2000):
+    return ColumnarTable.from_rows(
+        [{"id": i, "quantite": i * 1.5, "datemouvement": "2025-03-%02d" % (1 + i % 28), "ref": "r%d" % i}
+         for i in range(n)]
+    )
+
+
+@pytest.mark.parametrize("compress", [False, True])
+def test_round_trip_keeps_nulls_and_kinds(compress, monkeypatch):
+    monkeypatch.setattr(table_codec, "TABLE_COMPRESS_MIN_BYTES", 0)
+    table = ColumnarTable.from_rows(ROWS)
+    assert [table.kind(n) for n in ("id", "prix", "date", "nom", "actif", "meta")] == [
+        KIND_INT, KIND_FLOAT, KIND_DATE, KIND_OBJ, KIND_OBJ, KIND_OBJ,
+    ]
+    decoded = decode_table(encode_table(table, compress=compress))
+    assert decoded.to_rows() == ROWS
+    assert {n: decoded.kind(n) for n in decoded.columns} == {n: table.kind(n) for n in table.columns}
+
+
+def test_round_trip_empty_table_and_legacy_json():
+    assert decode_table(encode_table(ColumnarTable.from_rows([]))).length == 0
+    assert decode_table('[{"id": 1, "nom": "x"}]').to_rows() == [{"id": 1, "nom": "x"}]
+
+
+def test_chunked_blob_reassembles(client, monkeypatch):
+    monkeypatch.setattr(table_codec, "TABLE_CHUNK_BYTES", 1024)
+    table = _big_table()
+    blob = encode_table(table)
+    assert len(blob) > 3 * 1024
+    pipe = client.pipeline()
+    write_blob(pipe, "table_cache:t", blob, 60)
+    pipe.execute()
+    assert len(client.keys("table_chunk:table_cache:t:*")) == -(-len(blob) // 1024)
+    assert read_blobs(client, ["table_cache:t", "table_cache:absente"]) == [blob, None]
+    assert decode_table(read_blobs(client, ["table_cache:t"])[0]).to_rows() == table.to_rows()
+    assert 0 < client.ttl("table_cache:t") <= 60
+
+
+def test_rewrite_retires_previous_chunks(client, monkeypatch):
+    monkeypatch.setattr(table_codec, "TABLE_CHUNK_BYTES", 1024)
+    pipe = client.pipeline()
+    write_blob(pipe, "table_cache:t", encode_table(_big_table()), 600)
+    pipe.execute()
+    old_chunks = client.keys("table_chunk:table_cache:t:*")
+    _, heads = read_blobs_with_heads(client, ["table_cache:t"])
+
+    smaller = encode_table(_big_table(1500))
+    pipe = client.pipeline()
+    write_blob(pipe, "table_cache:t", smaller, 600, previous=heads[0])
+    pipe.execute()
+    assert read_blobs(client, ["table_cache:t"]) == [smaller]
+    # anciens morceaux : encore lisibles le temps du délai de grâce, puis expirés
+    assert all(0 < client.ttl(k) <= table_codec.TABLE_CHUNK_GRACE for k in old_chunks)
+
+    _, heads = read_blobs_with_heads(client, ["table_cache:t"])
+    pipe = client.pipeline()
+    delete_blob(pipe, "table_cache:t", previous=heads[0])
+    pipe.execute()
+    assert read_blobs(client, ["table_cache:t"]) == [None]
+    assert all(client.ttl(k) <= table_codec.TABLE_CHUNK_GRACE for k in client.keys("table_chunk:*"))
+
+
+def test_missing_chunk_reads_as_absent(client, monkeypatch):
+    monkeypatch.setattr(table_codec, "TABLE_CHUNK_BYTES", 1024)
+    pipe = client.pipeline()
+    write_blob(pipe, "table_cache:t", encode_table(_big_table()), 60)
+    pipe.execute()
+    client.delete(sorted(client.keys("table_chunk:*"))[0])
+    assert read_blobs(client, ["table_cache:t"]) == [None]
+
+
+def test_remaining_ttl_keeps_deadline(client):
+    client.setex("table_cache:t", 30, b"x")
+    assert 0 < table_codec.remaining_ttl(client, "table_cache:t", 600) <= 30
+    client.set("table_cache:sans_ttl", b"x")
+    assert table_codec.remaining_ttl(client, "table_cache:sans_ttl", 600) == 600
+    assert table_codec.remaining_ttl(client, "table_cache:absente", 600) == 600
@@ -0,0 +1,49 @@
+from types import SimpleNamespace
+
+import services.config_service as config_service
+from services.compute_graph import request_scope
+
+
+class _Query:
+    """Requête PostgREST factice : enregistre les appels, sert les pages depuis rows."""
+
+    def __init__(self, rows, calls):
+        self.rows, self.calls, self.window = rows, calls, None
+
+    def select(self, *_):
+        return self
+
+    def order(self, column):
+        self.calls.append(("order", column))
+        return self
+
+    def range(self, lo, hi):
+        self.window = (lo, hi)
+        return self
+
+    def execute(self):
+        lo, hi = self.window
+        ordered = sorted(self.rows, key=lambda r: tuple(r[c] for c in sorted(r)))
+        return SimpleNamespace(data=ordered[lo:hi + 1])
+
+
+def test_offset_pages_are_ordered_on_every_column(monkeypatch):
+    rows = [{"a": i % 3, "b": i} for i in range(7)]
+    calls = []
+    monkeypatch.setattr(config_service, "_table_columns", lambda table: ["a", "b"])
+    monkeypatch.setattr(config_service, "TABLE_PAGE_SIZE", 3)
+    monkeypatch.setattr(config_service, "supabase", SimpleNamespace(table=lambda t: _Query(rows, calls)))
+    pages = list(config_service._iter_table_pages("sans_id"))
+    assert [len(p) for p in pages] == [3, 3, 1]
+    assert sorted(r["b"] for p in pages for r in p) == list(range(7))
+    assert ("order", "a") in calls and ("order", "b") in calls
+
+
+def test_fold_keeps_no_page_in_request_scope(monkeypatch):
+    pages = [[{"id": p * 10 + i, "quantitedisponible": 1, "quantitereserve": 0} for i in range(10)] for p in range(5)]
+    monkeypatch.setattr(config_service, "_iter_table_pages", lambda table, columns=None: iter(pages))
+    store = {}
+    with request_scope(store):
+        total = config_service.fold_table_pages(SimpleNamespace(rpc_name="kpi_stock_disponible", params={}))
+    assert total == 50
+    assert store == {}
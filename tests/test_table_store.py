@@ -0,0 +1,43 @@
+from services.table_codec import decode_table, encode_table
+from services.table_store import ColumnarTable, KIND_FLOAT, KIND_INT, KIND_OBJ
+
+
+def test_mixed_int_float_column_keeps_ints():
+    rows = [{"quantite": 12}, {"quantite": 2.5}, {"quantite": None}, {"quantite": 3}]
+    table = ColumnarTable.from_rows(rows)
+    assert table.kind("quantite") == KIND_OBJ
+    assert table.to_rows() == rows
+    assert [type(r["quantite"]) for r in table.to_rows()] == [int, float, type(None), int]
+    assert [type(r["quantite"]) for r in decode_table(encode_table(table)).to_rows()] == [int, float, type(None), int]
+
+
+def test_concat_of_int_and_float_slices_keeps_ints():
+    table = ColumnarTable.concat([
+        ColumnarTable.from_rows([{"id": 1, "quantite": 4}]),
+        ColumnarTable.from_rows([{"id": 2, "quantite": 0.5}]),
+    ])
+    assert table.kind("id") == KIND_INT
+    assert table.to_rows() == [{"id": 1, "quantite": 4}, {"id": 2, "quantite": 0.5}]
+    assert type(table[0]["quantite"]) is int
+
+
+def test_homogeneous_columns_stay_typed():
+    table = ColumnarTable.from_rows([{"a": 1, "b": 1.0}, {"a": None, "b": None}])
+    assert (table.kind("a"), table.kind("b")) == (KIND_INT, KIND_FLOAT)
+
+
+def test_upsert_keeps_updated_rows_in_place():
+    base = ColumnarTable.from_rows([{"id": i, "statut": "a"} for i in range(1, 5)])
+    delta = ColumnarTable.from_rows([{"id": 3, "statut": "b"}, {"id": 9, "statut": "n"}, {"id": 1, "statut": "b"}])
+    assert [(r["id"], r["statut"]) for r in base.upsert(delta)] == [
+        (1, "b"), (2, "a"), (3, "b"), (4, "a"), (9, "n"),
+    ]
+
+
+def test_upsert_duplicate_keys_take_last_and_append_only_new():
+    base = ColumnarTable.from_rows([{"id": 1, "v": 0}, {"id": 2, "v": 0}])
+    delta = ColumnarTable.from_rows([{"id": 2, "v": 1}, {"id": 5, "v": 1}, {"id": 2, "v": 2}, {"id": 5, "v": 2}])
+    assert base.upsert(delta).to_rows() == [{"id": 1, "v": 0}, {"id": 2, "v": 2}, {"id": 5, "v": 2}]
+    inserts = ColumnarTable.from_rows([{"id": 3, "v": 1}])
+    assert base.upsert(inserts).to_rows() == [{"id": 1, "v": 0}, {"id": 2, "v": 0}, {"id": 3, "v": 1}]
+    assert base.upsert(ColumnarTable.from_rows([])) is base